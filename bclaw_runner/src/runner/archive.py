@@ -0,0 +1,133 @@
+from contextlib import closing
+import json
+import logging
+import os
+import tarfile
+import threading
+
+from .codec import CompressingReader, decompressing_reader, CODEC_METADATA_KEY
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_METADATA_KEY = "bclaw_archive"
+ARCHIVE_FORMATS = ("tar",)
+# archive indexes go in a folder of their own next to the archive, which repo globs skip
+INDEX_DIR = "_archive_index_"
+
+
+def index_key(archive_key: str) -> str:
+    """
+    Returns the key of the index of the archive at archive_key, e.g. path/to/_archive_index_/archive.json
+    """
+    head, sep, name = archive_key.rpartition("/")
+    return f"{head}{sep}{INDEX_DIR}/{name}.json"
+
+
+def is_index_key(key: str) -> bool:
+    return INDEX_DIR in key.split("/")[:-1]
+
+
+def _members(local_dir: str):
+    for root, dirs, files in os.walk(local_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            path = os.path.join(root, filename)
+            yield path, os.path.relpath(path, local_dir)
+
+
+def _write_tar(fp, local_dir: str, index: list) -> None:
+    with tarfile.open(fileobj=fp, mode="w|", format=tarfile.PAX_FORMAT) as tar:
+        for path, arcname in _members(local_dir):
+            tarinfo = tar.gettarinfo(path, arcname)
+            if tarinfo.isreg():
+                with open(path, "rb") as member_fp:
+                    tar.addfile(tarinfo, member_fp)
+                # the member's data ends at the current offset, padded out to a full block
+                padded_size = -(-tarinfo.size // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+                index.append({"name": arcname, "offset": tar.offset - padded_size, "size": tarinfo.size})
+            else:
+                tar.addfile(tarinfo)
+
+
+def upload_archive(s3_obj, index_obj, local_dir: str, extra_args: dict, codec: str = None) -> int:
+    """
+    Streams the contents of local_dir to s3_obj as a single tar archive, optionally compressed, and
+    writes a JSON index of the archive's members (name, offset and size of the data in the
+    uncompressed archive) to index_obj. Returns the number of files archived.
+    """
+    metadata = extra_args.get("Metadata", {}) | {ARCHIVE_METADATA_KEY: "tar"}
+    if codec is not None:
+        metadata[CODEC_METADATA_KEY] = codec
+    extra_args = extra_args | {"Metadata": metadata}
+
+    index = []
+    errors = []
+    read_fd, write_fd = os.pipe()
+
+    def _writer():
+        try:
+            with os.fdopen(write_fd, "wb") as fp:
+                _write_tar(fp, local_dir, index)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=_writer, daemon=True)
+    thread.start()
+    try:
+        with os.fdopen(read_fd, "rb") as fp:
+            source = fp if codec is None else CompressingReader(fp, codec)
+            s3_obj.upload_fileobj(source, ExtraArgs=extra_args)
+    finally:
+        thread.join()
+
+    if errors:
+        # the upload finished with a truncated archive, don't leave it lying around
+        s3_obj.delete()
+        raise errors[0]
+
+    index_obj.put(Body=json.dumps({"format": "tar", "codec": codec, "members": index}).encode("utf-8"),
+                  ServerSideEncryption="AES256",
+                  Tagging="bclaw.system=true")
+    return len(index)
+
+
+def extract_archive(s3_obj, dest_dir: str) -> None:
+    """
+    Unpacks an archive created by upload_archive into dest_dir while it downloads.
+    """
+    codec = s3_obj.metadata.get(CODEC_METADATA_KEY)
+    with closing(s3_obj.get()["Body"]) as body:
+        source = body if codec is None else decompressing_reader(body, codec)
+        with tarfile.open(fileobj=source, mode="r|") as tar:
+            tar.extractall(dest_dir, filter="data")
+
+
+def download_member(s3_obj, member: str, dest: str) -> None:
+    """
+    Downloads a single member of an archive created by upload_archive. Uses a byte range request for
+    uncompressed archives; compressed ones have to be read from the beginning.
+    """
+    index_obj = s3_obj.Bucket().Object(index_key(s3_obj.key))
+    with closing(index_obj.get()["Body"]) as fp:
+        index = json.load(fp)
+
+    entry = next((m for m in index["members"] if m["name"] == member), None)
+    if entry is None:
+        raise FileNotFoundError(f"s3://{s3_obj.bucket_name}/{s3_obj.key}#{member}")
+
+    if index["codec"] is None:
+        with open(dest, "wb") as fp:
+            if entry["size"] > 0:
+                start, end = entry["offset"], entry["offset"] + entry["size"] - 1
+                with closing(s3_obj.get(Range=f"bytes={start}-{end}")["Body"]) as body:
+                    for chunk in body.iter_chunks(1024 ** 2):
+                        fp.write(chunk)
+    else:
+        with closing(s3_obj.get()["Body"]) as body, \
+                tarfile.open(fileobj=decompressing_reader(body, index["codec"]), mode="r|") as tar:
+            for tarinfo in tar:
+                if tarinfo.name == member:
+                    with tar.extractfile(tarinfo) as src, open(dest, "wb") as fp:
+                        while chunk := src.read(1024 ** 2):
+                            fp.write(chunk)
+                    break
@@ -7,6 +7,8 @@ from typing import Dict, Tuple
 import backoff
 import boto3
 
+from .web import WebObject, is_url
+
 
 logger = logging.getLogger(__name__)
 logging.getLogger("backoff").setLevel(logging.ERROR)
@@ -24,17 +26,27 @@ def _blocking_download(s3_object, dest_path: str, name_for_logging: str) -> None
     else:
         logger.debug(f"acquiring a lock on {name_for_logging}")
         lock_path = f"{os.path.dirname(dest_path)}.lock"
-        with open(lock_path, "w") as lfp:
-            fcntl.flock(lfp, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            logger.debug(f"lock acquired for {name_for_logging}")
-            s3_size = s3_object.content_length
-            logger.info(f"downloading {name_for_logging} ({s3_size} bytes) to cache")
-            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
-            s3_object.download_file(dest_path)
-            local_size = os.path.getsize(dest_path)
-            logger.info(f"{name_for_logging} ({s3_size} bytes) downloaded to cache ({local_size} bytes)")
-            logger.debug(f"releasing lock on {name_for_logging}")
-            fcntl.flock(lfp, fcntl.LOCK_UN)
+        try:
+            with open(lock_path, "w") as lfp:
+                fcntl.flock(lfp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                logger.debug(f"lock acquired for {name_for_logging}")
+                s3_size = s3_object.content_length
+                logger.info(f"downloading {name_for_logging} ({s3_size} bytes) to cache")
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                s3_object.download_file(dest_path)
+                local_size = os.path.getsize(dest_path)
+                logger.info(f"{name_for_logging} ({s3_size} bytes) downloaded to cache ({local_size} bytes)")
+                logger.debug(f"releasing lock on {name_for_logging}")
+                fcntl.flock(lfp, fcntl.LOCK_UN)
+        except BlockingIOError:
+            # someone else holds the lock and will clean up after themselves
+            raise
+        except BaseException:
+            # don't let a failed download look like a cache hit to the next job
+            if os.path.isfile(dest_path):
+                os.remove(dest_path)
+            os.remove(lock_path)
+            raise
         os.remove(lock_path)
 
 
@@ -48,16 +60,26 @@ def _download_loop(s3_object, dest_path: str, *, name_for_logging: str) -> None:
 
 
 def _download_to_cache(item: Tuple[str, str]) -> Tuple[str, str]:
-    session = boto3.Session()
+    key, src_path = item
 
-    key, s3_path = item
-    s3_bucket, s3_key = s3_path.split("/", 3)[2:]
-    src = session.resource("s3").Object(s3_bucket, s3_key)
+    if is_url(src_path):
+        src = WebObject(src_path)
+        src_etag = src.cache_tag
+        file_name = src.name
 
-    cache_path = os.environ["BC_SCRATCH_PATH"]
-    src_etag = src.e_tag.strip('"')  # ETag comes wrapped in double quotes for some reason
-    file_name = os.path.basename(s3_key)
+        if src_etag is None:
+            logger.warning(f"{src_path} has no ETag or Last-Modified header, downloading without caching")
+            src.download_file(file_name)
+            return key, file_name
 
+    else:
+        session = boto3.Session()
+        s3_bucket, s3_key = src_path.split("/", 3)[2:]
+        src = session.resource("s3").Object(s3_bucket, s3_key)
+        src_etag = src.e_tag.strip('"')  # ETag comes wrapped in double quotes for some reason
+        file_name = os.path.basename(s3_key)
+
+    cache_path = os.environ["BC_SCRATCH_PATH"]
     cached_file = f"{cache_path}/{src_etag}/{file_name}"
 
     _download_loop(src, cached_file, name_for_logging=file_name)
@@ -76,7 +98,8 @@ def get_reference_inputs(ref_spec: Dict[str, str]) -> Dict[str, str]:
 
         for key, src in result:
             dst = ret[key] = os.path.basename(src)
-            logger.info(f"linking cached {dst} to workspace")
-            os.link(src, dst)
+            if src != dst:
+                logger.info(f"linking cached {dst} to workspace")
+                os.link(src, dst)
 
     return ret
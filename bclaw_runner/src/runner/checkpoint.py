@@ -0,0 +1,135 @@
+from contextlib import closing, nullcontext
+import glob as g
+import json
+import logging
+import os
+import signal
+import time
+
+import boto3
+
+from .dind import signal_child_container
+from .instance import on_spot_termination
+from .repo import Repository
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_REQUEST_FILE = "_bclaw_checkpoint"
+UPLOADS_RECORD = "_multipart_uploads.json"
+
+
+class Checkpoint(object):
+    """
+    Saves the state of a step to the repository when a spot termination notice arrives, and
+    restores it when the step is retried.
+
+    Does nothing if the checkpoint spec is empty.
+
+    checkpoint spec (from the compiler):
+        files:  list of local file names or globs to save
+        signal: name of a signal to send to the user commands, e.g. SIGUSR1 (optional)
+        wait:   seconds to wait for the commands to write their checkpoint files
+    """
+    def __init__(self, repo: Repository, spec: dict, tags: dict):
+        self.repo = repo
+        self.spec = spec
+        self.tags = tags
+        # a retry is a new Batch job, so key the checkpoint on the execution instead. The repo already
+        # distinguishes scatter branches
+        self.prefix = repo.qualify(f"_checkpoint_/{os.environ['BC_STEP_NAME']}/{os.environ.get('BC_EXECUTION_ID', 'none')}")
+
+    def _upload_args(self) -> dict:
+        return {"ServerSideEncryption": "AES256", "Tagging": "bclaw.system=true"}
+
+    def _record_multipart_uploads(self, s3_client, outputs: dict) -> None:
+        # only this step's own outputs: other steps and scatter branches may be writing to the same places
+        targets = set(self.repo.output_destinations(outputs))
+        prefixes = {(bucket, key.rsplit("/", 1)[0] + "/" if "/" in key else "") for bucket, key in targets}
+
+        uploads = []
+        for bucket, prefix in prefixes:
+            paginator = s3_client.get_paginator("list_multipart_uploads")
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                uploads += [{"Bucket": bucket, "Key": u["Key"], "UploadId": u["UploadId"]}
+                            for u in page.get("Uploads", []) if (bucket, u["Key"]) in targets]
+
+        s3_client.put_object(Bucket=self.repo.bucket, Key=f"{self.prefix}/{UPLOADS_RECORD}",
+                             Body=json.dumps(uploads).encode("utf-8"), **self._upload_args())
+        logger.info(f"recorded {len(uploads)} in-progress multipart uploads")
+
+    def save(self, work_dir: str, outputs: dict) -> None:
+        logger.warning("saving checkpoint")
+
+        with open(os.path.join(work_dir, CHECKPOINT_REQUEST_FILE), "w"):
+            pass
+        if self.spec.get("signal"):
+            signal_child_container(work_dir, signal.Signals[self.spec["signal"]])
+
+        # give the commands a chance to write out their checkpoint files
+        time.sleep(self.spec.get("wait", 60))
+
+        s3_client = boto3.client("s3")
+        try:
+            self.repo.upload_outputs(outputs, self.tags)
+        except Exception:
+            logger.exception("failed to upload outputs: ")
+
+        count = 0
+        for pattern in self.spec.get("files", []):
+            for filename in g.glob(pattern, root_dir=work_dir, recursive=True):
+                local_file = os.path.join(work_dir, filename)
+                if os.path.isfile(local_file):
+                    s3_client.upload_file(local_file, self.repo.bucket, f"{self.prefix}/{os.path.normpath(filename)}",
+                                          ExtraArgs=self._upload_args())
+                    count += 1
+        logger.info(f"saved {count} checkpoint files")
+
+        self._record_multipart_uploads(s3_client, outputs)
+
+    def restore(self, work_dir: str) -> None:
+        if not self.spec:
+            return
+
+        s3_client = boto3.client("s3")
+        paginator = s3_client.get_paginator("list_objects_v2")
+
+        count = 0
+        for page in paginator.paginate(Bucket=self.repo.bucket, Prefix=f"{self.prefix}/"):
+            for obj in page.get("Contents", []):
+                rel_path = obj["Key"][len(self.prefix) + 1:]
+
+                if rel_path == UPLOADS_RECORD:
+                    # the managed uploads that started these can't pick up where they left off, so
+                    # clean them up instead of leaving orphaned parts around
+                    response = s3_client.get_object(Bucket=self.repo.bucket, Key=obj["Key"])
+                    with closing(response["Body"]) as fp:
+                        uploads = json.load(fp)
+                    for upload in uploads:
+                        try:
+                            s3_client.abort_multipart_upload(**upload)
+                        except Exception:
+                            logger.warning(f"unable to abort multipart upload of {upload['Key']}")
+                    continue
+
+                local_file = os.path.join(work_dir, rel_path)
+                os.makedirs(os.path.dirname(local_file), exist_ok=True)
+                s3_client.download_file(self.repo.bucket, obj["Key"], local_file)
+                count += 1
+
+        if count > 0:
+            logger.info(f"restored {count} checkpoint files")
+
+    def clear(self) -> None:
+        if not self.spec:
+            return
+
+        try:
+            s3 = boto3.resource("s3")
+            s3.Bucket(self.repo.bucket).objects.filter(Prefix=f"{self.prefix}/").delete()
+        except Exception:
+            logger.warning("unable to clear checkpoint")
+
+    def armed(self, work_dir: str, outputs: dict):
+        if not self.spec:
+            return nullcontext()
+        return on_spot_termination(lambda: self.save(work_dir, outputs))
@@ -0,0 +1,81 @@
+from contextlib import closing
+import gzip
+import io
+import logging
+import shutil
+import zlib
+
+try:
+    from compression import zstd
+except ImportError:
+    # zstd is in the standard library as of Python 3.14
+    zstd = None
+
+logger = logging.getLogger(__name__)
+
+CODECS = ("gzip", "zstd")
+CODEC_METADATA_KEY = "bclaw_codec"
+CHUNK_SIZE = 1024 ** 2
+
+
+def _zstd():
+    if zstd is None:
+        raise RuntimeError("zstd compression requires Python 3.14 or later")
+    return zstd
+
+
+def _compressor(codec: str):
+    if codec == "gzip":
+        return zlib.compressobj(wbits=31)
+    if codec == "zstd":
+        return _zstd().ZstdCompressor()
+    raise ValueError(f"unsupported compression codec: {codec}")
+
+
+class CompressingReader(io.RawIOBase):
+    """
+    Wraps a readable binary file object; reading from this returns the compressed contents of
+    the wrapped file. Suitable for passing to upload_fileobj.
+    """
+    def __init__(self, raw, codec: str):
+        self.raw = raw
+        self.compressor = _compressor(codec)
+        self.buffer = b""
+        self.eof = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        while len(self.buffer) < len(b) and not self.eof:
+            chunk = self.raw.read(CHUNK_SIZE)
+            if chunk:
+                self.buffer += self.compressor.compress(chunk)
+            else:
+                self.buffer += self.compressor.flush()
+                self.eof = True
+
+        n = min(len(b), len(self.buffer))
+        b[:n] = self.buffer[:n]
+        self.buffer = self.buffer[n:]
+        return n
+
+
+def decompressing_reader(raw, codec: str):
+    """
+    Wraps a readable binary file object; reading from this returns the decompressed contents of
+    the wrapped file.
+    """
+    if codec == "gzip":
+        return gzip.GzipFile(fileobj=raw, mode="rb")
+    if codec == "zstd":
+        return _zstd().ZstdFile(raw, mode="rb")
+    raise ValueError(f"unsupported compression codec: {codec}")
+
+
+def decompress_to_file(body, dest: str, codec: str) -> None:
+    """
+    Streams the compressed contents of an S3 object body into an uncompressed local file.
+    """
+    with closing(body), decompressing_reader(body, codec) as src, open(dest, "wb") as fp:
+        shutil.copyfileobj(src, fp, CHUNK_SIZE)
@@ -4,12 +4,13 @@ import json
 import logging
 import os
 import re
+import signal
 from typing import Generator
 
 import boto3
 import docker
 from docker.models.images import Image
-from docker.types import DeviceRequest, DriverConfig, Mount
+from docker.types import DeviceRequest, DriverConfig, Mount, Ulimit
 import requests
 
 from .signal_trapper import signal_trapper
@@ -25,6 +26,8 @@ user_cmd_logger.propagate = False
 
 # https://docker-py.readthedocs.io/en/stable/index.html
 
+WORKSPACE_LABEL = "bclaw.workspace"
+
 
 def get_gpu_requests() -> list:
     if "NVIDIA_VISIBLE_DEVICES" in os.environ:
@@ -85,6 +88,14 @@ def get_mounts(metadata: dict, parent_workspace: str, child_workspace: str) -> G
                         driver_config=DriverConfig("amazon-ecs-volume-plugin"))
 
 
+def get_container_limits(limits: dict) -> dict:
+    # limits is produced by the compiler; keys other than ulimits are docker-py keyword arguments
+    ret = {k: v for k, v in limits.items() if k != "ulimits"}
+    if "ulimits" in limits:
+        ret["ulimits"] = [Ulimit(**u) for u in limits["ulimits"]]
+    return ret
+
+
 def get_environment_vars() -> dict:
     # copy all environment variables starting with AWS_ or BC_ to the child container
     ret = {k: v for k, v in os.environ.items() if re.match(r"^(?:AWS|BC)_.*", k)}
@@ -126,7 +137,8 @@ def pull_image(docker_client: docker.DockerClient, image_spec: dict) -> Image:
     return ret
 
 
-def run_child_container(image_spec: dict, command: str, parent_workspace: str, parent_job_data_file: str) -> int:
+def run_child_container(image_spec: dict, command: str, parent_workspace: str, parent_job_data_file: str,
+                        limits: dict) -> int:
     child_workspace = os.environ["BC_SCRATCH_PATH"]
 
     parent_metadata = get_container_metadata()
@@ -139,6 +151,9 @@ def run_child_container(image_spec: dict, command: str, parent_workspace: str, p
     environment["BC_JOB_DATA_FILE"] = os.path.join(child_workspace, os.path.basename(parent_job_data_file))
 
     device_requests = get_gpu_requests()
+    container_limits = get_container_limits(limits)
+    if container_limits:
+        logger.info(f"container limits: {limits}")
 
     exit_code = 255
     with closing(docker.client.from_env()) as docker_client:
@@ -152,10 +167,12 @@ def run_child_container(image_spec: dict, command: str, parent_workspace: str, p
                                                  entrypoint=[],
                                                  environment=environment,
                                                  init=True,
+                                                 labels={WORKSPACE_LABEL: parent_workspace},
                                                  mem_limit=mem_limit,
                                                  mounts=mounts,
                                                  version="auto",
-                                                 working_dir=child_workspace)
+                                                 working_dir=child_workspace,
+                                                 **container_limits)
         with signal_trapper(container):
             try:
                 with closing(container.logs(stream=True)) as fp:
@@ -175,3 +192,10 @@ def run_child_container(image_spec: dict, command: str, parent_workspace: str, p
                 exit_code = response.get("StatusCode", 1)
                 logger.info(f"{exit_code=}")
     return exit_code
+
+
+def signal_child_container(parent_workspace: str, sig: int) -> None:
+    with closing(docker.client.from_env()) as docker_client:
+        for container in docker_client.containers.list(filters={"label": f"{WORKSPACE_LABEL}={parent_workspace}"}):
+            logger.warning(f"sending {signal.Signals(sig).name} to user commands")
+            container.kill(signal=sig)
@@ -2,7 +2,7 @@ from contextlib import contextmanager
 import logging
 import os
 import threading
-from typing import Generator
+from typing import Callable, Generator
 
 import backoff
 import boto3
@@ -13,6 +13,8 @@ logger = logging.getLogger(__name__)
 METADATA_HOME = "169.254.169.254"
 TOKEN = None
 
+_termination_handlers = []
+
 
 @backoff.on_exception(backoff.constant, requests.exceptions.RequestException,
                       max_tries=3, interval=1, raise_on_giveup=False)
@@ -51,7 +53,7 @@ def _this_is_a_spot_instance() -> bool:
         return False
 
 
-def _do_termination_check() -> None:
+def _do_termination_check() -> bool:
     """Checks if the spot instance is scheduled for termination."""
     response = requests.get(
         f"http://{METADATA_HOME}/latest/meta-data/spot/instance-action",
@@ -60,6 +62,7 @@ def _do_termination_check() -> None:
     )
     if response.status_code == 200:
         logger.warning(f"spot instance will be terminated at {response.json()['time']}")
+        return True
     elif response.status_code == 401:
         # token might be invalid or expired, go get a new one
         # don't bother retrying the request, we'll just check again on the next interval
@@ -70,14 +73,27 @@ def _do_termination_check() -> None:
     else:
         # raise for other errors
         response.raise_for_status()
+    return False
+
+
+def _handle_termination() -> None:
+    """Calls the registered termination handlers."""
+    for handler in list(_termination_handlers):
+        try:
+            handler()
+        except Exception:
+            logger.exception("termination handler failed: ")
 
 
 def _termination_checker_impl(event, interval) -> None:
     """Runs the termination check in a loop."""
+    handled = False
     while not event.is_set():
         try:
             logger.debug("checking instance metadata")
-            _do_termination_check()
+            if _do_termination_check() and not handled:
+                handled = True
+                _handle_termination()
         except Exception as e:
             logger.warning(f"termination check failed: {str(e)}")
         finally:
@@ -85,6 +101,16 @@ def _termination_checker_impl(event, interval) -> None:
     logger.debug("exiting checker thread")
 
 
+@contextmanager
+def on_spot_termination(handler: Callable[[], None]) -> Generator[None, None, None]:
+    """Registers a function to be called if a spot termination notice arrives while the context is active."""
+    _termination_handlers.append(handler)
+    try:
+        yield
+    finally:
+        _termination_handlers.remove(handler)
+
+
 @contextmanager
 def spot_termination_checker(interval=30) -> Generator[None, None, None]:
     """Context manager for the spot termination checker."""
@@ -0,0 +1,245 @@
+from contextlib import closing, contextmanager
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import os
+import re
+import threading
+import time
+from typing import Dict, Generator
+from urllib.parse import quote, unquote
+
+from .dind import get_container_metadata
+
+logger = logging.getLogger(__name__)
+
+BLOCK_DIR = "_bclaw_blocks"
+BLOCK_SIZE = 8 * 1024 ** 2
+BLOCK_MAX_AGE_SECONDS = 24 * 60 * 60
+BLOCK_CACHE_MAX_BYTES = 32 * 1024 ** 3
+# how many bytes of new blocks a job writes between checks of the cache size
+EVICTION_INTERVAL_BYTES = 1024 ** 3
+
+range_header = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class _Evictor(object):
+    """
+    Keeps the cached blocks within BLOCK_CACHE_MAX_BYTES while objects are being served, by checking the
+    size of the cache every time another EVICTION_INTERVAL_BYTES of blocks have been written.
+    """
+    def __init__(self, scratch_path: str):
+        self.scratch_path = scratch_path
+        self.written = 0
+        self.lock = threading.Lock()
+
+    def wrote(self, size: int) -> None:
+        with self.lock:
+            self.written += size
+            if self.written < EVICTION_INTERVAL_BYTES:
+                return
+            self.written = 0
+        evict_blocks(self.scratch_path)
+
+
+class _BlockCache(object):
+    """
+    Fetches an S3 object in BLOCK_SIZE byte ranges on first access and keeps the blocks on the scratch
+    volume, where other jobs on the instance can use them too. Blocks are keyed on the object's ETag,
+    so a changed object never mixes with stale blocks.
+    """
+    def __init__(self, s3_obj, scratch_path: str, evictor: _Evictor):
+        self.s3_obj = s3_obj
+        self.evictor = evictor
+        self.size = s3_obj.content_length
+        self.e_tag = s3_obj.e_tag
+        name = hashlib.sha256(f"{s3_obj.bucket_name}/{s3_obj.key}\n{self.e_tag}".encode("utf-8")).hexdigest()
+        self.block_dir = os.path.join(scratch_path, BLOCK_DIR, name)
+        os.makedirs(self.block_dir, exist_ok=True)
+
+    def _block(self, n: int) -> bytes:
+        path = os.path.join(self.block_dir, str(n))
+        try:
+            with open(path, "rb") as fp:
+                ret = fp.read()
+            os.utime(path)
+            return ret
+        except FileNotFoundError:
+            pass
+
+        start = n * BLOCK_SIZE
+        end = min(start + BLOCK_SIZE, self.size) - 1
+        response = self.s3_obj.get(Range=f"bytes={start}-{end}", IfMatch=self.e_tag)
+        with closing(response["Body"]) as body:
+            ret = body.read()
+
+        # write-then-rename, so a concurrent reader never sees a partial block
+        os.makedirs(self.block_dir, exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as fp:
+            fp.write(ret)
+        os.replace(tmp_path, path)
+        self.evictor.wrote(len(ret))
+        return ret
+
+    def read(self, start: int, end: int) -> Generator[bytes, None, None]:
+        """
+        Yields the bytes from start to end, inclusive.
+        """
+        for n in range(start // BLOCK_SIZE, end // BLOCK_SIZE + 1):
+            block = self._block(n)
+            block_start = n * BLOCK_SIZE
+            yield block[max(start - block_start, 0):end - block_start + 1]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+    def _respond(self, send_body: bool) -> None:
+        cache = self.server.objects.get(unquote(self.path.lstrip("/")))
+        if cache is None:
+            self.send_error(404)
+            return
+
+        start, end = 0, cache.size - 1
+        status = 200
+        if m := range_header.fullmatch(self.headers.get("Range", "")):
+            first, last = m.groups()
+            if first:
+                start = int(first)
+                end = min(int(last), cache.size - 1) if last else cache.size - 1
+            elif last:
+                start = max(cache.size - int(last), 0)
+            if start >= cache.size or start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{cache.size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("ETag", cache.e_tag)
+        self.send_header("Content-Length", str(end - start + 1 if cache.size else 0))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{cache.size}")
+        self.end_headers()
+
+        if send_body and cache.size > 0:
+            for chunk in cache.read(start, end):
+                self.wfile.write(chunk)
+
+    def do_HEAD(self):
+        self._respond(send_body=False)
+
+    def do_GET(self):
+        self._respond(send_body=True)
+
+
+def _server_address() -> str:
+    # user commands run in a sibling container, so they need this container's address on the docker network
+    if "ECS_CONTAINER_METADATA_URI_V4" in os.environ:
+        try:
+            return get_container_metadata()["Networks"][0]["IPv4Addresses"][0]
+        except Exception:
+            logger.warning("unable to find this container's IP address, serving lazy inputs on localhost")
+    return "127.0.0.1"
+
+
+@contextmanager
+def serve_objects(s3_objects: Dict[str, object], scratch_path: str) -> Generator[Dict[str, str], None, None]:
+    """
+    Serves S3 objects over HTTP, with range request support, for as long as the context is open. Byte
+    ranges are fetched from S3 the first time they are requested and cached on the scratch volume.
+    Yields a dict mapping each key of s3_objects to the URL the object is served at.
+    """
+    if not s3_objects:
+        yield {}
+        return
+
+    host = _server_address()
+    # only listen on the address the user commands are given, not on every interface
+    server = ThreadingHTTPServer((host, 0), _Handler)
+    server.daemon_threads = True
+    evictor = _Evictor(scratch_path)
+    server.objects = {name: _BlockCache(s3_obj, scratch_path, evictor) for name, s3_obj in s3_objects.items()}
+    port = server.server_address[1]
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        ret = {name: f"http://{host}:{port}/{quote(name)}" for name in s3_objects}
+        logger.info(f"serving {len(ret)} lazy inputs at http://{host}:{port}")
+        yield ret
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def evict_blocks(scratch_path: str) -> None:
+    """
+    Removes the least recently read cached blocks until the rest take up no more than BLOCK_CACHE_MAX_BYTES.
+    """
+    block_dir = os.path.join(scratch_path, BLOCK_DIR)
+    if not os.path.isdir(block_dir):
+        return
+
+    blocks = []
+    for obj_entry in os.scandir(block_dir):
+        if not obj_entry.is_dir(follow_symlinks=False):
+            continue
+        for entry in os.scandir(obj_entry.path):
+            # leave blocks that are still being written alone
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            blocks.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in blocks)
+    if total <= BLOCK_CACHE_MAX_BYTES:
+        return
+
+    blocks.sort()
+    removed = 0
+    for _, size, path in blocks:
+        if total <= BLOCK_CACHE_MAX_BYTES:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        removed += 1
+    logger.info(f"evicted {removed} cached blocks")
+
+
+def sweep_blocks(scratch_path: str) -> None:
+    """
+    Removes cached blocks that haven't been read in a day, then the least recently read ones if the
+    cache is still bigger than BLOCK_CACHE_MAX_BYTES.
+    """
+    block_dir = os.path.join(scratch_path, BLOCK_DIR)
+    if not os.path.isdir(block_dir):
+        return
+
+    horizon = time.time() - BLOCK_MAX_AGE_SECONDS
+    for obj_entry in os.scandir(block_dir):
+        if not obj_entry.is_dir(follow_symlinks=False):
+            continue
+        for entry in os.scandir(obj_entry.path):
+            if entry.stat().st_mtime < horizon:
+                os.remove(entry.path)
+        try:
+            os.rmdir(obj_entry.path)
+        except OSError:
+            pass
+
+    evict_blocks(scratch_path)
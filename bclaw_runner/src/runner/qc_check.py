@@ -1,10 +1,16 @@
 import json
 import logging
 import os
-from typing import Generator
+from types import CodeType
+from typing import Generator, Iterable, Set
 
 import boto3
 
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 
 logger = logging.getLogger(__name__)
 
@@ -41,13 +47,53 @@ def run_one_qc_check(qc_data: dict, qc_expression: str) -> bool:
     return result
 
 
+def _names_in(code: CodeType) -> Set[str]:
+    ret = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            ret |= _names_in(const)
+    return ret
+
+
+def referenced_names(qc_expressions: Iterable[str]) -> Set[str]:
+    """
+    Returns every name that the QC expressions might look up in the QC data. This can include
+    builtins and attribute names too, which does no harm.
+    """
+    ret = set()
+    for qc_expression in qc_expressions:
+        ret |= _names_in(compile(qc_expression, "<qc>", "eval"))
+    return ret
+
+
+def load_qc_data(qc_file: str, names: Set[str]) -> dict:
+    """
+    Reads the top-level fields named in names from a QC result file. If ijson is available, the file is
+    parsed incrementally: other fields are skipped without being built in memory, and reading stops if
+    every requested field has been found.
+    """
+    if ijson is None:
+        with open(qc_file) as fp:
+            return json.load(fp)
+
+    # A QC field can shadow a builtin (max, id, type...), so every name has to be looked for. Names
+    # that aren't in the file just mean reading to the end.
+    ret = {}
+    with open(qc_file, "rb") as fp:
+        for key, value in ijson.kvitems(fp, "", use_float=True):
+            if key in names:
+                ret[key] = value
+                if len(ret) == len(names):
+                    break
+    return ret
+
+
 def run_all_qc_checks(checks: list) -> Generator[str, None, None]:
     for item in checks:
         qc_file = item["qc_result_file"]
         logger.info(f"{qc_file=}")
 
-        with open(qc_file) as fp:
-            qc_data = json.load(fp)
+        qc_data = load_qc_data(qc_file, referenced_names(item["stop_early_if"]))
 
         for qc_expression in item["stop_early_if"]:
             if run_one_qc_check(qc_data, qc_expression):
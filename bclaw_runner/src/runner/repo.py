@@ -1,17 +1,28 @@
 from concurrent.futures import ThreadPoolExecutor
-from contextlib import closing
+from contextlib import closing, contextmanager
 import fnmatch
-import glob as g
 import json
 import logging
 import os
 import re
+import stat
+import threading
 from typing import Dict, Generator, Iterable, List, Tuple
+from urllib.parse import urlparse
 
 import boto3
 import botocore.exceptions
 from more_itertools import peekable
 
+from . import transfer
+from .archive import upload_archive, download_member, index_key, is_index_key, ARCHIVE_METADATA_KEY
+from .cache import get_reference_inputs
+from .codec import CompressingReader, CODEC_METADATA_KEY
+from .lazy import serve_objects
+from .tree_glob import iglob_many, _Pattern
+from .watcher import watch_files
+from .web import WebObject, is_url
+
 logger = logging.getLogger(__name__)
 
 
@@ -29,6 +40,46 @@ def _is_glob(filename: str) -> bool:
     return ret is not None
 
 
+# input file options: only fetch part of an object
+input_option = re.compile(r"^(?P<name>\S+?)\s+\+(?P<option>range|select|access):\s+(?P<value>.+)$", flags=re.S)
+
+
+def _split_input_option(filename: str) -> Tuple[str, str, str]:
+    """
+    Splits "file.csv +select: SELECT ..." into ("file.csv", "select", "SELECT ..."). Returns
+    (filename, None, None) if there is no option.
+    """
+    if m := input_option.fullmatch(filename.strip()):
+        return m.group("name"), m.group("option"), m.group("value").strip()
+    return filename, None, None
+
+
+def _local_name(filename: str) -> str:
+    filename = _split_input_option(filename)[0]
+    if is_url(filename):
+        return os.path.basename(urlparse(filename).path)
+    return os.path.basename(filename)
+
+
+def _uploadable(path: str) -> bool:
+    # Only regular files and directories (archived outputs) are uploaded. In particular, this skips the named
+    # pipes of streamed outputs: opening one would block forever or take data meant for the streaming upload
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return True
+    return stat.S_ISREG(mode) or stat.S_ISDIR(mode)
+
+
+def _input_items(input_spec: Dict[str, str | List[str]]) -> Generator[Tuple[str, str], None, None]:
+    for symbolic_name, filenames in input_spec.items():
+        if isinstance(filenames, list):
+            for filename in filenames:
+                yield symbolic_name, filename
+        else:
+            yield symbolic_name, filenames
+
+
 def _expand_s3_glob(glob: str) -> Generator[str, None, None]:
     bucket_name, globby_s3_key = glob.split("/", 3)[2:]
     if (m := re.search(r"^([^\[\]*?]+)(?=/)", globby_s3_key)) is not None:
@@ -42,17 +93,70 @@ def _expand_s3_glob(glob: str) -> Generator[str, None, None]:
     object_summaries = bucket.objects.filter(Prefix=prefix)
     object_keys = (o.key for o in object_summaries)
 
-    target_keys = fnmatch.filter(object_keys, globby_s3_key)
+    target_keys = (k for k in fnmatch.filter(object_keys, globby_s3_key) if not is_index_key(k))
     target_paths = (f"s3://{bucket_name}/{k}" for k in target_keys)
     yield from target_paths
 
 
+class _OutputStream(object):
+    """
+    Uploads whatever the user's commands write into a named pipe in the workspace, so that
+    a large output never has to be written to and read back from local disk.
+    """
+    def __init__(self, fifo_path: str, s3_obj, extra_args: dict, codec: str = None):
+        self.fifo_path = fifo_path
+        self.s3_obj = s3_obj
+        self.extra_args = extra_args
+        self.codec = codec
+        self.abandoned = False
+        self.error = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(fifo_path)), exist_ok=True)
+        os.mkfifo(fifo_path)
+        self.thread = threading.Thread(target=self._upload, daemon=True)
+        self.thread.start()
+
+    def _upload(self) -> None:
+        try:
+            # open() blocks until a writer opens the other end of the pipe
+            with open(self.fifo_path, "rb") as fp:
+                # finish() opens the pipe itself if nobody else did. Don't upload anything in that case,
+                # unless a writer got in just under the wire
+                if fp.peek(1) == b"" and self.abandoned:
+                    logger.warning(f"nothing written to streaming output {self.fifo_path}")
+                    return
+                logger.info(f"starting streaming upload: {self.fifo_path} -> s3://{self.s3_obj.bucket_name}/{self.s3_obj.key}")
+                if self.codec is None:
+                    self.s3_obj.upload_fileobj(fp, ExtraArgs=self.extra_args)
+                else:
+                    extra_args = self.extra_args | {"Metadata": self.extra_args["Metadata"] | {CODEC_METADATA_KEY: self.codec}}
+                    self.s3_obj.upload_fileobj(CompressingReader(fp, self.codec), ExtraArgs=extra_args)
+            logger.info(f"finished streaming upload: {self.fifo_path} -> s3://{self.s3_obj.bucket_name}/{self.s3_obj.key} "
+                        f"({self.s3_obj.content_length} bytes)")
+        except Exception as e:
+            self.error = e
+
+    def finish(self) -> None:
+        while self.thread.is_alive():
+            # unblock the reader if no writer ever opened the pipe
+            self.abandoned = True
+            try:
+                fd = os.open(self.fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+                os.close(fd)
+            except OSError:
+                pass
+            self.thread.join(timeout=1)
+
+
 class Repository(object):
-    def __init__(self, s3_uri: str):
+    def __init__(self, s3_uri: str, engine: str = "auto"):
         logger.info(f"repository={s3_uri}")
         self.s3_uri = s3_uri
+        self.engine = engine
         self.bucket, self.prefix = s3_uri.split("/", 3)[2:]
         self.run_status_obj = f"_control_/{os.environ['BC_STEP_NAME']}.complete"
+        self._uploaded = {}
+        self._uploaded_lock = threading.Lock()
 
     def to_uri(self, filename: str) -> str:
         ret = f"{self.s3_uri}/{filename}"
@@ -111,9 +215,24 @@ class Repository(object):
         logger.info("output files missing; continuing")
 
 
-    def _inputerator(self, input_spec: Dict[str, str]) -> Generator[str, None, None]:
-        for symbolic_name, filename in input_spec.items():
+    def _inputerator(self, input_spec: Dict[str, str | List[str]]) -> Generator[str, None, None]:
+        for symbolic_name, filename in _input_items(input_spec):
             optional = symbolic_name.endswith("?")
+            filename, option, value = _split_input_option(filename)
+            suffix = "" if option is None else f" +{option}: {value}"
+
+            # http(s) URLs are downloaded as they are, no globbing or options
+            if is_url(filename):
+                yield filename
+                continue
+
+            # archive_name#path/to/member refers to a single file inside an archived directory
+            if "#" in filename:
+                archive, member = filename.split("#", 1)
+                if not archive.startswith("s3://"):
+                    archive = self.to_uri(os.path.basename(archive))
+                yield f"{archive}#{member}"
+                continue
 
             if filename.startswith("s3://"):
                 uri = filename
@@ -126,19 +245,53 @@ class Repository(object):
                     logger.warning(f"optional file not found: {filename}; skipping")
                 else:
                     raise FileNotFoundError(filename)
-            yield from s3_objects
+            yield from (f"{o}{suffix}" for o in s3_objects)
 
     @staticmethod
-    def _download_this(s3_uri: str) -> str:
+    def _download_url(url: str) -> str:
+        # go through the reference cache when there is one, so that every job on the instance can share the download
+        if "BC_SCRATCH_PATH" in os.environ:
+            return get_reference_inputs({"url": url})["url"]
+
+        src = WebObject(url)
+        logger.info(f"starting download: {url} ({src.content_length} bytes) -> {src.name}")
+        src.download_file(src.name)
+        logger.info(f"finished download: {url} -> {src.name} ({os.path.getsize(src.name)} bytes)")
+        return src.name
+
+    def _download_this(self, s3_uri: str) -> str:
+        if is_url(s3_uri):
+            return self._download_url(s3_uri)
+
+        s3_uri, option, value = _split_input_option(s3_uri)
+        s3_uri, _, member = s3_uri.partition("#")
         bucket, key = s3_uri.split("/", 3)[2:]
-        dest = os.path.basename(key)
+        dest = os.path.basename(member or key)
         session = boto3.Session()
         s3 = session.resource("s3")
         try:
             s3_obj = s3.Object(bucket, key)
+            if member:
+                logger.info(f"starting download: {s3_uri}#{member} -> {dest}")
+                download_member(s3_obj, member, dest)
+                logger.info(f"finished download: {s3_uri}#{member} -> {dest} ({os.path.getsize(dest)} bytes)")
+                return dest
+
+            if option == "range":
+                logger.info(f"starting download: {s3_uri} (bytes {value}) -> {dest}")
+                transfer.download_range(s3_obj, dest, value)
+                logger.info(f"finished download: {s3_uri} (bytes {value}) -> {dest} ({os.path.getsize(dest)} bytes)")
+                return dest
+
+            if option == "select":
+                logger.info(f"starting S3 Select: {s3_uri} -> {dest}")
+                transfer.select_to_file(s3_obj, dest, value)
+                logger.info(f"finished S3 Select: {s3_uri} -> {dest} ({os.path.getsize(dest)} bytes)")
+                return dest
+
             s3_size = s3_obj.content_length
             logger.info(f"starting download: {s3_uri} ({s3_size} bytes) -> {dest}")
-            s3_obj.download_file(dest)
+            transfer.download(s3_obj, dest, self.engine, os.environ.get("BC_SCRATCH_PATH"))
             local_size = os.path.getsize(dest)
             logger.info(f"finished download: {s3_uri} ({s3_size} bytes) -> {dest} ({local_size} bytes)")
             return dest
@@ -148,32 +301,89 @@ class Repository(object):
             else:
                 raise
 
-    def download_inputs(self, input_spec: Dict[str, str]) -> Dict[str, str]:
+    @staticmethod
+    def _lazy_input_spec(input_spec: Dict[str, str | List[str]]) -> Dict[str, str]:
+        ret = {}
+        for symbolic_name, filename in input_spec.items():
+            if isinstance(filename, list):
+                continue
+            name, option, value = _split_input_option(filename)
+            if option == "access" and value == "lazy":
+                if _is_glob(name) or "#" in name or is_url(name):
+                    logger.warning(f"lazy access is only available for single S3 objects, downloading {name}")
+                else:
+                    ret[symbolic_name] = name
+        return ret
+
+    def download_inputs(self, input_spec: Dict[str, str | List[str]], lazy: bool = False) -> Dict[str, str]:
+        """
+        Downloads input files to the current directory. If lazy is True, inputs marked
+        '+access: lazy' are skipped; use serve_lazy_inputs for those. An input can be a list of files,
+        in which case its local name is the space separated list of their local names.
+        """
+        if lazy:
+            lazy_spec = self._lazy_input_spec(input_spec)
+            input_spec = {k: v for k, v in input_spec.items() if k not in lazy_spec}
+
         with ThreadPoolExecutor(max_workers=256) as executor:
             result = list(executor.map(self._download_this, self._inputerator(input_spec)))
 
         logger.info(f"{len(result)} files downloaded")
 
-        ret = {k.rstrip("?"): os.path.basename(v) for k, v in input_spec.items()}
+        ret = {k.rstrip("?"): " ".join(_local_name(f) for f in v) if isinstance(v, list) else _local_name(v)
+               for k, v in input_spec.items()}
         return ret
 
-    @staticmethod
-    def _outputerator(output_spec: dict) -> Generator[Tuple[str, dict], None, None]:
-        for sym_name, file_spec in output_spec.items():
-            expanded = g.glob(file_spec["name"], recursive=True)
-            if not expanded:
-                logger.warning(f"no file matching '{file_spec['name']}' found in workspace")
-            for filename in expanded:
-                yld = file_spec.copy()
-                yld["name"] = filename
-                yield sym_name, yld
+    @contextmanager
+    def serve_lazy_inputs(self, input_spec: Dict[str, str]) -> Generator[Dict[str, str], None, None]:
+        """
+        Serves inputs marked '+access: lazy' over HTTP while the context is open, fetching byte ranges
+        from S3 as they are requested. Yields a dict mapping their symbolic names to their URLs.
 
-    def _upload_that(self, symbolic_name: str, file_spec: dict, global_tags: dict) -> str:
-        local_file = file_spec["name"]
-        local_tags = file_spec["s3_tags"]
-        local_size = os.path.getsize(local_file)
+        Compressed and archived objects can't be served as they are stored, so they are downloaded to
+        the current directory instead, and their local names are yielded in place of URLs.
+        """
+        s3 = boto3.Session().resource("s3")
+        s3_objects = {}
+        file_names = {}
+        downloaded = {}
+        for symbolic_name, name in self._lazy_input_spec(input_spec).items():
+            uri = name if name.startswith("s3://") else self.to_uri(os.path.basename(name))
+            bucket, key = uri.split("/", 3)[2:]
+            s3_obj = s3.Object(bucket, key)
+            try:
+                s3_obj.load()
+            except botocore.exceptions.ClientError as ce:
+                if "Not Found" in str(ce) or "404" in str(ce):
+                    if symbolic_name.endswith("?"):
+                        logger.warning(f"optional file not found: {name}; skipping")
+                        continue
+                    raise FileNotFoundError(uri)
+                raise
+            if CODEC_METADATA_KEY in s3_obj.metadata or ARCHIVE_METADATA_KEY in s3_obj.metadata:
+                logger.warning(f"{uri} is compressed or archived, downloading it instead of serving it lazily")
+                downloaded[symbolic_name.rstrip("?")] = self._download_this(uri)
+                continue
+            # serve under the file name, so that tools can find index files (e.g. x.bam.bai) next to their data files
+            file_names[symbolic_name.rstrip("?")] = os.path.basename(key)
+            s3_objects[os.path.basename(key)] = s3_obj
 
-        s3_filename = os.path.basename(local_file)
+        with serve_objects(s3_objects, os.environ["BC_SCRATCH_PATH"]) as urls:
+            yield {k: urls[v] for k, v in file_names.items()} | downloaded
+
+    @staticmethod
+    def _outputerator(output_spec: dict) -> Generator[Tuple[str, dict], None, None]:
+        # all the patterns are expanded in one pass over the workspace
+        for sym_name, filename in iglob_many({k: v["name"] for k, v in output_spec.items()}):
+            if not _uploadable(filename):
+                logger.info(f"{filename} is not a regular file or directory, not uploading it")
+                continue
+            yld = output_spec[sym_name].copy()
+            yld["name"] = filename
+            yield sym_name, yld
+
+    def _destination(self, file_spec: dict) -> Tuple[str, str, str]:
+        s3_filename = os.path.basename(os.path.normpath(file_spec["name"]))
 
         if "dest" in file_spec:
             dest_uri = f"{file_spec['dest']}{s3_filename}"
@@ -183,32 +393,178 @@ class Repository(object):
             key = self.qualify(s3_filename)
             dest_uri = f"s3://{bucket}/{key}"
 
+        return bucket, key, dest_uri
+
+    def output_destinations(self, output_spec: Dict[str, dict]) -> Generator[Tuple[str, str], None, None]:
+        """
+        Yields the (bucket, key) of every S3 object that uploading the outputs currently in the
+        workspace would write.
+        """
+        for _, file_spec in self._outputerator(output_spec):
+            bucket, key, _ = self._destination(file_spec)
+            yield bucket, key
+            if file_spec.get("archive"):
+                yield bucket, index_key(key)
+
+    @staticmethod
+    def _upload_args(file_spec: dict, global_tags: dict) -> dict:
         # https://jcoenraadts.medium.com/how-to-write-tags-when-a-file-is-uploaded-to-s3-with-boto3-and-python-690f92224e2b
-        tagging_str = "&".join(f"{k}={v}" for k, v in (global_tags | local_tags).items())
+        tagging_str = "&".join(f"{k}={v}" for k, v in (global_tags | file_spec["s3_tags"]).items())
+
+        ret = {"ServerSideEncryption": "AES256",
+               "Metadata": _file_metadata(),
+               "Tagging": tagging_str}
+        return ret
+
+    @staticmethod
+    def _file_version(local_file: str) -> Tuple[int, int]:
+        st = os.stat(local_file)
+        return st.st_mtime_ns, st.st_size
+
+    def _already_uploaded(self, local_file: str) -> bool:
+        with self._uploaded_lock:
+            prev = self._uploaded.get(os.path.abspath(local_file))
+        return prev is not None and prev == self._file_version(local_file)
+
+    def _upload_that(self, symbolic_name: str, file_spec: dict, global_tags: dict) -> str:
+        local_file = file_spec["name"]
+        version = self._file_version(local_file)
+        local_size = version[1]
+
+        bucket, key, dest_uri = self._destination(file_spec)
 
         # todo: add more retries? adaptive retries?
         #   https://boto3.amazonaws.com/v1/documentation/api/latest/guide/retries.html
-        logger.info(f"starting upload: {local_file} ({local_size} bytes) -> {dest_uri}")
         session = boto3.Session()
         s3 = session.resource("s3")
         s3_obj = s3.Object(bucket, key)
-        s3_obj.upload_file(local_file,
-                           ExtraArgs={"ServerSideEncryption": "AES256",
-                                      "Metadata": _file_metadata(),
-                                      "Tagging": tagging_str}
-                           )
+
+        if file_spec.get("archive"):
+            if not os.path.isdir(local_file):
+                raise NotADirectoryError(f"archive output {local_file} is not a directory")
+            logger.info(f"starting archive upload: {local_file}/ -> {dest_uri}")
+            count = upload_archive(s3_obj, s3.Object(bucket, index_key(key)), local_file,
+                                   self._upload_args(file_spec, global_tags), file_spec.get("compress"))
+            logger.info(f"finished archive upload: {local_file}/ ({count} files) -> {dest_uri} "
+                        f"({s3_obj.content_length} bytes)")
+            with self._uploaded_lock:
+                self._uploaded[os.path.abspath(local_file)] = version
+            return dest_uri
+
+        logger.info(f"starting upload: {local_file} ({local_size} bytes) -> {dest_uri}")
+        transfer.upload(s3_obj, local_file, self._upload_args(file_spec, global_tags), self.engine,
+                        file_spec.get("compress"))
         s3_size = s3_obj.content_length
 
         logger.info(f"finished upload: {local_file} ({local_size} bytes) -> {dest_uri} ({s3_size} bytes)")
+
+        with self._uploaded_lock:
+            self._uploaded[os.path.abspath(local_file)] = version
         return dest_uri
 
     def upload_outputs(self, output_spec: Dict[str, dict], global_tags: dict) -> None:
         uploader = lambda sn, fs: self._upload_that(sn, fs, global_tags)
 
+        # skip anything uploaded early that hasn't changed since. Uploads start while the workspace is still
+        # being searched
+        pending = ((sn, fs) for sn, fs in self._outputerator(output_spec) if not self._already_uploaded(fs["name"]))
+
         with ThreadPoolExecutor(max_workers=256) as executor:
-            result = list(executor.map(uploader, *zip(*self._outputerator(output_spec))))  # kudos to copilot
+            result = list(executor.map(lambda p: uploader(*p), pending))
         logger.info(f"{len(result)} files uploaded")
 
+    @contextmanager
+    def uploading_outputs(self, output_spec: Dict[str, dict], global_tags: dict) -> Generator[None, None, None]:
+        """
+        Uploads outputs in the background while the body of the with statement runs, and waits for
+        the uploads to finish on the way out. Upload errors are raised from the with statement.
+        """
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            upload = executor.submit(self.upload_outputs, output_spec, global_tags)
+            try:
+                yield
+            finally:
+                upload.result()
+
+    @contextmanager
+    def watch_outputs(self, output_spec: Dict[str, dict], global_tags: dict) -> Generator[None, None, None]:
+        """
+        Uploads files matching outputs marked "upload: early" in the background as soon as they are
+        closed, while the commands are still running. Failed early uploads are only logged; the final
+        call to upload_outputs picks up anything that was missed or has changed since.
+        """
+        early_spec = {k: v for k, v in output_spec.items() if v.get("upload") == "early"}
+        if not early_spec:
+            yield
+            return
+
+        # match the same way as upload_outputs does, so that early and final uploads pick the same files
+        patterns = {sym_name: _Pattern(file_spec["name"]) if _is_glob(file_spec["name"])
+                    else os.path.normpath(file_spec["name"])
+                    for sym_name, file_spec in early_spec.items()}
+
+        def _matcher(rel_path: str) -> Generator[Tuple[str, dict], None, None]:
+            parts = tuple(rel_path.split("/"))
+            for sym_name, file_spec in early_spec.items():
+                pattern = patterns[sym_name]
+                if pattern.matches(parts) if isinstance(pattern, _Pattern) else rel_path == pattern:
+                    yld = file_spec.copy()
+                    yld["name"] = rel_path
+                    yield sym_name, yld
+                    return
+
+        def _early_upload(sym_name: str, file_spec: dict) -> None:
+            try:
+                if not self._already_uploaded(file_spec["name"]):
+                    self._upload_that(sym_name, file_spec, global_tags)
+            except Exception as e:
+                logger.warning(f"early upload of {file_spec['name']} failed, will retry later: {e}")
+
+        with ThreadPoolExecutor(max_workers=16) as executor:
+            def _on_finished(rel_path: str) -> None:
+                if not _uploadable(rel_path):
+                    return
+                for sym_name, file_spec in _matcher(rel_path):
+                    executor.submit(_early_upload, sym_name, file_spec)
+
+            with watch_files(os.getcwd(), _on_finished):
+                yield
+
+    @contextmanager
+    def stream_outputs(self, output_spec: Dict[str, dict], global_tags: dict) -> Generator[Dict[str, dict], None, None]:
+        """
+        Creates a named pipe in the workspace for each output marked "upload: stream" and uploads
+        whatever is written to it while the commands run. Yields the output spec for the remaining
+        outputs, which must be uploaded in the usual way.
+        """
+        streams = []
+        remaining = {}
+
+        for sym_name, file_spec in output_spec.items():
+            if file_spec.get("upload") != "stream":
+                remaining[sym_name] = file_spec
+            elif _is_glob(file_spec["name"]):
+                logger.warning(f"cannot stream to a glob ({file_spec['name']}), will upload matching files later")
+                remaining[sym_name] = file_spec
+            else:
+                bucket, key, dest_uri = self._destination(file_spec)
+                logger.info(f"streaming {file_spec['name']} -> {dest_uri}")
+                s3_obj = boto3.Session().resource("s3").Object(bucket, key)
+                streams.append(_OutputStream(file_spec["name"], s3_obj, self._upload_args(file_spec, global_tags),
+                                             file_spec.get("compress")))
+
+        try:
+            yield remaining
+
+        finally:
+            for stream in streams:
+                stream.finish()
+
+        if failures := [s for s in streams if s.error is not None]:
+            for stream in failures:
+                logger.error(f"streaming upload of {stream.fifo_path} failed: {stream.error}")
+            raise RuntimeError(f"{len(failures)} streaming uploads failed")
+
     def check_for_previous_run(self) -> None:
         """
         Raises SkipExecution if this step has been run before
@@ -6,11 +6,15 @@ Usage:
 
 Options:
     -c COMMANDS     command
+    -e ENGINE       s3 transfer engine: auto, boto3, crt, ranged [default: auto]
     -f JSON_STRING  reference files
     -i JSON_STRING  input files
     -k STRING       step skip condition: output, rerun, none [default: none]
+    -l JSON_STRING  child container resource limits [default: {}]
     -m JSON_STRING  Docker image spec
+    -n PHASE        native execution phase: stage-in, stage-out, none [default: none]
     -o JSON_STRING  output files
+    -p JSON_STRING  spot interruption checkpoint spec [default: {}]
     -q JSON_STRING  QC check spec
     -r S3_PATH      repository path
     -s SHELL        unix shell to run commands in (bash | sh | sh-pipefail) [default: sh]
@@ -19,6 +23,7 @@ Options:
     --version       show version
 """
 
+from contextlib import nullcontext
 from functools import partial, partialmethod
 import json
 import logging.config
@@ -28,20 +33,26 @@ from typing import Dict, List
 from docopt import docopt
 
 from .cache import get_reference_inputs
-from .string_subs import substitute, substitute_image_tag
+from .checkpoint import Checkpoint
+from .string_subs import substitute, substitute_file_spec, substitute_image_tag
 from .preamble import log_preamble
 from .qc_check import do_checks, abort_execution, QCFailure
 from .repo import Repository, SkipExecution
 from .instance import get_imdsv2_token, tag_this_instance, spot_termination_checker
-from .workspace import workspace, write_job_data_file, run_commands, UserCommandsFailed
+from .workspace import workspace, native_workspace, write_job_data_file, run_commands, write_native_script, \
+    write_native_skip, native_skip_requested, check_native_commands, UserCommandsFailed
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def main(commands: List[str],
+def main(checkpoint: dict,
+         commands: List[str],
+         engine: str,
          image_spec: dict,
          inputs: Dict[str, str],
+         limits: dict,
+         native: str,
          outputs: Dict[str, str | Dict],
          qc: List[dict],
          references: Dict[str, str],
@@ -52,46 +63,87 @@ def main(commands: List[str],
 
     exit_code = 0
     try:
-        repo = Repository(repo_path)
+        repo = Repository(repo_path, engine)
 
-        if skip == "rerun":
-            repo.check_for_previous_run()
-        elif skip == "output":
-            repo.check_files_exist(list(outputs.values()))
+        # in native mode, the stage-in runner has already checked for skips and cleared the run status
+        if native != "stage-out":
+            if skip == "rerun":
+                repo.check_for_previous_run()
+            elif skip == "output":
+                repo.check_files_exist(list(outputs.values()))
 
-        repo.clear_run_status()
+            repo.clear_run_status()
 
         job_data_obj = repo.read_job_data()
 
         jobby_commands   = substitute(commands,   job_data_obj)
-        jobby_inputs     = substitute(inputs,     job_data_obj)
+        jobby_inputs     = substitute_file_spec(inputs, job_data_obj)
         jobby_outputs    = substitute(outputs,    job_data_obj)  # this will recurse down to s3_tags
         jobby_references = substitute(references, job_data_obj)
         jobby_tags       = substitute(tags,       job_data_obj)
 
         jobby_image_spec = substitute_image_tag(image_spec, job_data_obj)
 
-        with workspace() as wrk:
-            # download references, link to workspace
-            local_references = get_reference_inputs(jobby_references)
-
-            # download inputs -> returns local filenames
-            local_inputs = repo.download_inputs(jobby_inputs)
-            local_outputs = {k.rstrip("!"): v["name"] for k, v in jobby_outputs.items()}
-
-            subbed_commands = substitute(jobby_commands,
-                                         local_inputs |
-                                         local_outputs |
-                                         local_references)
-
-            local_job_data = write_job_data_file(job_data_obj, wrk)
-
-            try:
-                run_commands(jobby_image_spec, subbed_commands, wrk, local_job_data, shell)
-                do_checks(qc)
-
-            finally:
-                repo.upload_outputs(jobby_outputs, jobby_tags)
+        if native == "none":
+            this_workspace = workspace()
+        else:
+            this_workspace = native_workspace(cleanup=native == "stage-out")
+
+        with this_workspace as wrk:
+            if native == "stage-out":
+                if native_skip_requested():
+                    raise SkipExecution("stage-in runner skipped this step")
+
+                try:
+                    check_native_commands()
+                    do_checks(qc)
+
+                finally:
+                    repo.upload_outputs(jobby_outputs, jobby_tags)
+
+            else:
+                # download references, link to workspace
+                local_references = get_reference_inputs(jobby_references)
+
+                # download inputs -> returns local filenames. Lazy inputs are served while the commands run,
+                # which can't happen in native mode
+                lazy = native == "none"
+                local_inputs = repo.download_inputs(jobby_inputs, lazy=lazy)
+
+                # restore files saved by a previous attempt that was interrupted
+                this_checkpoint = Checkpoint(repo, checkpoint, jobby_tags)
+                this_checkpoint.restore(wrk)
+
+                local_outputs = {k.rstrip("!"): v["name"] for k, v in jobby_outputs.items()}
+                local_job_data = write_job_data_file(job_data_obj, wrk)
+
+                with repo.serve_lazy_inputs(jobby_inputs) if lazy else nullcontext({}) as lazy_inputs:
+                    subbed_commands = substitute(jobby_commands,
+                                                 local_inputs |
+                                                 lazy_inputs |
+                                                 local_outputs |
+                                                 local_references)
+
+                    if native == "stage-in":
+                        write_native_script(subbed_commands, wrk, local_job_data, shell)
+
+                    else:
+                        with repo.stream_outputs(jobby_outputs, jobby_tags) as unstreamed_outputs:
+                            try:
+                                with repo.watch_outputs(unstreamed_outputs, jobby_tags), \
+                                        this_checkpoint.armed(wrk, unstreamed_outputs):
+                                    run_commands(jobby_image_spec, subbed_commands, wrk, local_job_data, shell,
+                                                 limits)
+
+                            except BaseException:
+                                repo.upload_outputs(unstreamed_outputs, jobby_tags)
+                                raise
+
+                            else:
+                                # QC checks only read local files, so they can run while the outputs upload
+                                with repo.uploading_outputs(unstreamed_outputs, jobby_tags):
+                                    do_checks(qc)
+                                    this_checkpoint.clear()
 
     except UserCommandsFailed as uce:
         logger.error(str(uce))
@@ -103,14 +155,16 @@ def main(commands: List[str],
 
     except SkipExecution as se:
         logger.info(str(se))
-        pass
+        if native == "stage-in":
+            write_native_skip()
 
     except Exception as e:
         logger.exception("bclaw_runner error: ")
         exit_code = 199
 
     else:
-        repo.put_run_status()
+        if native != "stage-in":
+            repo.put_run_status()
         logger.info("runner finished")
 
     return exit_code
@@ -132,9 +186,13 @@ def cli() -> int:
     with spot_termination_checker():
         args = docopt(__doc__, version=os.environ["BC_VERSION"])
 
+        ckpt     = json.loads(args["-p"])
         commands = json.loads(args["-c"])
+        engine   = args["-e"]
         image    = json.loads(args["-m"])
         inputs   = json.loads(args["-i"])
+        limits   = json.loads(args["-l"])
+        native   = args["-n"]
         outputs  = json.loads(args["-o"])
         qc       = json.loads(args["-q"])
         refs     = json.loads(args["-f"])
@@ -143,5 +201,5 @@ def cli() -> int:
         skip     = args["-k"]
         tags     = json.loads(args["-t"])
 
-        ret = main(commands, image, inputs, outputs, qc, refs, repo, shell, skip, tags)
+        ret = main(ckpt, commands, engine, image, inputs, limits, native, outputs, qc, refs, repo, shell, skip, tags)
         return ret
@@ -1,13 +1,21 @@
 from functools import partial
 import jmespath
 import re
-from typing import Any
+from typing import Any, Dict
+
+
+def _is_batch(expr: str, value: Any) -> bool:
+    # in a batched scatter, the scatter values are lists
+    return isinstance(value, list) and expr.startswith("scatter.")
 
 
 def lookup(m: re.Match, spec: dict) -> str:
     ret = jmespath.search(m.group(1), spec)
     if ret is None:
         ret = m.group(0)
+    elif _is_batch(m.group(1), ret):
+        # e.g. ${scatter.files} in a batched scatter: space separated, for the shell
+        ret = " ".join(str(r) for r in ret)
     return str(ret)
 
 
@@ -27,6 +35,21 @@ def substitute(target: Any, spec: dict) -> Any:
     return ret
 
 
+def substitute_file_spec(target: Dict[str, str], spec: dict) -> Dict[str, Any]:
+    """
+    Like substitute, but a value that consists of nothing but a reference to a batched scatter value
+    becomes a list of strings, so that e.g. an input of ${scatter.files} names several files.
+    """
+    ret = {}
+    for k, v in target.items():
+        if isinstance(v, str) and (m := SUB_FINDER.fullmatch(v)) is not None and \
+                _is_batch(m.group(1), found := jmespath.search(m.group(1), spec)):
+            ret[k] = [str(f) for f in found]
+        else:
+            ret[k] = substitute(v, spec)
+    return ret
+
+
 def substitute_image_tag(image_spec: dict, sub_spec: dict) -> dict:
     name = image_spec["name"]
     parts = name.split("/")
@@ -0,0 +1,290 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+import fcntl
+import hashlib
+import json
+import logging
+import mmap
+import os
+import threading
+import time
+
+from boto3.s3.transfer import TransferConfig
+
+from .archive import extract_archive, ARCHIVE_METADATA_KEY
+from .codec import CompressingReader, decompress_to_file, CODEC_METADATA_KEY
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ("auto", "boto3", "crt", "ranged")
+PARTIAL_DIR = "_bclaw_partial"
+PARTIAL_MAX_AGE_SECONDS = 24 * 60 * 60
+RESUMABLE_THRESHOLD = 512 * 1024 ** 2
+RESUMABLE_PART_SIZE = 64 * 1024 ** 2
+RESUMABLE_WORKERS = 8
+CHUNK_SIZE = 1024 ** 2
+
+
+def _partial_paths(scratch_path: str, bucket: str, key: str) -> tuple:
+    partial_dir = os.path.join(scratch_path, PARTIAL_DIR)
+    os.makedirs(partial_dir, exist_ok=True)
+    name = hashlib.sha256(f"{bucket}/{key}".encode("utf-8")).hexdigest()
+    return os.path.join(partial_dir, f"{name}.part"), os.path.join(partial_dir, f"{name}.json")
+
+
+def _load_progress(progress_path: str, etag: str, size: int) -> set:
+    try:
+        with open(progress_path) as fp:
+            progress = json.load(fp)
+        if progress["etag"] == etag and progress["size"] == size and progress["part_size"] == RESUMABLE_PART_SIZE:
+            return set(progress["done"])
+        logger.info("object has changed since the previous download attempt, starting over")
+    except (OSError, ValueError, KeyError):
+        pass
+    return set()
+
+
+def _save_progress(progress_path: str, etag: str, size: int, done: set) -> None:
+    tmp_path = f"{progress_path}.tmp"
+    with open(tmp_path, "w") as fp:
+        json.dump({"etag": etag, "size": size, "part_size": RESUMABLE_PART_SIZE, "done": sorted(done)}, fp)
+    os.replace(tmp_path, progress_path)
+
+
+def _lock_partial(data_path: str) -> int | None:
+    # Opens and exclusively locks the partial file, returning its descriptor, or None if another job holds
+    # the lock. A job that finishes a download renames the partial file it locked, so if the file was renamed
+    # between opening and locking it, the lock is on the finished file: start over with a new partial file.
+    while True:
+        fd = os.open(data_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            if os.fstat(fd).st_ino == os.stat(data_path).st_ino:
+                return fd
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        except FileNotFoundError:
+            pass
+        except BaseException:
+            os.close(fd)
+            raise
+        os.close(fd)
+
+
+def resumable_download(s3_obj, dest: str, scratch_path: str) -> bool:
+    """
+    Downloads a large S3 object in parallel byte ranges into a preallocated, memory-mapped partial
+    file on the scratch volume, keeping track of the finished ranges in a sidecar file. If a previous
+    attempt on this instance was interrupted, only the missing ranges are fetched, provided the
+    object's ETag hasn't changed. The finished file is moved to dest.
+
+    Returns False without downloading anything if another job is already downloading the same object.
+    """
+    etag = s3_obj.e_tag
+    size = s3_obj.content_length
+    data_path, progress_path = _partial_paths(scratch_path, s3_obj.bucket_name, s3_obj.key)
+
+    fd = _lock_partial(data_path)
+    if fd is None:
+        logger.info(f"s3://{s3_obj.bucket_name}/{s3_obj.key} is being downloaded by another job")
+        return False
+
+    try:
+        done = _load_progress(progress_path, etag, size)
+        if os.fstat(fd).st_size != size:
+            done = set()
+            os.ftruncate(fd, size)
+
+        parts = range((size + RESUMABLE_PART_SIZE - 1) // RESUMABLE_PART_SIZE)
+        missing = [p for p in parts if p not in done]
+        if done:
+            logger.info(f"resuming download: {len(done)} of {len(parts)} parts already downloaded")
+
+        lock = threading.Lock()
+
+        def _fetch(part: int) -> None:
+            start = part * RESUMABLE_PART_SIZE
+            end = min(start + RESUMABLE_PART_SIZE, size) - 1
+            response = s3_obj.get(Range=f"bytes={start}-{end}", IfMatch=etag)
+            offset = start
+            with closing(response["Body"]) as body:
+                for chunk in body.iter_chunks(CHUNK_SIZE):
+                    mm[offset:offset + len(chunk)] = chunk
+                    offset += len(chunk)
+            with lock:
+                done.add(part)
+                _save_progress(progress_path, etag, size, done)
+
+        if missing:
+            with mmap.mmap(fd, size) as mm, ThreadPoolExecutor(max_workers=RESUMABLE_WORKERS) as executor:
+                list(executor.map(_fetch, missing))
+                mm.flush()
+
+        os.replace(data_path, dest)
+        os.remove(progress_path)
+        return True
+
+    finally:
+        os.close(fd)
+
+
+def _crt_config() -> TransferConfig | None:
+    try:
+        import awscrt  # noqa: F401
+        return TransferConfig(preferred_transfer_client="crt")
+    except ImportError:
+        logger.warning("AWS CRT is not installed, using the boto3 transfer engine")
+        return None
+
+
+def choose_engine(engine: str, size: int, scratch_path: str | None) -> str:
+    if engine == "auto":
+        engine = "ranged" if size >= RESUMABLE_THRESHOLD else "boto3"
+    if engine == "ranged" and scratch_path is None:
+        engine = "boto3"
+    return engine
+
+
+def download(s3_obj, dest: str, engine: str, scratch_path: str | None) -> None:
+    """
+    Downloads an S3 object using the requested transfer engine:
+        boto3:  boto3's managed transfer
+        crt:    boto3's managed transfer backed by the AWS Common Runtime S3 client
+        ranged: parallel, resumable ranged GETs into a memory mapped file (see resumable_download)
+        auto:   ranged for objects of RESUMABLE_THRESHOLD bytes or more, boto3 for the rest
+
+    Objects uploaded with compression (see upload) are decompressed on the fly, whatever the engine.
+    Archives (see archive.upload_archive) are unpacked into a directory named dest.
+    """
+    if ARCHIVE_METADATA_KEY in s3_obj.metadata:
+        logger.debug(f"unpacking s3://{s3_obj.bucket_name}/{s3_obj.key}")
+        extract_archive(s3_obj, dest)
+        return
+
+    if (codec := s3_obj.metadata.get(CODEC_METADATA_KEY)) is not None:
+        logger.debug(f"decompressing s3://{s3_obj.bucket_name}/{s3_obj.key} ({codec})")
+        decompress_to_file(s3_obj.get()["Body"], dest, codec)
+        return
+
+    engine = choose_engine(engine, s3_obj.content_length, scratch_path)
+    logger.debug(f"downloading s3://{s3_obj.bucket_name}/{s3_obj.key} with the {engine} engine")
+
+    if engine == "ranged" and resumable_download(s3_obj, dest, scratch_path):
+        return
+    if engine == "crt":
+        s3_obj.download_file(dest, Config=_crt_config())
+    else:
+        s3_obj.download_file(dest)
+
+
+def upload(s3_obj, local_file: str, extra_args: dict, engine: str, codec: str = None) -> None:
+    """
+    Uploads a file using the requested transfer engine. Only crt changes anything here; the other
+    engines use boto3's managed transfer.
+
+    If codec is given, the file is compressed on the fly and the codec is recorded in the object's
+    metadata.
+    """
+    if codec is not None:
+        extra_args = extra_args | {"Metadata": extra_args.get("Metadata", {}) | {CODEC_METADATA_KEY: codec}}
+        with open(local_file, "rb") as fp:
+            s3_obj.upload_fileobj(CompressingReader(fp, codec), ExtraArgs=extra_args)
+    elif engine == "crt":
+        s3_obj.upload_file(local_file, ExtraArgs=extra_args, Config=_crt_config())
+    else:
+        s3_obj.upload_file(local_file, ExtraArgs=extra_args)
+
+
+def download_range(s3_obj, dest: str, byte_range: str) -> None:
+    """
+    Downloads part of an S3 object. byte_range uses HTTP Range syntax without the "bytes=" prefix:
+    "0-1023" is the first 1 KiB, "1024-" is everything after that, and "-1024" is the last 1 KiB.
+    The range applies to the object as stored, i.e. to the compressed bytes of a compressed output.
+    """
+    response = s3_obj.get(Range=f"bytes={byte_range}")
+    with closing(response["Body"]) as body, open(dest, "wb") as fp:
+        for chunk in body.iter_chunks(CHUNK_SIZE):
+            fp.write(chunk)
+
+
+def _select_serialization(key: str, codec: str | None) -> tuple:
+    name = key.lower()
+    compression = "NONE"
+    for ext, compression_type in ((".gz", "GZIP"), (".bz2", "BZIP2")):
+        if name.endswith(ext):
+            name, compression = name[:-len(ext)], compression_type
+
+    if codec == "gzip":
+        compression = "GZIP"
+    elif codec is not None:
+        raise ValueError(f"S3 Select does not support {codec} compression")
+
+    if name.endswith((".tsv", ".tab")):
+        return ({"CSV": {"FileHeaderInfo": "USE", "FieldDelimiter": "\t"}, "CompressionType": compression},
+                {"CSV": {"FieldDelimiter": "\t"}})
+    if name.endswith(".csv"):
+        return {"CSV": {"FileHeaderInfo": "USE"}, "CompressionType": compression}, {"CSV": {}}
+    if name.endswith((".jsonl", ".ndjson")):
+        return {"JSON": {"Type": "LINES"}, "CompressionType": compression}, {"JSON": {}}
+    if name.endswith(".json"):
+        return {"JSON": {"Type": "DOCUMENT"}, "CompressionType": compression}, {"JSON": {}}
+    if name.endswith(".parquet"):
+        return {"Parquet": {}}, {"JSON": {}}
+    raise ValueError(f"S3 Select is not supported for {key}: unrecognized file type")
+
+
+def select_to_file(s3_obj, dest: str, expression: str) -> None:
+    """
+    Runs an S3 Select query against an object and writes the results to dest. The input format is
+    taken from the file extension:
+        .csv:             comma separated, first line is the header
+        .tsv, .tab:       tab separated, first line is the header
+        .json:            a single JSON document
+        .jsonl, .ndjson:  JSON lines
+        .parquet:         parquet
+
+    CSV and TSV results are written in the same format, without a header; JSON and parquet results
+    are written as JSON lines.
+    """
+    input_serialization, output_serialization = _select_serialization(s3_obj.key,
+                                                                       s3_obj.metadata.get(CODEC_METADATA_KEY))
+    response = s3_obj.meta.client.select_object_content(Bucket=s3_obj.bucket_name,
+                                                        Key=s3_obj.key,
+                                                        Expression=expression,
+                                                        ExpressionType="SQL",
+                                                        InputSerialization=input_serialization,
+                                                        OutputSerialization=output_serialization)
+    with open(dest, "wb") as fp:
+        for event in response["Payload"]:
+            if "Records" in event:
+                fp.write(event["Records"]["Payload"])
+            elif "Stats" in event:
+                details = event["Stats"]["Details"]
+                logger.info(f"S3 Select scanned {details['BytesScanned']} bytes, "
+                            f"returned {details['BytesReturned']} bytes")
+
+
+def sweep_partials(scratch_path: str) -> None:
+    """
+    Removes partial downloads that nobody has touched in a day.
+    """
+    partial_dir = os.path.join(scratch_path, PARTIAL_DIR)
+    if not os.path.isdir(partial_dir):
+        return
+
+    horizon = time.time() - PARTIAL_MAX_AGE_SECONDS
+    for entry in os.scandir(partial_dir):
+        if entry.name.endswith(".part") and entry.stat().st_mtime < horizon:
+            fd = os.open(entry.path, os.O_RDONLY)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                logger.info(f"removing stale partial download {entry.name}")
+                os.remove(entry.path)
+                progress_path = entry.path[:-len(".part")] + ".json"
+                if os.path.exists(progress_path):
+                    os.remove(progress_path)
+            except BlockingIOError:
+                pass
+            finally:
+                os.close(fd)
@@ -0,0 +1,102 @@
+import fnmatch
+import glob as g
+import logging
+import os
+import re
+from typing import Dict, Generator, Hashable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Pattern(object):
+    """
+    A shell-style glob pattern, relative to the current directory, split into path components.
+    Follows the same rules as glob.glob(..., recursive=True): "**" matches zero or more directories,
+    and wildcards don't match names starting with a dot.
+    """
+    def __init__(self, pattern: str):
+        self.prefix = ""
+        while pattern.startswith("./"):
+            self.prefix += "./"
+            pattern = pattern[2:]
+        self.components = [c for c in pattern.split("/") if c]
+        self.regexes = [None if c == "**" else re.compile(fnmatch.translate(c)) for c in self.components]
+
+    def _component_match(self, i: int, name: str) -> bool:
+        if name.startswith(".") and not self.components[i].startswith("."):
+            return False
+        return self.regexes[i].match(name) is not None
+
+    def _match(self, i: int, parts: Tuple[str, ...], partial: bool) -> bool:
+        if i == len(self.components):
+            return not parts and not partial
+        if not parts:
+            # a directory is worth descending into if there are components left to match below it.
+            # Otherwise, trailing "**"s can match nothing
+            return partial or all(r is None for r in self.regexes[i:])
+
+        if self.regexes[i] is None:
+            return (self._match(i + 1, parts, partial) or
+                    (not parts[0].startswith(".") and self._match(i, parts[1:], partial)))
+
+        return self._component_match(i, parts[0]) and self._match(i + 1, parts[1:], partial)
+
+    def matches(self, parts: Tuple[str, ...]) -> bool:
+        return self._match(0, parts, partial=False)
+
+    def could_contain(self, parts: Tuple[str, ...]) -> bool:
+        return self._match(0, parts, partial=True)
+
+
+def _walkable(pattern: str) -> bool:
+    # absolute paths and paths outside the current directory are left to glob.glob
+    return not (os.path.isabs(pattern) or ".." in pattern.split("/"))
+
+
+def iglob_many(patterns: Dict[Hashable, str]) -> Generator[Tuple[Hashable, str], None, None]:
+    """
+    Expands several glob patterns at once, yielding (key, path) pairs as matches are found. Patterns
+    without wildcards are just checked for existence. The rest are matched together in a single
+    os.scandir walk of the current directory, which only descends into directories that could hold
+    a match for at least one pattern.
+
+    Logs a warning for each pattern that matches nothing.
+    """
+    found = set()
+    walkers: List[Tuple[Hashable, _Pattern]] = []
+
+    for key, pattern in patterns.items():
+        if not g.has_magic(pattern):
+            if os.path.lexists(pattern):
+                found.add(key)
+                yield key, pattern
+        elif _walkable(pattern):
+            walkers.append((key, _Pattern(pattern)))
+        else:
+            for path in g.iglob(pattern, recursive=True):
+                found.add(key)
+                yield key, path
+
+    if walkers:
+        stack = [()]
+        while stack:
+            dir_parts = stack.pop()
+            dir_path = os.path.join(".", *dir_parts)
+            try:
+                entries = list(os.scandir(dir_path))
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+
+            for entry in entries:
+                parts = dir_parts + (entry.name,)
+                for key, pattern in walkers:
+                    if pattern.matches(parts):
+                        found.add(key)
+                        yield key, pattern.prefix + "/".join(parts)
+
+                if entry.is_dir() and any(pattern.could_contain(parts) for _, pattern in walkers):
+                    stack.append(parts)
+
+    for key, pattern in patterns.items():
+        if key not in found:
+            logger.warning(f"no file matching '{pattern}' found in workspace")
@@ -0,0 +1,111 @@
+from contextlib import contextmanager
+import ctypes
+import logging
+import os
+import select
+import struct
+import threading
+from typing import Callable, Dict, Generator
+
+logger = logging.getLogger(__name__)
+
+# from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct("iIII")
+POLL_SECONDS = 0.5
+
+
+class _Inotify(object):
+    def __init__(self):
+        # CDLL(None) finds the symbols in whatever libc the interpreter is linked to (glibc or musl)
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.dirs: Dict[int, str] = {}
+
+    def add_tree(self, top: str) -> None:
+        for dirpath, _, _ in os.walk(top):
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dirpath), WATCH_MASK)
+            if wd < 0:
+                logger.warning(f"unable to watch {dirpath}: {os.strerror(ctypes.get_errno())}")
+            else:
+                self.dirs[wd] = dirpath
+
+    def events(self) -> Generator[tuple, None, None]:
+        try:
+            buf = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return
+
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(buf, offset)
+            offset += EVENT_HEADER.size
+            name = buf[offset:offset + length].rstrip(b"\0").decode()
+            offset += length
+
+            if mask & IN_IGNORED:
+                self.dirs.pop(wd, None)
+            elif mask & IN_Q_OVERFLOW:
+                logger.warning("file watcher event queue overflowed, some files may not be uploaded early")
+            elif wd in self.dirs:
+                yield mask, os.path.join(self.dirs[wd], name)
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def _watch(ino: _Inotify, top: str, callback: Callable[[str], None], stop: threading.Event) -> None:
+    try:
+        while not stop.is_set():
+            ready, _, _ = select.select([ino.fd], [], [], POLL_SECONDS)
+            if not ready:
+                continue
+            for mask, path in ino.events():
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        # catches the directory itself plus anything written to it before the watch was set
+                        ino.add_tree(path)
+                        for dirpath, _, filenames in os.walk(path):
+                            for filename in filenames:
+                                callback(os.path.relpath(os.path.join(dirpath, filename), top))
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    callback(os.path.relpath(path, top))
+    except Exception:
+        logger.exception("file watcher failed, remaining outputs will be uploaded after the commands finish")
+    finally:
+        ino.close()
+
+
+@contextmanager
+def watch_files(top: str, callback: Callable[[str], None]) -> Generator[None, None, None]:
+    """
+    Calls callback with the path (relative to top) of every file under top that is closed after
+    writing or moved into place while the context is active. The callback runs on the watcher
+    thread, so it should hand off any real work.
+    """
+    try:
+        ino = _Inotify()
+        ino.add_tree(top)
+    except (AttributeError, OSError) as e:
+        logger.warning(f"unable to watch {top} for finished files: {e}")
+        yield
+        return
+
+    stop = threading.Event()
+    thread = threading.Thread(target=_watch, args=(ino, top, callback, stop), daemon=True)
+    thread.start()
+
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import logging
+import mmap
+import os
+from urllib.parse import urlparse
+import uuid
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+URL_SCHEMES = ("http://", "https://")
+PART_SIZE = 16 * 1024 ** 2
+WORKERS = 8
+CHUNK_SIZE = 1024 ** 2
+TIMEOUT = 60
+
+
+def is_url(path: str) -> bool:
+    return path.startswith(URL_SCHEMES)
+
+
+class WebObject(object):
+    """
+    Just enough of the boto3 S3 Object interface (content_length, download_file) to let the reference
+    cache and the input downloader treat an http(s) URL like an S3 object.
+    """
+    def __init__(self, url: str):
+        self.url = url
+        self.name = os.path.basename(urlparse(url).path)
+
+        # a one-byte range request instead of HEAD, because presigned S3 URLs are only good for GETs
+        with requests.get(url, headers={"Range": "bytes=0-0"}, stream=True, timeout=TIMEOUT) as response:
+            if response.status_code == 404:
+                raise FileNotFoundError(url)
+            response.raise_for_status()
+
+            self.e_tag = response.headers.get("ETag")
+            self.last_modified = response.headers.get("Last-Modified")
+            total = response.headers.get("Content-Range", "*").rsplit("/", 1)[-1]
+
+            if response.status_code == 206 and total != "*":
+                self.content_length = int(total)
+                self.accepts_ranges = True
+            else:
+                self.content_length = int(response.headers.get("Content-Length", -1))
+                self.accepts_ranges = False
+
+    @property
+    def cache_tag(self) -> str | None:
+        """
+        Identifies this version of the object, or None if the server doesn't give enough information
+        to tell versions apart. Query strings are left out so that re-signed presigned URLs for the same
+        object share a cache entry.
+        """
+        validator = self.e_tag or self.last_modified
+        if validator is None:
+            return None
+        parsed = urlparse(self.url)
+        base = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
+        return hashlib.sha256(f"{base}\n{validator}".encode("utf-8")).hexdigest()
+
+    def _if_range(self) -> dict:
+        # weak ETags aren't allowed in If-Range
+        if self.e_tag is not None and not self.e_tag.startswith("W/"):
+            return {"If-Range": self.e_tag}
+        if self.last_modified is not None:
+            return {"If-Range": self.last_modified}
+        return {}
+
+    def _download_to(self, path: str) -> None:
+        if not self.accepts_ranges or self.content_length <= PART_SIZE:
+            with requests.get(self.url, stream=True, timeout=TIMEOUT) as response, open(path, "wb") as fp:
+                response.raise_for_status()
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    fp.write(chunk)
+            return
+
+        headers = self._if_range()
+
+        def _fetch(start: int) -> None:
+            end = min(start + PART_SIZE, self.content_length) - 1
+            with requests.get(self.url, headers=headers | {"Range": f"bytes={start}-{end}"},
+                              stream=True, timeout=TIMEOUT) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise RuntimeError(f"{self.url} changed during download")
+                offset = start
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    mm[offset:offset + len(chunk)] = chunk
+                    offset += len(chunk)
+
+        with open(path, "wb+") as fp:
+            fp.truncate(self.content_length)
+            with mmap.mmap(fp.fileno(), self.content_length) as mm, \
+                    ThreadPoolExecutor(max_workers=WORKERS) as executor:
+                list(executor.map(_fetch, range(0, self.content_length, PART_SIZE)))
+                mm.flush()
+
+    def download_file(self, dest: str) -> None:
+        """
+        Downloads the object to dest, in parallel byte ranges if the server supports them and the
+        object is bigger than PART_SIZE. Like boto3's download_file, the data goes to a temp file in
+        the same directory that is renamed to dest once it's complete, so a failed download never
+        leaves a partial file at dest.
+        """
+        tmp_path = f"{dest}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            self._download_to(tmp_path)
+            os.replace(tmp_path, dest)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
@@ -1,15 +1,33 @@
 from contextlib import contextmanager
+import fcntl
 import json
 import logging
 import os
 import shutil
+import threading
+import time
 from tempfile import mkdtemp, NamedTemporaryFile
 from typing import Generator
 
 from .dind import run_child_container
+from .lazy import sweep_blocks
+from .transfer import sweep_partials
 
 logger = logging.getLogger(__name__)
 
+WORKSPACE_PREFIX = "bclaw_wrk_"
+NATIVE_WORKSPACE_PREFIX = "bclaw_native_"
+TRASH_DIR = "_bclaw_trash"
+SWEEP_GRACE_SECONDS = 60
+# native workspaces go unlocked between containers, so give them longer. Their user containers touch them
+# every NATIVE_HEARTBEAT_SECONDS
+NATIVE_SWEEP_GRACE_SECONDS = 10 * 60
+NATIVE_HEARTBEAT_SECONDS = 60
+
+NATIVE_SCRIPT = "_bclaw_native.sh"
+NATIVE_EXIT_CODE_FILE = "_bclaw_exit_code"
+NATIVE_SKIP_FILE = "_bclaw_skip"
+
 
 class UserCommandsFailed(Exception):
     def __init__(self, message: str, exit_code:int):
@@ -17,13 +35,101 @@ class UserCommandsFailed(Exception):
         self.exit_code = exit_code
 
 
+def _try_lock(path: str) -> int | None:
+    # returns an open file descriptor holding an exclusive lock on path, or None if
+    # some other process holds a lock on it
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return fd
+    except BlockingIOError:
+        os.close(fd)
+        return None
+
+
+def _empty_trash(trash_path: str) -> None:
+    for entry in os.scandir(trash_path):
+        logger.debug(f"deleting {entry.path}")
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _move_to_trash(path: str, trash_path: str) -> None:
+    os.makedirs(trash_path, exist_ok=True)
+    os.rename(path, os.path.join(trash_path, os.path.basename(path)))
+
+
+def sweep_scratch(scratch_path: str) -> None:
+    """
+    Reclaims scratch space left behind by previous jobs on this instance: empties the trash,
+    moves orphaned workspaces into it, and removes stale cache lock files, partial downloads,
+    and lazy input blocks.
+
+    Every running job holds a shared flock on its workspace directory. The lock disappears when the
+    job's process dies, even if it is SIGKILLed, so a workspace that can be locked exclusively
+    belongs to a dead job. Workspaces modified in the last minute are left alone, since their owners
+    may not have locked them yet. Native workspaces are only locked while a runner container is
+    working in them, so they get NATIVE_SWEEP_GRACE_SECONDS instead. Lock files are only removed if
+    they are unlocked and older than every live workspace.
+    """
+    trash_path = os.path.join(scratch_path, TRASH_DIR)
+    now = time.time()
+    live_mtimes = []
+
+    try:
+        for entry in os.scandir(scratch_path):
+            if not entry.is_dir(follow_symlinks=False):
+                continue
+            if entry.name.startswith(WORKSPACE_PREFIX):
+                grace_time = now - SWEEP_GRACE_SECONDS
+            elif entry.name.startswith(NATIVE_WORKSPACE_PREFIX):
+                grace_time = now - NATIVE_SWEEP_GRACE_SECONDS
+            else:
+                continue
+            if (mtime := entry.stat().st_mtime) > grace_time or (fd := _try_lock(entry.path)) is None:
+                live_mtimes.append(mtime)
+            else:
+                try:
+                    logger.info(f"reclaiming orphaned workspace {entry.name}")
+                    _move_to_trash(entry.path, trash_path)
+                finally:
+                    os.close(fd)
+
+        horizon = min(live_mtimes, default=0)
+        for entry in os.scandir(scratch_path):
+            if entry.name.endswith(".lock") and entry.is_file() and entry.stat().st_mtime < horizon:
+                if (fd := _try_lock(entry.path)) is not None:
+                    try:
+                        logger.info(f"removing stale lock file {entry.name}")
+                        os.remove(entry.path)
+                    finally:
+                        os.close(fd)
+
+        sweep_partials(scratch_path)
+        sweep_blocks(scratch_path)
+
+        if os.path.isdir(trash_path):
+            _empty_trash(trash_path)
+
+    except Exception:
+        logger.warning("scratch volume sweep failed, continuing")
+
+
 @contextmanager
 def workspace() -> Generator[str, None, None]:
     orig_path = os.getcwd()
-    work_path = mkdtemp(dir=os.environ["BC_SCRATCH_PATH"])
+    scratch_path = os.environ["BC_SCRATCH_PATH"]
+    work_path = mkdtemp(prefix=WORKSPACE_PREFIX, dir=scratch_path)
 
     logger.debug(f"workspace={work_path}")
 
+    # hold a shared lock on the workspace for as long as this job is alive. This tells
+    # sweep_scratch (in this or any other job on this instance) not to touch it
+    lock_fd = os.open(work_path, os.O_RDONLY)
+    fcntl.flock(lock_fd, fcntl.LOCK_SH)
+
+    sweeper = threading.Thread(target=sweep_scratch, args=(scratch_path,), daemon=True)
+    sweeper.start()
+
     try:
         os.chdir(work_path)
         yield work_path
@@ -31,17 +137,73 @@ def workspace() -> Generator[str, None, None]:
     finally:
         logger.debug("cleaning up workspace")
         os.chdir(orig_path)
-        shutil.rmtree(work_path, ignore_errors=True)
+        os.close(lock_fd)
+
+        # renaming the workspace is quick no matter how many files it contains. Deletion happens
+        # in the background; if the runner exits first, the next job on this instance will finish it
+        trash_path = os.path.join(scratch_path, TRASH_DIR)
+        try:
+            _move_to_trash(work_path, trash_path)
+            cleaner = threading.Thread(target=_empty_trash, args=(trash_path,), daemon=True)
+            cleaner.start()
+        except OSError:
+            logger.warning("unable to move workspace to trash, deleting in place")
+            shutil.rmtree(work_path, ignore_errors=True)
         logger.debug("cleanup finished")
 
 
+def _native_work_path() -> str:
+    ret = os.path.join(os.environ["BC_SCRATCH_PATH"], f"{NATIVE_WORKSPACE_PREFIX}{os.environ['AWS_BATCH_JOB_ID']}")
+    return ret
+
+
+@contextmanager
+def native_workspace(cleanup: bool) -> Generator[str, None, None]:
+    """
+    In native mode, the stage-in runner, the user's command block, and the stage-out runner run in
+    separate containers of the same Batch job, so they can't share a randomly named temp dir. They
+    use a workspace named for the Batch job ID instead. Each runner holds a shared lock on it while it
+    works, like workspace() does, and the user's container keeps its mtime fresh (see write_native_script),
+    so sweep_scratch only reclaims it once the job is gone. The stage-out runner cleans up.
+    """
+    orig_path = os.getcwd()
+    scratch_path = os.environ["BC_SCRATCH_PATH"]
+    work_path = _native_work_path()
+    os.makedirs(work_path, exist_ok=True)
+
+    logger.debug(f"workspace={work_path}")
+
+    lock_fd = os.open(work_path, os.O_RDONLY)
+    fcntl.flock(lock_fd, fcntl.LOCK_SH)
+
+    try:
+        os.chdir(work_path)
+        yield work_path
+
+    finally:
+        os.chdir(orig_path)
+        if cleanup:
+            os.close(lock_fd)
+            logger.debug("cleaning up workspace")
+            try:
+                _move_to_trash(work_path, os.path.join(scratch_path, TRASH_DIR))
+            except OSError:
+                logger.warning("unable to move workspace to trash, deleting in place")
+                shutil.rmtree(work_path, ignore_errors=True)
+            logger.debug("cleanup finished")
+        else:
+            # start the grace period over for the hand-off to the next container
+            os.utime(work_path)
+            os.close(lock_fd)
+
+
 def write_job_data_file(job_data: dict, dest_dir: str) -> str:
     with NamedTemporaryFile(prefix="job_data_", suffix=".json", dir=dest_dir, mode="w", delete=False) as fp:
         json.dump(job_data, fp)
     return fp.name
 
 
-def run_commands(image_spec: dict, commands: list, work_dir: str, job_data_file: str, shell_opt: str) -> None:
+def _write_command_script(commands: list, shell_opt: str) -> str:
     script_file = "_commands.sh"
 
     with open(script_file, "w") as fp:
@@ -60,9 +222,62 @@ def run_commands(image_spec: dict, commands: list, work_dir: str, job_data_file:
         raise RuntimeError(f"unrecognized shell: {shell_opt}")
 
     os.chmod(script_file, 0o700)
-    command = f"{shell_cmd} {script_file}"
+    ret = f"{shell_cmd} {script_file}"
+    return ret
+
+
+def run_commands(image_spec: dict, commands: list, work_dir: str, job_data_file: str, shell_opt: str,
+                 limits: dict) -> None:
+    command = _write_command_script(commands, shell_opt)
+
+    if (exit_code := run_child_container(image_spec, command, work_dir, job_data_file, limits)) == 0:
+        logger.info("command block succeeded")
+    else:
+        logger.error("command block failed")
+        raise UserCommandsFailed(f"command block failed with exit code {exit_code}", exit_code)
+
+
+def write_native_script(commands: list, work_dir: str, job_data_file: str, shell_opt: str) -> None:
+    # the user's container runs this script in place of the docker-in-docker child container
+    command = _write_command_script(commands, shell_opt)
+
+    with open(NATIVE_SCRIPT, "w") as fp:
+        print(f"cd {work_dir}", file=fp)
+        print(f"export BC_WORKSPACE={work_dir}", file=fp)
+        print(f"export BC_JOB_DATA_FILE={job_data_file}", file=fp)
+        # tells sweep_scratch that the workspace is still in use
+        print(f"(while true; do touch {work_dir}; sleep {NATIVE_HEARTBEAT_SECONDS}; done) &", file=fp)
+        print("heartbeat=$!", file=fp)
+        print(command, file=fp)
+        print(f"echo $? > {NATIVE_EXIT_CODE_FILE}", file=fp)
+        print("kill $heartbeat", file=fp)
+
+    logger.info("command block staged for native execution")
+
+
+def write_native_skip() -> None:
+    # tells the user's container and the stage-out runner that this step is being skipped
+    work_path = _native_work_path()
+    os.makedirs(work_path, exist_ok=True)
+    open(os.path.join(work_path, NATIVE_SKIP_FILE), "w").close()
+    with open(os.path.join(work_path, NATIVE_SCRIPT), "w") as fp:
+        print("exit 0", file=fp)
+
+
+def native_skip_requested() -> bool:
+    ret = os.path.isfile(os.path.join(_native_work_path(), NATIVE_SKIP_FILE))
+    return ret
+
+
+def check_native_commands() -> None:
+    try:
+        with open(NATIVE_EXIT_CODE_FILE) as fp:
+            exit_code = int(fp.read().strip())
+    except (OSError, ValueError):
+        logger.error("no exit code found for command block")
+        exit_code = 255
 
-    if (exit_code := run_child_container(image_spec, command, work_dir, job_data_file)) == 0:
+    if exit_code == 0:
         logger.info("command block succeeded")
     else:
         logger.error("command block failed")
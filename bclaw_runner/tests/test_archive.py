@@ -0,0 +1,120 @@
+import json
+import os
+import tarfile
+
+import boto3
+import moto
+import pytest
+
+from ..src.runner.archive import upload_archive, extract_archive, download_member, index_key, is_index_key
+from ..src.runner.codec import zstd
+
+needs_zstd = pytest.mark.skipif(zstd is None, reason="zstd needs Python 3.14")
+
+TEST_BUCKET = "test-bucket"
+
+
+@pytest.fixture(scope="module")
+def mock_bucket():
+    with moto.mock_aws():
+        bucket = boto3.resource("s3", region_name="us-east-1").Bucket(TEST_BUCKET)
+        bucket.create()
+        yield bucket
+
+
+@pytest.mark.parametrize("archive_key, expect", [
+    ("repo/path/genes", "repo/path/_archive_index_/genes.json"),
+    ("genes", "_archive_index_/genes.json"),
+])
+def test_index_key(archive_key, expect):
+    result = index_key(archive_key)
+    assert result == expect
+    assert is_index_key(result)
+    assert not is_index_key(archive_key)
+
+
+@pytest.fixture(scope="function")
+def local_dir(tmp_path):
+    ret = tmp_path / "genes"
+    os.makedirs(ret / "sub")
+    (ret / "gene1.json").write_text('{"gene": 1}')
+    (ret / "sub" / "gene2.json").write_text('{"gene": 2}' * 1000)
+    (ret / "empty.json").write_text("")
+    return ret
+
+
+@pytest.mark.parametrize("codec", [None, "gzip", pytest.param("zstd", marks=needs_zstd)])
+def test_upload_extract_archive(mock_bucket, local_dir, tmp_path, codec):
+    s3_obj = mock_bucket.Object(f"archives/{codec}/genes")
+    index_obj = mock_bucket.Object(f"archives/{codec}/_archive_index_/genes.json")
+
+    count = upload_archive(s3_obj, index_obj, str(local_dir), {"Metadata": {"execution_id": "ELVISLIVES"}}, codec)
+    assert count == 3
+
+    s3_obj.reload()
+    expected_metadata = {"execution_id": "ELVISLIVES", "bclaw_archive": "tar"}
+    if codec is not None:
+        expected_metadata["bclaw_codec"] = codec
+    assert s3_obj.metadata == expected_metadata
+
+    index = json.loads(index_obj.get()["Body"].read())
+    assert index["format"] == "tar"
+    assert index["codec"] == codec
+    assert [m["name"] for m in index["members"]] == ["empty.json", "gene1.json", "sub/gene2.json"]
+
+    dest = tmp_path / "extracted"
+    extract_archive(s3_obj, str(dest))
+    assert (dest / "gene1.json").read_text() == '{"gene": 1}'
+    assert (dest / "sub" / "gene2.json").read_text() == '{"gene": 2}' * 1000
+    assert (dest / "empty.json").read_text() == ""
+
+
+def test_upload_archive_index_offsets(mock_bucket, local_dir, tmp_path):
+    s3_obj = mock_bucket.Object("archives/offsets/genes")
+    index_obj = mock_bucket.Object("archives/offsets/_archive_index_/genes.json")
+    upload_archive(s3_obj, index_obj, str(local_dir), {})
+
+    raw = s3_obj.get()["Body"].read()
+    index = json.loads(index_obj.get()["Body"].read())
+    for member in index["members"]:
+        expected = (local_dir / member["name"]).read_bytes()
+        assert raw[member["offset"]:member["offset"] + member["size"]] == expected
+
+
+@pytest.mark.parametrize("codec", [None, pytest.param("zstd", marks=needs_zstd)])
+@pytest.mark.parametrize("member, expect", [
+    ("gene1.json", '{"gene": 1}'),
+    ("sub/gene2.json", '{"gene": 2}' * 1000),
+    ("empty.json", ""),
+])
+def test_download_member(mock_bucket, local_dir, tmp_path, codec, member, expect):
+    s3_obj = mock_bucket.Object(f"archives/members/{codec}/genes")
+    index_obj = mock_bucket.Object(f"archives/members/{codec}/_archive_index_/genes.json")
+    upload_archive(s3_obj, index_obj, str(local_dir), {}, codec)
+
+    dest = tmp_path / "member"
+    download_member(s3_obj, member, str(dest))
+    assert dest.read_text() == expect
+
+
+def test_download_member_missing(mock_bucket, local_dir, tmp_path):
+    s3_obj = mock_bucket.Object("archives/missing/genes")
+    index_obj = mock_bucket.Object("archives/missing/_archive_index_/genes.json")
+    upload_archive(s3_obj, index_obj, str(local_dir), {})
+
+    with pytest.raises(FileNotFoundError, match="genes#nope.json"):
+        download_member(s3_obj, "nope.json", str(tmp_path / "nope.json"))
+
+
+def test_upload_archive_fail(mock_bucket, tmp_path, monkeypatch):
+    def crashy_write_tar(fp, *_):
+        fp.write(b"partial archive")
+        raise PermissionError("can't read that")
+
+    monkeypatch.setattr("bclaw_runner.src.runner.archive._write_tar", crashy_write_tar)
+    s3_obj = mock_bucket.Object("archives/fail/genes")
+    index_obj = mock_bucket.Object("archives/fail/_archive_index_/genes.json")
+
+    with pytest.raises(PermissionError):
+        upload_archive(s3_obj, index_obj, str(tmp_path), {})
+    assert len(list(mock_bucket.objects.filter(Prefix="archives/fail/"))) == 0
@@ -53,6 +53,22 @@ def test_blocking_download_blocked(tmp_path, s3_bucket):
     os.remove(lock_file)
 
 
+def test_blocking_download_failed(tmp_path):
+    class _Broken(object):
+        content_length = 99
+
+        def download_file(self, dest):
+            with open(dest, "wb") as fp:
+                fp.write(b"partial")
+            raise RuntimeError("connection reset")
+
+    dst = f"{tmp_path}/cache/file1"
+    with pytest.raises(RuntimeError, match="connection reset"):
+        _blocking_download(_Broken(), dst, "file1")
+    assert not os.path.exists(dst)
+    assert not os.path.exists(f"{tmp_path}/cache.lock")
+
+
 def test_download_to_cache(monkeypatch, tmp_path, s3_bucket):
     monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
 
@@ -122,3 +138,36 @@ def test_get_reference_inputs_fail(monkeypatch, tmp_path, s3_bucket):
 
     with pytest.raises(Exception):
         _ = get_reference_inputs(ref_spec)
+
+
+def test_download_to_cache_url(monkeypatch, tmp_path, requests_mock):
+    monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    url = "https://example.com/refs/genome.fa?sig=123"
+    requests_mock.get(url, content=b"ACGT", headers={"ETag": '"abc"'})
+
+    key, cached_file = _download_to_cache(("ref", url))
+    assert key == "ref"
+    assert cached_file.startswith(str(tmp_path))
+    assert os.path.basename(cached_file) == "genome.fa"
+    with open(cached_file, "rb") as fp:
+        assert fp.read() == b"ACGT"
+
+    # second call is a cache hit
+    _, cached_file2 = _download_to_cache(("ref", url))
+    assert cached_file2 == cached_file
+    assert requests_mock.call_count == 3
+
+
+def test_get_reference_inputs_uncacheable_url(monkeypatch, tmp_path, requests_mock):
+    monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    url = "https://example.com/refs/genome.fa"
+    requests_mock.get(url, content=b"ACGT")
+
+    workspace = f"{str(tmp_path)}/workdir"
+    os.makedirs(workspace)
+    os.chdir(workspace)
+
+    result = get_reference_inputs({"ref": url})
+    assert result == {"ref": "genome.fa"}
+    with open("genome.fa", "rb") as fp:
+        assert fp.read() == b"ACGT"
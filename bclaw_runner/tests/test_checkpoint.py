@@ -0,0 +1,121 @@
+import json
+import os
+import signal
+
+import boto3
+import moto
+import pytest
+
+from ..src.runner.checkpoint import Checkpoint, CHECKPOINT_REQUEST_FILE
+from ..src.runner.repo import Repository
+
+TEST_BUCKET = "test-bucket"
+
+
+@pytest.fixture(scope="function")
+def mock_bucket(monkeypatch):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    monkeypatch.setenv("BC_EXECUTION_ID", "exec-12345")
+    monkeypatch.setenv("AWS_BATCH_JOB_ID", "job-12345")
+    with moto.mock_aws():
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        bucket = s3.Bucket(TEST_BUCKET)
+        bucket.create()
+        yield bucket
+
+
+def test_save(mock_bucket, tmp_path, monkeypatch, mocker):
+    signaller = mocker.patch("bclaw_runner.src.runner.checkpoint.signal_child_container")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+
+    os.chdir(tmp_path)
+    os.makedirs("ckpt/sub")
+    for filename in ["ckpt/state1", "ckpt/sub/state2", "partial_output", "not_saved"]:
+        with open(filename, "w") as fp:
+            print(filename, file=fp)
+
+    pending = mock_bucket.meta.client.create_multipart_upload(Bucket=TEST_BUCKET, Key="repo/path/partial_output")
+    # another step writing to the same repo
+    mock_bucket.meta.client.create_multipart_upload(Bucket=TEST_BUCKET, Key="repo/path/other_output")
+    mock_bucket.meta.client.create_multipart_upload(Bucket=TEST_BUCKET, Key="repo/path/sub/partial_output")
+
+    spec = {"files": ["ckpt/**"], "signal": "SIGUSR1", "wait": 0}
+    outputs = {"partial": {"name": "partial_output", "s3_tags": {}},
+               "missing": {"name": "missing_output", "s3_tags": {}}}
+    checkpoint = Checkpoint(repo, spec, {})
+    checkpoint.save(str(tmp_path), outputs)
+
+    assert os.path.isfile(CHECKPOINT_REQUEST_FILE)
+    signaller.assert_called_once_with(str(tmp_path), signal.SIGUSR1)
+
+    keys = sorted(o.key for o in mock_bucket.objects.all())
+    assert keys == [
+        "repo/path/_checkpoint_/test_step/exec-12345/_multipart_uploads.json",
+        "repo/path/_checkpoint_/test_step/exec-12345/ckpt/state1",
+        "repo/path/_checkpoint_/test_step/exec-12345/ckpt/sub/state2",
+        "repo/path/partial_output",
+    ]
+
+    record = json.loads(mock_bucket.Object("repo/path/_checkpoint_/test_step/exec-12345/_multipart_uploads.json")
+                        .get()["Body"].read())
+    assert record == [{"Bucket": TEST_BUCKET, "Key": "repo/path/partial_output", "UploadId": pending["UploadId"]}]
+
+
+def test_restore(mock_bucket, tmp_path):
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+
+    pending = mock_bucket.meta.client.create_multipart_upload(Bucket=TEST_BUCKET, Key="repo/path/big_output")
+    record = [{"Bucket": TEST_BUCKET, "Key": "repo/path/big_output", "UploadId": pending["UploadId"]}]
+    mock_bucket.put_object(Key="repo/path/_checkpoint_/test_step/exec-12345/_multipart_uploads.json",
+                           Body=json.dumps(record).encode("utf-8"))
+    mock_bucket.put_object(Key="repo/path/_checkpoint_/test_step/exec-12345/ckpt/state1", Body=b"state one")
+    mock_bucket.put_object(Key="repo/path/_checkpoint_/test_step/other-exec/ckpt/state2", Body=b"state two")
+
+    checkpoint = Checkpoint(repo, {"files": ["ckpt/*"]}, {})
+    checkpoint.restore(str(tmp_path))
+
+    with open(tmp_path / "ckpt" / "state1") as fp:
+        assert fp.read() == "state one"
+    assert not os.path.exists(tmp_path / "ckpt" / "state2")
+    assert not os.path.exists(tmp_path / "_multipart_uploads.json")
+
+    uploads = mock_bucket.meta.client.list_multipart_uploads(Bucket=TEST_BUCKET)
+    assert "Uploads" not in uploads
+
+    checkpoint.clear()
+    keys = [o.key for o in mock_bucket.objects.all()]
+    assert keys == ["repo/path/_checkpoint_/test_step/other-exec/ckpt/state2"]
+
+
+def test_no_checkpoint(mock_bucket, tmp_path, mocker):
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+    mock_bucket.put_object(Key="repo/path/_checkpoint_/test_step/exec-12345/ckpt/state1", Body=b"state one")
+    saver = mocker.patch.object(Checkpoint, "save")
+
+    checkpoint = Checkpoint(repo, {}, {})
+    checkpoint.restore(str(tmp_path))
+    with checkpoint.armed(str(tmp_path), {}):
+        pass
+    checkpoint.clear()
+
+    assert os.listdir(tmp_path) == []
+    saver.assert_not_called()
+    assert len(list(mock_bucket.objects.all())) == 1
+
+
+def test_restore_retried_job(mock_bucket, tmp_path, monkeypatch):
+    # Step Functions retries the step as a new Batch job
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+    os.chdir(tmp_path)
+    os.makedirs("first/ckpt")
+    with open("first/ckpt/state1", "w") as fp:
+        fp.write("state one")
+
+    Checkpoint(repo, {"files": ["ckpt/*"], "wait": 0}, {}).save(str(tmp_path / "first"), {})
+
+    monkeypatch.setenv("AWS_BATCH_JOB_ID", "job-67890")
+    os.makedirs("second")
+    Checkpoint(repo, {"files": ["ckpt/*"]}, {}).restore(str(tmp_path / "second"))
+
+    with open(tmp_path / "second" / "ckpt" / "state1") as fp:
+        assert fp.read() == "state one"
@@ -0,0 +1,49 @@
+import gzip
+import io
+
+import pytest
+
+from ..src.runner.codec import CompressingReader, decompress_to_file, zstd
+
+needs_zstd = pytest.mark.skipif(zstd is None, reason="zstd needs Python 3.14")
+
+CONTENT = b"chrom\tpos\tref\talt\n" + b"chr1\t12345\tA\tG\n" * 100000
+
+
+class FakeBody(io.BytesIO):
+    def iter_chunks(self, chunk_size):
+        while chunk := self.read(chunk_size):
+            yield chunk
+
+
+@pytest.mark.parametrize("codec, decompress", [
+    ("gzip", gzip.decompress),
+    pytest.param("zstd", lambda b: zstd.decompress(b), marks=needs_zstd),
+])
+def test_compressing_reader(codec, decompress):
+    reader = CompressingReader(io.BytesIO(CONTENT), codec)
+    compressed = b""
+    while chunk := reader.read(1000):
+        compressed += chunk
+
+    assert len(compressed) < len(CONTENT) / 10
+    assert decompress(compressed) == CONTENT
+
+
+@pytest.mark.parametrize("codec", ["gzip", pytest.param("zstd", marks=needs_zstd)])
+def test_decompress_to_file(tmp_path, codec):
+    compressed = CompressingReader(io.BytesIO(CONTENT), codec).read()
+    dest = tmp_path / "dest"
+    decompress_to_file(FakeBody(compressed), str(dest), codec)
+    assert dest.read_bytes() == CONTENT
+
+
+@pytest.mark.skipif(zstd is not None, reason="zstd is available")
+def test_zstd_unavailable():
+    with pytest.raises(RuntimeError, match="Python 3.14"):
+        CompressingReader(io.BytesIO(CONTENT), "zstd")
+
+
+def test_unsupported_codec():
+    with pytest.raises(ValueError, match="unsupported compression codec: lzma"):
+        CompressingReader(io.BytesIO(CONTENT), "lzma")
@@ -3,11 +3,11 @@ import pytest
 
 import boto3
 import docker
-from docker.types import DeviceRequest, DriverConfig, Mount
+from docker.types import DeviceRequest, DriverConfig, Mount, Ulimit
 import moto
 
-from ..src.runner.dind import (get_gpu_requests, get_container_metadata, get_mounts, get_environment_vars, get_auth,
-                               pull_image, run_child_container)
+from ..src.runner.dind import (get_gpu_requests, get_container_metadata, get_mounts, get_container_limits,
+                               get_environment_vars, get_auth, pull_image, run_child_container)
 
 
 TEST_SECRET_NAME = "test_secret"
@@ -127,6 +127,18 @@ def test_pull_image(image_spec, expected_source, expected_auth, monkeypatch, moc
         assert result.auth == expected_auth
 
 
+@pytest.mark.parametrize("limits, expect", [
+    ({}, {}),
+    ({"nano_cpus": 2000000000, "cpuset_cpus": "0-1", "cpuset_mems": "0", "shm_size": "1024m"},
+     {"nano_cpus": 2000000000, "cpuset_cpus": "0-1", "cpuset_mems": "0", "shm_size": "1024m"}),
+    ({"ulimits": [{"name": "nofile", "soft": 1024, "hard": 4096}, {"name": "memlock", "soft": -1, "hard": -1}]},
+     {"ulimits": [Ulimit(name="nofile", soft=1024, hard=4096), Ulimit(name="memlock", soft=-1, hard=-1)]}),
+])
+def test_get_container_limits(limits, expect):
+    result = get_container_limits(limits)
+    assert result == expect
+
+
 @pytest.mark.parametrize("exit_code", [0, 88])
 @pytest.mark.parametrize("logging_crash", [False, True])
 def test_run_child_container(caplog, monkeypatch, requests_mock, exit_code, logging_crash,
@@ -171,7 +183,7 @@ def test_run_child_container(caplog, monkeypatch, requests_mock, exit_code, logg
         "name": "local/image",
         "auth": "",
     }
-    result = run_child_container(image_spec, "ls -l", f"{bc_scratch_path}/parent/workspace", job_data_file)
+    result = run_child_container(image_spec, "ls -l", f"{bc_scratch_path}/parent/workspace", job_data_file, {})
 
     assert test_container.args[0].tags == ["local/image"]
     assert test_container.args[1] == "ls -l"
@@ -187,6 +199,7 @@ def test_run_child_container(caplog, monkeypatch, requests_mock, exit_code, logg
             "BC_WORKSPACE": bc_scratch_path,
         },
         "init": True,
+        "labels": {"bclaw.workspace": f"{bc_scratch_path}/parent/workspace"},
         "mem_limit": "2048m",
         "mounts": [Mount(bc_scratch_path, "/host/volume/scratch/parent/workspace", type="bind", read_only=False)],
         "version": "auto",
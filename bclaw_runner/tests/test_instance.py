@@ -84,6 +84,21 @@ def test_termination_checker_impl_with_exception(mocker, caplog):
     assert do_check.call_count == 2  # Ensure it was called twice despite exceptions
 
 
+def test_termination_checker_impl_calls_handlers(mocker):
+    mocker.patch("bclaw_runner.src.runner.instance._do_termination_check", side_effect=[False, True, True])
+    handler = mocker.MagicMock()
+    crashy_handler = mocker.MagicMock(side_effect=RuntimeError("crash"))
+    event = mocker.MagicMock()
+    event.is_set.side_effect = [False, False, False, True]
+
+    with instance.on_spot_termination(crashy_handler), instance.on_spot_termination(handler):
+        instance._termination_checker_impl(event, interval=0)
+
+    crashy_handler.assert_called_once()
+    handler.assert_called_once()
+    assert instance._termination_handlers == []
+
+
 def test_spot_termination_checker(monkeypatch, requests_mock, caplog):
     monkeypatch.setattr(instance, "TOKEN", "test_token")
     requests_mock.get("http://169.254.169.254/latest/meta-data/instance-life-cycle", text="spot")
@@ -0,0 +1,142 @@
+import os
+import time
+
+import boto3
+import moto
+import pytest
+import requests
+
+from ..src.runner import lazy
+from ..src.runner.lazy import serve_objects, sweep_blocks, evict_blocks, BLOCK_DIR
+
+TEST_BUCKET = "test-bucket"
+CONTENT = b"0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+@pytest.fixture(scope="module")
+def mock_object():
+    with moto.mock_aws():
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        bucket = s3.Bucket(TEST_BUCKET)
+        bucket.create()
+        bucket.put_object(Key="big/file.bam", Body=CONTENT)
+        yield s3.Object(TEST_BUCKET, "big/file.bam")
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    monkeypatch.setattr(lazy, "BLOCK_SIZE", 10)
+
+
+@pytest.mark.parametrize("byte_range, status, expect", [
+    (None, 200, CONTENT),
+    ("bytes=0-9", 206, CONTENT[:10]),
+    ("bytes=5-24", 206, CONTENT[5:25]),
+    ("bytes=30-", 206, CONTENT[30:]),
+    ("bytes=-4", 206, CONTENT[-4:]),
+    ("bytes=20-999", 206, CONTENT[20:]),
+])
+def test_serve_objects(mock_object, tmp_path, byte_range, status, expect):
+    with serve_objects({"file.bam": mock_object}, str(tmp_path)) as urls:
+        assert list(urls) == ["file.bam"]
+        headers = {} if byte_range is None else {"Range": byte_range}
+        response = requests.get(urls["file.bam"], headers=headers)
+    assert response.status_code == status
+    assert response.content == expect
+    assert response.headers["Accept-Ranges"] == "bytes"
+
+
+def test_serve_objects_caches_blocks(mock_object, tmp_path, mocker):
+    with serve_objects({"file.bam": mock_object}, str(tmp_path)) as urls:
+        requests.get(urls["file.bam"], headers={"Range": "bytes=12-15"})
+
+        block_dirs = os.listdir(tmp_path / BLOCK_DIR)
+        assert len(block_dirs) == 1
+        assert os.listdir(tmp_path / BLOCK_DIR / block_dirs[0]) == ["1"]
+
+        # a cached block is not fetched again
+        getter = mocker.patch.object(type(mock_object), "get")
+        response = requests.get(urls["file.bam"], headers={"Range": "bytes=10-19"})
+        assert response.content == CONTENT[10:20]
+        getter.assert_not_called()
+
+
+def test_serve_objects_evicts_blocks(mock_object, tmp_path, monkeypatch):
+    monkeypatch.setattr(lazy, "BLOCK_CACHE_MAX_BYTES", 20)
+    monkeypatch.setattr(lazy, "EVICTION_INTERVAL_BYTES", 1)
+
+    with serve_objects({"file.bam": mock_object}, str(tmp_path)) as urls:
+        response = requests.get(urls["file.bam"])
+    assert response.content == CONTENT
+
+    # the blocks read last are kept
+    block_dir = tmp_path / BLOCK_DIR / os.listdir(tmp_path / BLOCK_DIR)[0]
+    assert sorted(os.listdir(block_dir)) == ["2", "3"]
+
+
+def test_serve_objects_errors(mock_object, tmp_path):
+    with serve_objects({"file.bam": mock_object}, str(tmp_path)) as urls:
+        base_url = urls["file.bam"].rsplit("/", 1)[0]
+        assert requests.get(f"{base_url}/nothing").status_code == 404
+        assert requests.get(urls["file.bam"], headers={"Range": "bytes=99-"}).status_code == 416
+        head = requests.head(urls["file.bam"])
+        assert head.headers["Content-Length"] == str(len(CONTENT))
+
+
+def test_serve_objects_listen_address(mock_object, tmp_path, monkeypatch):
+    # the server only listens on the address it hands out
+    addresses = []
+
+    class RecordingServer(lazy.ThreadingHTTPServer):
+        def __init__(self, server_address, handler):
+            addresses.append(server_address)
+            super().__init__(server_address, handler)
+
+    monkeypatch.setattr(lazy, "ThreadingHTTPServer", RecordingServer)
+    monkeypatch.setattr(lazy, "_server_address", lambda: "127.0.0.1")
+
+    with serve_objects({"file.bam": mock_object}, str(tmp_path)) as urls:
+        assert urls["file.bam"].startswith("http://127.0.0.1:")
+        assert requests.get(urls["file.bam"]).content == CONTENT
+    assert addresses == [("127.0.0.1", 0)]
+
+
+def test_serve_objects_empty(tmp_path):
+    with serve_objects({}, str(tmp_path)) as urls:
+        assert urls == {}
+
+
+def test_sweep_blocks(tmp_path):
+    obj_dir = tmp_path / BLOCK_DIR / "abc123"
+    os.makedirs(obj_dir)
+    for block in ["0", "1"]:
+        (obj_dir / block).write_bytes(b"x")
+    long_ago = time.time() - lazy.BLOCK_MAX_AGE_SECONDS - 10
+    os.utime(obj_dir / "0", (long_ago, long_ago))
+
+    sweep_blocks(str(tmp_path))
+    assert os.listdir(obj_dir) == ["1"]
+
+    os.utime(obj_dir / "1", (long_ago, long_ago))
+    sweep_blocks(str(tmp_path))
+    assert not os.path.exists(obj_dir)
+
+
+def test_evict_blocks(tmp_path, monkeypatch):
+    monkeypatch.setattr(lazy, "BLOCK_CACHE_MAX_BYTES", 25)
+
+    now = time.time()
+    for obj, block, age in [("abc123", "0", 40), ("abc123", "1", 10), ("def456", "0", 30), ("def456", "1", 20)]:
+        obj_dir = tmp_path / BLOCK_DIR / obj
+        os.makedirs(obj_dir, exist_ok=True)
+        (obj_dir / block).write_bytes(b"x" * 10)
+        os.utime(obj_dir / block, (now - age, now - age))
+    (tmp_path / BLOCK_DIR / "abc123" / "2.123.tmp").write_bytes(b"x" * 10)
+
+    evict_blocks(str(tmp_path))
+    assert sorted(os.listdir(tmp_path / BLOCK_DIR / "abc123")) == ["1", "2.123.tmp"]
+    assert os.listdir(tmp_path / BLOCK_DIR / "def456") == ["1"]
+
+    # under the limit, nothing happens
+    evict_blocks(str(tmp_path))
+    assert sorted(os.listdir(tmp_path / BLOCK_DIR / "abc123")) == ["1", "2.123.tmp"]
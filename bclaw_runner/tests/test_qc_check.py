@@ -4,7 +4,9 @@ import boto3
 import moto
 import pytest
 
-from ..src.runner.qc_check import abort_execution, run_one_qc_check, run_all_qc_checks, do_checks, QCFailure
+from ..src.runner import qc_check
+from ..src.runner.qc_check import (abort_execution, run_one_qc_check, run_all_qc_checks, do_checks, QCFailure,
+                                   referenced_names, load_qc_data)
 
 QC_DATA_1 = {
     "a": 1,
@@ -36,11 +38,11 @@ def mock_state_machine():
 
 
 @pytest.fixture(scope="function")
-def mock_qc_data_files(mocker, request):
-    qc_file1 = mocker.mock_open(read_data=json.dumps(QC_DATA_1))
-    qc_file2 = mocker.mock_open(read_data=json.dumps(QC_DATA_2))
-    ret = mocker.patch("builtins.open", qc_file1)
-    ret.side_effect = [qc_file1.return_value, qc_file2.return_value]
+def mock_qc_data_files(tmp_path, monkeypatch):
+    # real files: ijson reads with readinto, which mock_open doesn't support
+    (tmp_path / "fake1").write_text(json.dumps(QC_DATA_1))
+    (tmp_path / "fake2").write_text(json.dumps(QC_DATA_2))
+    monkeypatch.chdir(tmp_path)
 
 
 def test_abort_execution(mock_state_machine, monkeypatch):
@@ -73,6 +75,50 @@ def test_run_one_qc_check(expression, expect):
     assert result == expect
 
 
+def test_referenced_names():
+    result = referenced_names(["a > 1", "b.get('c') == 2", "any(v > 3 for v in d)", "len(e) == 0"])
+    assert {"a", "b", "get", "d", "len", "e"} <= result
+    assert "v" not in result
+
+
+@pytest.mark.parametrize("use_ijson", [True, False])
+def test_load_qc_data(tmp_path, monkeypatch, use_ijson):
+    if not use_ijson:
+        monkeypatch.setattr(qc_check, "ijson", None)
+
+    qc_file = tmp_path / "qc.json"
+    qc_file.write_text(json.dumps({
+        "a": 1,
+        "b": 2.5,
+        "huge": list(range(10000)),
+        "c": {"d": [1, 2]},
+    }))
+
+    result = load_qc_data(str(qc_file), {"a", "b", "c", "len"})
+    assert result["a"] == 1
+    assert isinstance(result["a"], int)
+    assert result["b"] == 2.5
+    assert result["c"] == {"d": [1, 2]}
+    if use_ijson:
+        assert "huge" not in result
+
+
+def test_load_qc_data_stops_early(tmp_path):
+    qc_file = tmp_path / "qc.json"
+    qc_file.write_text('{"a": 1, "b": 2, "junk": [1, 2, ')  # truncated after the interesting part
+    result = load_qc_data(str(qc_file), {"a", "b"})
+    assert result == {"a": 1, "b": 2}
+
+
+def test_load_qc_data_builtin_names(tmp_path):
+    qc_file = tmp_path / "qc.json"
+    qc_file.write_text(json.dumps({"max": 5, "a": 1}))
+    expression = "max > 3 and a == 1"
+    result = load_qc_data(str(qc_file), referenced_names([expression]))
+    assert result == {"max": 5, "a": 1}
+    assert run_one_qc_check(result, expression)
+
+
 @pytest.mark.parametrize("fake1_cond, fake2_cond, expect", [
     (["a>1"], ["x<99"], []),  # all pass
     (["a>1", "b==2"], ["y<98"], ["fake1: b==2"]),  # one fail
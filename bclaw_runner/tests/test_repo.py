@@ -1,14 +1,21 @@
 from contextlib import closing
+import gzip
 import json
 import os
+import time
 
 import boto3
 import jmespath
 import moto
 import pytest
+import requests
 
+from ..src.runner import transfer
+from ..src.runner.codec import zstd
 from ..src.runner.repo import _is_glob, _expand_s3_glob, Repository, SkipExecution
 
+needs_zstd = pytest.mark.skipif(zstd is None, reason="zstd needs Python 3.14")
+
 TEST_BUCKET = "test-bucket"
 JOB_DATA = {"job": "data"}
 FILE1_CONTENT = "file one"
@@ -41,6 +48,8 @@ def mock_buckets():
         db.put_object(Key="different/path/different_file", Body=DIFFERENT_FILE_CONTENT.encode("utf-8"))
         db.put_object(Key="no_folder_file1", Body=NO_FOLDER_FILE1_CONTENT.encode("utf-8"))
         db.put_object(Key="no_folder_file2", Body=NO_FOLDER_FILE2_CONTENT.encode("utf-8"))
+        # archive indexes are never matched by globs
+        db.put_object(Key="different/path/_archive_index_/different_file.json", Body=b"{}")
 
         yield tb, db
 
@@ -184,6 +193,23 @@ def test_inputerator_glob_expansion(monkeypatch, mock_buckets, spec, expected_fi
     assert result == expect
 
 
+def test_inputerator_options(monkeypatch, mock_buckets):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+
+    spec = {
+        "heads": "file[12] +range: 0-99",
+        "selected": "other_file +select: SELECT * FROM S3Object s",
+    }
+    result = sorted(list(repo._inputerator(spec)))
+    expect = [
+        "s3://test-bucket/repo/path/file1 +range: 0-99",
+        "s3://test-bucket/repo/path/file2 +range: 0-99",
+        "s3://test-bucket/repo/path/other_file +select: SELECT * FROM S3Object s",
+    ]
+    assert result == expect
+
+
 @pytest.mark.parametrize("spec", [
     {"f": "missing"},
     {"f": "missing*"},
@@ -211,6 +237,20 @@ def test_download_this(monkeypatch, mock_buckets, tmp_path):
         assert line == FILE1_CONTENT
 
 
+def test_download_this_ranged(monkeypatch, mock_buckets, tmp_path, mocker):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    resumable = mocker.spy(transfer, "resumable_download")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path", engine="ranged")
+
+    os.makedirs(tmp_path / "wrk")
+    os.chdir(tmp_path / "wrk")
+    repo._download_this("s3://test-bucket/repo/path/file1")
+    resumable.assert_called_once()
+    with open(tmp_path / "wrk" / "file1") as fp:
+        assert fp.read() == FILE1_CONTENT
+
+
 def test_download_this_missing_file(monkeypatch, mock_buckets, tmp_path):
     monkeypatch.setenv("BC_STEP_NAME", "test_step")
     repo_uri = f"s3://{TEST_BUCKET}/repo/path"
@@ -247,6 +287,147 @@ def test_download_inputs(monkeypatch, tmp_path, mock_buckets):
     assert result == expect
 
 
+def test_download_inputs_list(monkeypatch, tmp_path, mock_buckets):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+
+    file_spec = {
+        "batch": [f"s3://{TEST_BUCKET}/repo/path/file1", "file2", f"s3://{DIFFERENT_BUCKET}/different/path/different_file"],
+        "other_file": "other_file",
+    }
+
+    os.chdir(tmp_path)
+    result = repo.download_inputs(file_spec)
+    assert result == {"batch": "file1 file2 different_file", "other_file": "other_file"}
+
+    for filename in "file1 file2 other_file different_file".split():
+        assert (tmp_path / filename).exists()
+    assert not (tmp_path / "file3").exists()
+
+
+def test_download_inputs_partial(monkeypatch, tmp_path, mock_buckets, mocker):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+    selector = mocker.patch.object(transfer, "select_to_file",
+                                   side_effect=lambda s3_obj, dest, expression: open(dest, "w").close())
+
+    file_spec = {
+        "head": "file3 +range: 0-3",
+        "tail": f"s3://{DIFFERENT_BUCKET}/different/path/different_file +range: -4",
+        "selected": "other_file +select: SELECT * FROM S3Object s",
+    }
+
+    os.chdir(tmp_path)
+    result = repo.download_inputs(file_spec)
+    assert result == {"head": "file3", "tail": "different_file", "selected": "other_file"}
+
+    assert (tmp_path / "file3").read_text() == FILE3_CONTENT[:4]
+    assert (tmp_path / "different_file").read_text() == DIFFERENT_FILE_CONTENT[-4:]
+    selector.assert_called_once()
+    s3_obj, dest, expression = selector.call_args.args
+    assert s3_obj.key == "repo/path/other_file"
+    assert dest == "other_file"
+    assert expression == "SELECT * FROM S3Object s"
+
+
+@pytest.mark.parametrize("scratch", [True, False])
+def test_download_inputs_url(monkeypatch, tmp_path, mock_buckets, requests_mock, scratch):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    if scratch:
+        monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+
+    url = "https://example.com/refs/genome.fa?sig=123"
+    requests_mock.get(url, content=b"ACGT", headers={"ETag": '"abc"'})
+
+    os.makedirs(tmp_path / "wrk")
+    os.chdir(tmp_path / "wrk")
+    result = repo.download_inputs({"genome": url, "other_file": "other_file"})
+    assert result == {"genome": "genome.fa", "other_file": "other_file"}
+    assert (tmp_path / "wrk" / "genome.fa").read_bytes() == b"ACGT"
+    assert (tmp_path / "wrk" / "other_file").read_text() == OTHER_FILE_CONTENT
+
+
+def test_lazy_inputs(monkeypatch, tmp_path, mock_buckets):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+
+    file_spec = {
+        "lazy_file": "file1 +access: lazy",
+        "lazy_glob": "file[23] +access: lazy",
+        "missing?": "missing_file +access: lazy",
+        "eager_file": "other_file",
+    }
+
+    os.makedirs(tmp_path / "wrk")
+    os.chdir(tmp_path / "wrk")
+    result = repo.download_inputs(file_spec, lazy=True)
+    assert result == {"lazy_glob": "file[23]", "eager_file": "other_file"}
+    assert sorted(os.listdir(tmp_path / "wrk")) == ["file2", "file3", "other_file"]
+
+    with repo.serve_lazy_inputs(file_spec) as lazy_inputs:
+        assert list(lazy_inputs) == ["lazy_file"]
+        assert lazy_inputs["lazy_file"].endswith("/file1")
+        response = requests.get(lazy_inputs["lazy_file"], headers={"Range": "bytes=0-3"})
+        assert response.content == FILE1_CONTENT[:4].encode("utf-8")
+
+
+@pytest.mark.parametrize("metadata", [{"bclaw_codec": "gzip"}, {"bclaw_archive": "tar"}])
+def test_lazy_inputs_stored_differently(monkeypatch, tmp_path, mock_buckets, metadata):
+    # compressed and archived objects are downloaded, since the lazy server would serve them as stored
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+
+    test_bucket, _ = mock_buckets
+    test_bucket.put_object(Key="repo/path/stored_file", Body=b"stored", Metadata=metadata)
+    download = []
+    monkeypatch.setattr(Repository, "_download_this", lambda self, uri: download.append(uri) or "stored_file")
+
+    os.chdir(tmp_path)
+    with repo.serve_lazy_inputs({"lazy_file": "file1 +access: lazy",
+                                 "stored": "stored_file +access: lazy"}) as lazy_inputs:
+        assert lazy_inputs["lazy_file"].startswith("http://")
+        assert lazy_inputs["stored"] == "stored_file"
+    assert download == [f"s3://{TEST_BUCKET}/repo/path/stored_file"]
+
+
+def test_lazy_inputs_compressed(monkeypatch, tmp_path, mock_buckets):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+
+    test_bucket, _ = mock_buckets
+    test_bucket.put_object(Key="repo/path/compressed_file", Body=gzip.compress(b"uncompressed content"),
+                           Metadata={"bclaw_codec": "gzip"})
+
+    os.chdir(tmp_path)
+    with repo.serve_lazy_inputs({"compressed": "compressed_file +access: lazy"}) as lazy_inputs:
+        assert lazy_inputs == {"compressed": "compressed_file"}
+        assert (tmp_path / "compressed_file").read_bytes() == b"uncompressed content"
+
+
+def test_lazy_inputs_not_lazy(monkeypatch, tmp_path, mock_buckets):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+
+    os.chdir(tmp_path)
+    result = repo.download_inputs({"lazy_file": "file1 +access: lazy"})
+    assert result == {"lazy_file": "file1"}
+    assert (tmp_path / "file1").read_text() == FILE1_CONTENT
+
+
+def test_lazy_inputs_missing_required_file(monkeypatch, tmp_path, mock_buckets):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+
+    with pytest.raises(FileNotFoundError, match="missing_file"):
+        with repo.serve_lazy_inputs({"missing": "missing_file +access: lazy"}):
+            pass
+
+
 def test_download_inputs_missing_required_file(monkeypatch, tmp_path, mock_buckets):
     monkeypatch.setenv("BC_STEP_NAME", "test_step")
     repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
@@ -303,6 +484,27 @@ def test_download_inputs_empty_inputs(monkeypatch, mock_buckets):
     assert len(result) == 0
 
 
+def test_uploading_outputs(monkeypatch, tmp_path, mock_buckets, mocker):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+    os.chdir(tmp_path)
+    (tmp_path / "bg_output").write_text("background")
+    spec = {"bg": {"name": "bg_output", "s3_tags": {}}}
+
+    with pytest.raises(RuntimeError, match="meanwhile"):
+        with repo.uploading_outputs(spec, {}):
+            raise RuntimeError("meanwhile")
+
+    test_bucket, _ = mock_buckets
+    assert test_bucket.Object("repo/path/bg_output").get()["Body"].read() == b"background"
+
+    mocker.patch.object(Repository, "_upload_that", side_effect=RuntimeError("upload failed"))
+    (tmp_path / "bg_output").write_text("changed")
+    with pytest.raises(RuntimeError, match="upload failed"):
+        with repo.uploading_outputs(spec, {}):
+            pass
+
+
 def test_outputerator(monkeypatch, tmp_path, caplog):
     monkeypatch.setenv("BC_STEP_NAME", "test_step")
     repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
@@ -406,6 +608,72 @@ def test_upload_that(monkeypatch, tmp_path, mock_buckets):
     assert tags == expected_tags
 
 
+@pytest.mark.parametrize("codec", ["gzip", pytest.param("zstd", marks=needs_zstd)])
+def test_upload_download_compressed(monkeypatch, tmp_path, mock_buckets, codec):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo_compressed/{codec}")
+
+    content = "gene\tcount\n" + "GENE1\t12345\n" * 10000
+    os.chdir(tmp_path)
+    with open("table.tsv", "w") as fp:
+        fp.write(content)
+
+    repo._upload_that("sym_name", {"name": "table.tsv", "s3_tags": {}, "compress": codec}, {})
+
+    test_bucket, _ = mock_buckets
+    s3_obj = test_bucket.Object(f"repo_compressed/{codec}/table.tsv")
+    assert s3_obj.metadata["bclaw_codec"] == codec
+    assert s3_obj.content_length < len(content) / 10
+
+    os.makedirs("downloaded")
+    os.chdir("downloaded")
+    repo._download_this(f"s3://{TEST_BUCKET}/repo_compressed/{codec}/table.tsv")
+    with open("table.tsv") as fp:
+        assert fp.read() == content
+
+
+@needs_zstd
+def test_upload_download_archive(monkeypatch, tmp_path, mock_buckets):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo_archive/path")
+
+    os.chdir(tmp_path)
+    os.makedirs("per_gene/sub")
+    for name in ["per_gene/gene1.json", "per_gene/sub/gene2.json"]:
+        with open(name, "w") as fp:
+            fp.write(name)
+
+    repo.upload_outputs({"genes": {"name": "per_gene/", "s3_tags": {}, "archive": "tar", "compress": "zstd"}}, {})
+
+    test_bucket, _ = mock_buckets
+    keys = sorted(o.key for o in test_bucket.objects.filter(Prefix="repo_archive/path/"))
+    assert keys == ["repo_archive/path/per_gene", "repo_archive/path/_archive_index_/per_gene.json"]
+
+    os.makedirs("downloaded")
+    os.chdir("downloaded")
+    result = repo.download_inputs({"genes": "per_gene", "gene2": "per_gene#sub/gene2.json"})
+    assert result == {"genes": "per_gene", "gene2": "gene2.json"}
+
+    with open("per_gene/sub/gene2.json") as fp:
+        assert fp.read() == "per_gene/sub/gene2.json"
+    with open("per_gene/gene1.json") as fp:
+        assert fp.read() == "per_gene/gene1.json"
+    with open("gene2.json") as fp:
+        assert fp.read() == "per_gene/sub/gene2.json"
+
+
+def test_upload_that_archive_not_a_directory(monkeypatch, tmp_path, mock_buckets):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo/path")
+
+    os.chdir(tmp_path)
+    with open("not_a_dir", "w") as fp:
+        print("content", file=fp)
+
+    with pytest.raises(NotADirectoryError):
+        repo._upload_that("sym_name", {"name": "not_a_dir", "s3_tags": {}, "archive": "tar"}, {})
+
+
 def test_upload_that_with_destination(monkeypatch, tmp_path, mock_buckets):
     monkeypatch.setenv("BC_EXECUTION_ID", "ELVISLIVES")
     monkeypatch.setenv("BC_STEP_NAME", "test_step")
@@ -538,6 +806,200 @@ def test_upload_outputs_empty_outputs(monkeypatch, mock_buckets):
     repo.upload_outputs(output_spec, global_tags)
 
 
+def test_upload_outputs_skip_already_uploaded(monkeypatch, tmp_path, mock_buckets, mocker):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo_three/path")
+
+    os.chdir(tmp_path)
+    for output_filename in "output1 output2 output3".split():
+        with open(output_filename, "w") as fp:
+            print(output_filename, file=fp)
+
+    output_spec = {"outputs": {"name": "output*", "s3_tags": {}}}
+
+    repo._upload_that("outputs", {"name": "output1", "s3_tags": {}}, {})
+    repo._upload_that("outputs", {"name": "output2", "s3_tags": {}}, {})
+    with open("output2", "a") as fp:
+        print("changed", file=fp)
+
+    spy = mocker.spy(repo, "_upload_that")
+    repo.upload_outputs(output_spec, {})
+
+    uploaded = sorted(c.args[1]["name"] for c in spy.call_args_list)
+    assert uploaded == ["output2", "output3"]
+
+
+def test_watch_outputs(monkeypatch, tmp_path, mock_buckets):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo_early/path")
+
+    output_spec = {
+        "early_glob": {"name": "early*.txt", "s3_tags": {}, "upload": "early"},
+        "early_file": {"name": "./subdir/early_file", "s3_tags": {}, "upload": "early"},
+        "late_file": {"name": "late_file", "s3_tags": {}},
+    }
+
+    os.chdir(tmp_path)
+    os.makedirs("subdir")
+    with repo.watch_outputs(output_spec, {}):
+        for filename in ["early1.txt", "early2.txt", "subdir/early_file", "late_file", "other_file"]:
+            with open(filename, "w") as fp:
+                print(filename, file=fp)
+        time.sleep(2)
+
+    test_bucket, _ = mock_buckets
+    repo_objects = test_bucket.meta.client.list_objects_v2(Bucket=TEST_BUCKET, Prefix="repo_early/path")
+    repo_contents = sorted(jmespath.search("Contents[].Key", repo_objects))
+    assert repo_contents == ["repo_early/path/early1.txt", "repo_early/path/early2.txt", "repo_early/path/early_file"]
+
+    assert repo._already_uploaded("early1.txt")
+    assert repo._already_uploaded("subdir/early_file")
+
+
+def test_watch_outputs_glob_rules(monkeypatch, tmp_path, mock_buckets):
+    # early uploads pick the same files that upload_outputs would: * doesn't cross directories or match
+    # dotfiles, and **/ matches zero or more directories
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo_early_globs/path")
+
+    output_spec = {
+        "txt": {"name": "*.txt", "s3_tags": {}, "upload": "early"},
+        "deep": {"name": "**/deep*.dat", "s3_tags": {}, "upload": "early"},
+    }
+
+    os.chdir(tmp_path)
+    os.makedirs("sub/dir")
+    os.makedirs("a/b")
+    with repo.watch_outputs(output_spec, {}):
+        for filename in ["top.txt", "sub/dir/nested.txt", ".hidden.txt", "deep1.dat", "a/b/deep2.dat", "a/.deep3.dat"]:
+            with open(filename, "w") as fp:
+                print(filename, file=fp)
+        time.sleep(2)
+
+    test_bucket, _ = mock_buckets
+    repo_objects = test_bucket.meta.client.list_objects_v2(Bucket=TEST_BUCKET, Prefix="repo_early_globs/path")
+    repo_contents = sorted(jmespath.search("Contents[].Key", repo_objects))
+    assert repo_contents == ["repo_early_globs/path/deep1.dat", "repo_early_globs/path/deep2.dat",
+                             "repo_early_globs/path/top.txt"]
+
+
+def test_stream_outputs(monkeypatch, tmp_path, mock_buckets):
+    monkeypatch.setenv("BC_EXECUTION_ID", "ELVISLIVES")
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo_stream/path")
+
+    global_tags = {"tag1": "valueX"}
+    output_spec = {
+        "streamed": {
+            "name": "subdir/streamed_output",
+            "s3_tags": {"tag2": "value2"},
+            "upload": "stream",
+        },
+        "streamed_elsewhere": {
+            "name": "other_streamed_output",
+            "dest": f"s3://{DIFFERENT_BUCKET}/streamed/",
+            "s3_tags": {},
+            "upload": "stream",
+        },
+        "unopened": {
+            "name": "unopened_output",
+            "s3_tags": {},
+            "upload": "stream",
+        },
+        "globbed": {
+            "name": "glob*",
+            "s3_tags": {},
+            "upload": "stream",
+        },
+        "regular": {
+            "name": "regular_output",
+            "s3_tags": {},
+        },
+    }
+
+    os.chdir(tmp_path)
+    with repo.stream_outputs(output_spec, global_tags) as remaining:
+        assert os.path.exists("subdir/streamed_output")
+        with open("subdir/streamed_output", "w") as fp:
+            print("streamed content", file=fp)
+        with open("other_streamed_output", "w") as fp:
+            print("other streamed content", file=fp)
+
+    assert remaining == {"globbed": output_spec["globbed"], "regular": output_spec["regular"]}
+
+    test_bucket, other_bucket = mock_buckets
+    chek = test_bucket.Object("repo_stream/path/streamed_output").get()
+    assert chek["Metadata"] == {"execution_id": "ELVISLIVES"}
+    with closing(chek["Body"]) as fp:
+        assert fp.read() == b"streamed content\n"
+
+    resp = test_bucket.meta.client.get_object_tagging(Bucket=TEST_BUCKET, Key="repo_stream/path/streamed_output")
+    tags = sorted(resp["TagSet"], key=lambda x: x["Key"])
+    assert tags == [{"Key": "tag1", "Value": "valueX"}, {"Key": "tag2", "Value": "value2"}]
+
+    chek2 = other_bucket.Object("streamed/other_streamed_output").get()
+    with closing(chek2["Body"]) as fp:
+        assert fp.read() == b"other streamed content\n"
+
+    repo_objects = test_bucket.meta.client.list_objects_v2(Bucket=TEST_BUCKET, Prefix="repo_stream/path")
+    repo_contents = jmespath.search("Contents[].Key", repo_objects)
+    assert repo_contents == ["repo_stream/path/streamed_output"]
+
+
+def test_stream_outputs_matching_glob(monkeypatch, tmp_path, mock_buckets):
+    # the named pipe of a streamed output must not be picked up by other outputs' globs, either by early
+    # uploads or by the final upload
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://{TEST_BUCKET}/repo_stream_glob/path")
+
+    output_spec = {
+        "streamed": {"name": "streamed.txt", "s3_tags": {}, "upload": "stream"},
+        "early_glob": {"name": "*.txt", "s3_tags": {}, "upload": "early"},
+        "final_glob": {"name": "stream*", "s3_tags": {}},
+    }
+
+    os.chdir(tmp_path)
+    with repo.stream_outputs(output_spec, {}) as remaining:
+        with repo.watch_outputs(remaining, {}):
+            with open("streamed.txt", "w") as fp:
+                print("streamed content", file=fp)
+            with open("regular.txt", "w") as fp:
+                print("regular content", file=fp)
+            time.sleep(2)
+        repo.upload_outputs(remaining, {})
+
+    test_bucket, _ = mock_buckets
+    repo_objects = test_bucket.meta.client.list_objects_v2(Bucket=TEST_BUCKET, Prefix="repo_stream_glob/path")
+    repo_contents = sorted(jmespath.search("Contents[].Key", repo_objects))
+    assert repo_contents == ["repo_stream_glob/path/regular.txt", "repo_stream_glob/path/streamed.txt"]
+
+    chek = test_bucket.Object("repo_stream_glob/path/streamed.txt").get()
+    with closing(chek["Body"]) as fp:
+        assert fp.read() == b"streamed content\n"
+
+
+def test_stream_outputs_fail(monkeypatch, tmp_path, mock_buckets):
+    monkeypatch.setenv("BC_STEP_NAME", "test_step")
+    repo = Repository(f"s3://unbucket/repo/path")
+
+    output_spec = {
+        "streamed": {
+            "name": "streamed_output",
+            "s3_tags": {},
+            "upload": "stream",
+        },
+    }
+
+    os.chdir(tmp_path)
+    with pytest.raises(RuntimeError, match="1 streaming uploads failed"):
+        with repo.stream_outputs(output_spec, {}):
+            try:
+                with open("streamed_output", "w") as fp:
+                    print("streamed content", file=fp)
+            except BrokenPipeError:
+                pass
+
+
 @pytest.mark.parametrize("step_name, expect_skip", [
     ("test_step", True),
     ("non_step", False),
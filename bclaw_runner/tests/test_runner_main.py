@@ -46,7 +46,7 @@ def mock_bucket():
         yield yld
 
 
-def fake_container(image_spec: dict, command: str, work_dir: str, job_data_file: str):
+def fake_container(image_spec: dict, command: str, work_dir: str, job_data_file: str, limits: dict):
     assert image_spec["name"] == "fake_image:test"
     response = subprocess.run(command, shell=True)
     return response.returncode
@@ -130,9 +130,13 @@ def test_main(monkeypatch, tmp_path, mock_bucket, mocker):
     }
 
     response = main(image_spec=image_spec,
+                    engine="auto",
                     commands=commands,
                     references=references,
                     inputs=inputs,
+                    checkpoint={},
+                    limits={},
+                    native="none",
                     outputs=outputs,
                     qc=qc,
                     repo_path=f"s3://{TEST_BUCKET}/repo/path",
@@ -255,9 +259,13 @@ def test_main_fail_before_commands(monkeypatch, tmp_path, mock_bucket):
     }
 
     response = main(image_spec=image_spec,
+                    engine="auto",
                     commands=commands,
                     references=references,
                     inputs=inputs,
+                    checkpoint={},
+                    limits={},
+                    native="none",
                     outputs=outputs,
                     qc=[],
                     repo_path=f"s3://{TEST_BUCKET}/repo/path",
@@ -297,9 +305,13 @@ def test_main_fail_in_commands(monkeypatch, tmp_path, mock_bucket):
 
 
     response = main(image_spec=image_spec,
+                    engine="auto",
                     commands=commands,
                     references=references,
                     inputs=inputs,
+                    checkpoint={},
+                    limits={},
+                    native="none",
                     outputs=outputs,
                     qc=[],
                     repo_path=f"s3://{TEST_BUCKET}/repo/path",
@@ -338,9 +350,13 @@ def test_main_fail_after_commands(monkeypatch, tmp_path, mock_bucket):
 
 
     response = main(image_spec=image_spec,
+                    engine="auto",
                     commands=commands,
                     references=references,
                     inputs=inputs,
+                    checkpoint={},
+                    limits={},
+                    native="none",
                     outputs=outputs,
                     qc=[],
                     repo_path=f"s3://{TEST_BUCKET}/repo/path",
@@ -352,6 +368,43 @@ def test_main_fail_after_commands(monkeypatch, tmp_path, mock_bucket):
     assert "repo/path/_control_/step4.complete" not in curr_bucket_contents
 
 
+def test_main_qc_failure(monkeypatch, tmp_path, mock_bucket, mocker):
+    monkeypatch.setenv("BC_STEP_NAME", "step_qc")
+    monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    monkeypatch.setattr(runner.workspace, "run_child_container", fake_container)
+    mock_abort = mocker.patch("bclaw_runner.src.runner.runner_main.abort_execution")
+
+    outputs = {
+        "qc_out": {"name": "qc.json", "s3_tags": {}},
+        "big_out": {"name": "big_output", "s3_tags": {}},
+    }
+    commands = ["echo '{\"x\": 1}' > ${qc_out}", "echo big > ${big_out}"]
+    qc = [{"qc_result_file": "qc.json", "stop_early_if": ["x == 1"]}]
+
+    response = main(image_spec={"name": "fake_image:${job.img_tag}", "auth": ""},
+                    engine="auto",
+                    commands=commands,
+                    references={},
+                    inputs={},
+                    checkpoint={},
+                    limits={},
+                    native="none",
+                    outputs=outputs,
+                    qc=qc,
+                    repo_path=f"s3://{TEST_BUCKET}/repo/path",
+                    shell="sh",
+                    skip="none",
+                    tags={})
+    assert response == 0
+    mock_abort.assert_called_once_with(["qc.json: x == 1"])
+
+    # outputs are uploaded even though QC failed
+    curr_bucket_contents = {o.key for o in mock_bucket.objects.all()}
+    assert "repo/path/qc.json" in curr_bucket_contents
+    assert "repo/path/big_output" in curr_bucket_contents
+    assert "repo/path/_control_/step_qc.complete" not in curr_bucket_contents
+
+
 @pytest.mark.parametrize("skip, expect", [
     ("rerun", 0),
     ("output", 0),
@@ -376,9 +429,13 @@ def test_main_skip(monkeypatch, tmp_path, mock_bucket, skip, expect):
 
 
     response = main(image_spec=image_spec,
+                    engine="auto",
                     commands=commands,
                     references=references,
                     inputs=inputs,
+                    checkpoint={},
+                    limits={},
+                    native="none",
                     outputs=outputs,
                     qc=[],
                     repo_path=f"s3://{TEST_BUCKET}/repo/path",
@@ -388,6 +445,109 @@ def test_main_skip(monkeypatch, tmp_path, mock_bucket, skip, expect):
     assert response == expect
 
 
+def test_main_checkpoint(monkeypatch, tmp_path, mock_bucket):
+    monkeypatch.setenv("BC_STEP_NAME", "step7")
+    monkeypatch.setenv("BC_EXECUTION_ID", "ckpt-exec-id")
+    monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    monkeypatch.setattr(runner.workspace, "run_child_container", fake_container)
+    mock_bucket.put_object(Key="repo/path/_checkpoint_/step7/ckpt-exec-id/ckpt/state", Body=b"restored")
+
+    response = main(image_spec={"name": "fake_image:${job.img_tag}", "auth": ""},
+                    engine="auto",
+                    commands=["cat ckpt/state > ${output8}"],
+                    references={},
+                    inputs={},
+                    checkpoint={"files": ["ckpt/*"], "wait": 0},
+                    limits={},
+                    native="none",
+                    outputs={"output8": {"name": "outfile8", "s3_tags": {}}},
+                    qc=[],
+                    repo_path=f"s3://{TEST_BUCKET}/repo/path",
+                    shell="sh",
+                    skip="none",
+                    tags={})
+    assert response == 0
+
+    with closing(mock_bucket.Object("repo/path/outfile8").get()["Body"]) as fp:
+        assert fp.read() == b"restored"
+
+    bucket_contents = {o.key for o in mock_bucket.objects.all()}
+    assert not any(k.startswith("repo/path/_checkpoint_/step7/") for k in bucket_contents)
+
+
+@pytest.mark.parametrize("command, expect_exit_code", [
+    ("echo native > ${output7}", 0),
+    ("echo native > ${output7}; false", 1),
+])
+def test_main_native(monkeypatch, tmp_path, mock_bucket, command, expect_exit_code):
+    monkeypatch.setenv("BC_STEP_NAME", "step5")
+    monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    monkeypatch.setenv("AWS_BATCH_JOB_ID", "native-job-id")
+
+    def _run(phase: str) -> int:
+        return main(image_spec={"name": "fake_image:${job.img_tag}", "auth": ""},
+                    engine="auto",
+                    commands=[command],
+                    references={},
+                    inputs={"input1": "file${job.key1}"},
+                    checkpoint={},
+                    limits={},
+                    native=phase,
+                    outputs={"output7": {"name": "outfile7", "s3_tags": {}}},
+                    qc=[],
+                    repo_path=f"s3://{TEST_BUCKET}/repo/path",
+                    shell="sh",
+                    skip="none",
+                    tags={})
+
+    mock_bucket.Object("repo/path/outfile7").delete()
+
+    assert _run("stage-in") == 0
+    native_workspace = tmp_path / "bclaw_native_native-job-id"
+    assert (native_workspace / "file1").is_file()
+    assert not (native_workspace / "outfile7").exists()
+
+    # this is what the user's container does
+    subprocess.run(f"sh {native_workspace}/_bclaw_native.sh", shell=True, cwd=tmp_path)
+    assert (native_workspace / "outfile7").is_file()
+
+    assert _run("stage-out") == expect_exit_code
+    assert not native_workspace.exists()
+
+    bucket_contents = {o.key for o in mock_bucket.objects.all()}
+    assert "repo/path/outfile7" in bucket_contents
+    assert ("repo/path/_control_/step5.complete" in bucket_contents) == (expect_exit_code == 0)
+
+
+def test_main_native_skip(monkeypatch, tmp_path, mock_bucket):
+    monkeypatch.setenv("BC_STEP_NAME", "step6")
+    monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    monkeypatch.setenv("AWS_BATCH_JOB_ID", "native-skip-job-id")
+    mock_bucket.put_object(Key="repo/path/_control_/step6.complete", Body=b"")
+
+    def _run(phase: str) -> int:
+        return main(image_spec={"name": "fake_image:${job.img_tag}", "auth": ""},
+                    engine="auto",
+                    commands=["false"],
+                    references={},
+                    inputs={},
+                    checkpoint={},
+                    limits={},
+                    native=phase,
+                    outputs={},
+                    qc=[],
+                    repo_path=f"s3://{TEST_BUCKET}/repo/path",
+                    shell="sh",
+                    skip="rerun",
+                    tags={})
+
+    assert _run("stage-in") == 0
+    native_workspace = tmp_path / "bclaw_native_native-skip-job-id"
+    response = subprocess.run(f"sh {native_workspace}/_bclaw_native.sh", shell=True)
+    assert response.returncode == 0
+    assert _run("stage-out") == 0
+
+
 def fake_main(*args):
     print("fake main running")
     time.sleep(1)
@@ -400,8 +560,16 @@ def fake_termination_checker_impl(*_):
 
 @moto.mock_aws
 @pytest.mark.parametrize("argv, expect", [
+    ("prog -c 2 -i 3 -o 4 -s 5 -f 6 -r 7 -k 8 -m 9 -q 10 -t 11 -l 12",
+    [{}, 2, "auto", 9, 3, 12, "none", 4, 10, 6, "7", "5", "8", 11]),
     ("prog -c 2 -i 3 -o 4 -s 5 -f 6 -r 7 -k 8 -m 9 -q 10 -t 11",
-    [2, 9, 3, 4, 10, 6, "7", "5", "8", 11])
+    [{}, 2, "auto", 9, 3, {}, "none", 4, 10, 6, "7", "5", "8", 11]),
+    ("prog -c 2 -i 3 -o 4 -s 5 -f 6 -r 7 -k 8 -m 9 -q 10 -t 11 -n stage-in",
+    [{}, 2, "auto", 9, 3, {}, "stage-in", 4, 10, 6, "7", "5", "8", 11]),
+    ("prog -c 2 -i 3 -o 4 -s 5 -f 6 -r 7 -k 8 -m 9 -q 10 -t 11 -p 13",
+    [13, 2, "auto", 9, 3, {}, "none", 4, 10, 6, "7", "5", "8", 11]),
+    ("prog -c 2 -i 3 -o 4 -s 5 -f 6 -r 7 -k 8 -m 9 -q 10 -t 11 -e ranged",
+    [{}, 2, "ranged", 9, 3, {}, "none", 4, 10, 6, "7", "5", "8", 11]),
 ])
 def test_cli(capsys, requests_mock, mock_ec2_instance, monkeypatch, argv, expect):
     requests_mock.put("http://169.254.169.254/latest/api/token", text="mocked-token")
@@ -2,7 +2,7 @@ import re
 
 import pytest
 
-from ..src.runner.string_subs import lookup, substitute, substitute_image_tag
+from ..src.runner.string_subs import lookup, substitute, substitute_file_spec, substitute_image_tag
 
 
 @pytest.mark.parametrize("pattern, string, expect", [
@@ -42,6 +42,50 @@ def test_substitute_string():
     assert result == expect
 
 
+def test_substitute_batch():
+    # only batched scatter values are space separated, other lists keep their usual form
+    subs = {
+        "scatter": {"files": ["a.txt", "b.txt"]},
+        "job": {"files": ["c.txt", "d.txt"]},
+    }
+    target = "cat ${scatter.files} ${job.files}"
+    result = substitute(target, subs)
+    expect = "cat a.txt b.txt ['c.txt', 'd.txt']"
+    assert result == expect
+
+
+def test_substitute_file_spec():
+    subs = {
+        "scatter": {
+            "files": ["s3://bucket/a.txt", "s3://bucket/b.txt"],
+            "one": "s3://bucket/c.txt",
+        },
+        "job": {
+            "n": [1, 2],
+        },
+    }
+    target = {
+        "files": "${scatter.files}",
+        "one": "${scatter.one}",
+        "numbers": "${job.n}",
+        "embedded": "prefix_${job.n}",
+        "batch_embedded": "prefix_${scatter.files}",
+        "plain": "file.txt",
+        "missing": "${scatter.nope}",
+    }
+    result = substitute_file_spec(target, subs)
+    expect = {
+        "files": ["s3://bucket/a.txt", "s3://bucket/b.txt"],
+        "one": "s3://bucket/c.txt",
+        "numbers": "[1, 2]",
+        "embedded": "prefix_[1, 2]",
+        "batch_embedded": "prefix_s3://bucket/a.txt s3://bucket/b.txt",
+        "plain": "file.txt",
+        "missing": "${scatter.nope}",
+    }
+    assert result == expect
+
+
 def test_substitute_nested():
     subs = {
         "metadata": {
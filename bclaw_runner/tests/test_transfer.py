@@ -0,0 +1,185 @@
+import fcntl
+import json
+import os
+import time
+
+import boto3
+import moto
+import pytest
+
+from ..src.runner import transfer
+from ..src.runner.transfer import resumable_download, sweep_partials, _partial_paths
+
+TEST_BUCKET = "test-bucket"
+CONTENT = b"0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+@pytest.fixture(scope="module")
+def mock_object():
+    with moto.mock_aws():
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        bucket = s3.Bucket(TEST_BUCKET)
+        bucket.create()
+        bucket.put_object(Key="big/file", Body=CONTENT)
+        yield s3.Object(TEST_BUCKET, "big/file")
+
+
+@pytest.fixture(autouse=True)
+def small_parts(monkeypatch):
+    monkeypatch.setattr(transfer, "RESUMABLE_PART_SIZE", 10)
+
+
+def test_resumable_download(mock_object, tmp_path):
+    dest = tmp_path / "dest"
+    result = resumable_download(mock_object, str(dest), str(tmp_path))
+    assert result is True
+    assert dest.read_bytes() == CONTENT
+
+    data_path, progress_path = _partial_paths(str(tmp_path), TEST_BUCKET, "big/file")
+    assert not os.path.exists(data_path)
+    assert not os.path.exists(progress_path)
+
+
+@pytest.mark.parametrize("etag, expect", [
+    (None, b"XXXXXXXXXX" + CONTENT[10:20] + b"XXXXXXXXXX" + CONTENT[30:]),
+    ('"changed"', CONTENT),
+])
+def test_resumable_download_resume(mock_object, tmp_path, etag, expect):
+    data_path, progress_path = _partial_paths(str(tmp_path), TEST_BUCKET, "big/file")
+
+    # parts 0 and 2 were finished by a previous attempt. Fill them with junk to show they're not fetched again
+    with open(data_path, "wb") as fp:
+        fp.write(b"X" * len(CONTENT))
+    with open(progress_path, "w") as fp:
+        json.dump({"etag": etag or mock_object.e_tag, "size": len(CONTENT), "part_size": 10, "done": [0, 2]}, fp)
+
+    dest = tmp_path / "dest"
+    resumable_download(mock_object, str(dest), str(tmp_path))
+    assert dest.read_bytes() == expect
+
+
+def test_resumable_download_locked(mock_object, tmp_path):
+    data_path, _ = _partial_paths(str(tmp_path), TEST_BUCKET, "big/file")
+    with open(data_path, "wb") as fp:
+        fcntl.flock(fp, fcntl.LOCK_EX)
+        result = resumable_download(mock_object, str(tmp_path / "dest"), str(tmp_path))
+    assert result is False
+    assert not (tmp_path / "dest").exists()
+
+
+def test_resumable_download_renamed(mock_object, tmp_path, monkeypatch):
+    data_path, _ = _partial_paths(str(tmp_path), TEST_BUCKET, "big/file")
+    finished = tmp_path / "finished"
+    with open(data_path, "wb") as fp:
+        fp.write(b"finished by another job")
+
+    # another job finishes its download and renames the partial file just before this one locks it
+    real_flock = fcntl.flock
+    calls = []
+
+    def _flock(fd, operation):
+        if not calls:
+            os.replace(data_path, finished)
+        calls.append(fd)
+        real_flock(fd, operation)
+
+    monkeypatch.setattr(transfer.fcntl, "flock", _flock)
+
+    dest = tmp_path / "dest"
+    result = resumable_download(mock_object, str(dest), str(tmp_path))
+    assert result is True
+    assert len(calls) == 2
+    assert dest.read_bytes() == CONTENT
+    assert finished.read_bytes() == b"finished by another job"
+
+
+def test_sweep_partials(tmp_path):
+    old_data, old_progress = _partial_paths(str(tmp_path), TEST_BUCKET, "old")
+    new_data, new_progress = _partial_paths(str(tmp_path), TEST_BUCKET, "new")
+    for path in [old_data, old_progress, new_data, new_progress]:
+        with open(path, "w"):
+            pass
+
+    long_ago = time.time() - transfer.PARTIAL_MAX_AGE_SECONDS - 10
+    os.utime(old_data, (long_ago, long_ago))
+
+    sweep_partials(str(tmp_path))
+    remaining = sorted(os.listdir(tmp_path / transfer.PARTIAL_DIR))
+    assert remaining == sorted(os.path.basename(p) for p in [new_data, new_progress])
+
+
+@pytest.mark.parametrize("engine, size, scratch_path, expect", [
+    ("auto", 100, "/scratch", "boto3"),
+    ("auto", transfer.RESUMABLE_THRESHOLD, "/scratch", "ranged"),
+    ("auto", transfer.RESUMABLE_THRESHOLD, None, "boto3"),
+    ("ranged", 100, "/scratch", "ranged"),
+    ("ranged", 100, None, "boto3"),
+    ("crt", 100, "/scratch", "crt"),
+    ("boto3", transfer.RESUMABLE_THRESHOLD, "/scratch", "boto3"),
+])
+def test_choose_engine(engine, size, scratch_path, expect):
+    assert transfer.choose_engine(engine, size, scratch_path) == expect
+
+
+@pytest.mark.parametrize("engine", ["auto", "boto3", "crt", "ranged"])
+def test_download(mock_object, tmp_path, engine):
+    dest = tmp_path / "dest"
+    transfer.download(mock_object, str(dest), engine, str(tmp_path))
+    assert dest.read_bytes() == CONTENT
+
+
+@pytest.mark.parametrize("engine", ["boto3", "crt"])
+def test_upload(mock_object, tmp_path, engine):
+    local_file = tmp_path / "local"
+    local_file.write_bytes(b"uploaded")
+    target = mock_object.Bucket().Object("uploaded/file")
+    transfer.upload(target, str(local_file), {"Metadata": {"engine": engine}}, engine)
+
+    response = target.get()
+    assert response["Body"].read() == b"uploaded"
+    assert response["Metadata"] == {"engine": engine}
+
+
+@pytest.mark.parametrize("byte_range, expect", [
+    ("0-9", CONTENT[:10]),
+    ("30-", CONTENT[30:]),
+    ("-6", CONTENT[-6:]),
+])
+def test_download_range(mock_object, tmp_path, byte_range, expect):
+    dest = tmp_path / "dest"
+    transfer.download_range(mock_object, str(dest), byte_range)
+    assert dest.read_bytes() == expect
+
+
+@pytest.mark.parametrize("key, codec, expect_in, expect_out", [
+    ("x.csv", None, {"CSV": {"FileHeaderInfo": "USE"}, "CompressionType": "NONE"}, {"CSV": {}}),
+    ("x.tsv.gz", None, {"CSV": {"FileHeaderInfo": "USE", "FieldDelimiter": "\t"}, "CompressionType": "GZIP"},
+     {"CSV": {"FieldDelimiter": "\t"}}),
+    ("x.jsonl", "gzip", {"JSON": {"Type": "LINES"}, "CompressionType": "GZIP"}, {"JSON": {}}),
+    ("x.JSON.bz2", None, {"JSON": {"Type": "DOCUMENT"}, "CompressionType": "BZIP2"}, {"JSON": {}}),
+    ("x.parquet", None, {"Parquet": {}}, {"JSON": {}}),
+])
+def test_select_serialization(key, codec, expect_in, expect_out):
+    result = transfer._select_serialization(key, codec)
+    assert result == (expect_in, expect_out)
+
+
+@pytest.mark.parametrize("key, codec", [
+    ("x.bam", None),
+    ("x.csv", "zstd"),
+])
+def test_select_serialization_unsupported(key, codec):
+    with pytest.raises(ValueError, match="S3 Select"):
+        transfer._select_serialization(key, codec)
+
+
+def test_select_to_file(mock_object, tmp_path):
+    target = mock_object.Bucket().Object("select/table.csv")
+    target.put(Body=b"gene,score\nabc,1\ndef,2\n")
+
+    dest = tmp_path / "dest"
+    transfer.select_to_file(target, str(dest), "SELECT s.gene FROM S3Object s")
+    result = dest.read_text()
+    assert "abc" in result
+    assert "def" in result
+    assert "score" not in result
@@ -0,0 +1,100 @@
+import glob
+import os
+
+import pytest
+
+from ..src.runner import tree_glob
+from ..src.runner.tree_glob import iglob_many
+
+FILES = [
+    "out1.txt",
+    "out2.txt",
+    "out3.csv",
+    ".hidden.txt",
+    "dir1/a.txt",
+    "dir1/b.csv",
+    "dir1/sub/c.txt",
+    "dir1/sub/deeper/d.txt",
+    "dir2/e.txt",
+    "dir2/.hidden_dir/f.txt",
+    ".snakemake/log/g.log",
+    "empty_dir/",
+]
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    for f in FILES:
+        path = tmp_path / f
+        if f.endswith("/"):
+            path.mkdir(parents=True)
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            path.write_text(f)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.mark.parametrize("pattern", [
+    "out*",
+    "*.txt",
+    "**/*.txt",
+    "dir1/**/*.txt",
+    "dir*/**",
+    "**",
+    "dir?/*",
+    "dir1/sub/*/d.txt",
+    "./out[12].txt",
+    ".*",
+    ".snakemake/**/*.log",
+    "dir2/.hidden_dir/*",
+    "*/*/*",
+    "nothing*",
+    "out1.txt",
+    "dir1/sub",
+    "not_there.txt",
+])
+def test_iglob_many_matches_glob(tree, pattern):
+    result = sorted(path for _, path in iglob_many({"x": pattern}))
+    expect = sorted(p.rstrip("/") for p in glob.glob(pattern, recursive=True))
+    assert result == expect
+
+
+def test_iglob_many_several_patterns(tree):
+    patterns = {
+        "texts": "**/*.txt",
+        "csvs": "**/*.csv",
+        "one": "out1.txt",
+        "none": "*.bam",
+    }
+    result = sorted(iglob_many(patterns))
+    expect = sorted([(k, p) for k, v in patterns.items() for p in glob.glob(v, recursive=True)])
+    assert result == expect
+
+
+def test_iglob_many_single_walk(tree, mocker):
+    spy = mocker.spy(tree_glob.os, "scandir")
+    _ = list(iglob_many({"a": "**/*.txt", "b": "**/*.csv", "c": "dir*/**/*"}))
+    scanned = [os.path.normpath(c.args[0]) for c in spy.call_args_list]
+    assert len(scanned) == len(set(scanned))
+    # hidden directories can't match any of these patterns, so they're never scanned
+    assert ".snakemake" not in scanned
+    assert os.path.join("dir2", ".hidden_dir") not in scanned
+
+
+def test_iglob_many_prunes(tree, mocker):
+    spy = mocker.spy(tree_glob.os, "scandir")
+    _ = list(iglob_many({"a": "dir1/sub/*.txt"}))
+    scanned = sorted(os.path.normpath(c.args[0]) for c in spy.call_args_list)
+    assert scanned == [".", "dir1", os.path.join("dir1", "sub")]
+
+
+def test_iglob_many_outside_workspace(tree):
+    os.chdir(tree / "dir1")
+    result = sorted(path for _, path in iglob_many({"x": "../dir2/*.txt", "y": f"{tree}/out*"}))
+    assert result == sorted(["../dir2/e.txt", f"{tree}/out1.txt", f"{tree}/out2.txt", f"{tree}/out3.csv"])
+
+
+def test_iglob_many_warning(tree, caplog):
+    _ = list(iglob_many({"x": "nothing*", "y": "out*"}))
+    assert caplog.messages == ["no file matching 'nothing*' found in workspace"]
@@ -0,0 +1,50 @@
+import os
+import time
+
+from ..src.runner.watcher import watch_files
+
+
+def test_watch_files(tmp_path):
+    (tmp_path / "old_dir").mkdir()
+    finished = []
+
+    with watch_files(str(tmp_path), finished.append):
+        with open(tmp_path / "file1", "w") as fp:
+            print("file one", file=fp)
+
+        with open(tmp_path / "old_dir" / "file2", "w") as fp:
+            print("file two", file=fp)
+
+        os.makedirs(tmp_path / "new_dir" / "subdir")
+        with open(tmp_path / "new_dir" / "subdir" / "file3", "w") as fp:
+            print("file three", file=fp)
+
+        with open(tmp_path / "temp_file", "w") as fp:
+            print("file four", file=fp)
+        os.rename(tmp_path / "temp_file", tmp_path / "file4")
+
+        # reading doesn't count
+        with open(tmp_path / "file1") as fp:
+            fp.read()
+
+        time.sleep(2)
+
+    assert "file1" in finished
+    assert "old_dir/file2" in finished
+    assert "new_dir/subdir/file3" in finished
+    assert "file4" in finished
+    assert finished.count("file1") == 1
+
+
+def test_watch_files_unavailable(monkeypatch, tmp_path):
+    def no_inotify():
+        raise OSError("nope")
+
+    monkeypatch.setattr("bclaw_runner.src.runner.watcher._Inotify", no_inotify)
+    finished = []
+
+    with watch_files(str(tmp_path), finished.append):
+        with open(tmp_path / "file1", "w") as fp:
+            print("file one", file=fp)
+
+    assert finished == []
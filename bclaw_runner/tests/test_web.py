@@ -0,0 +1,101 @@
+import re
+
+import pytest
+
+from ..src.runner import web
+from ..src.runner.web import WebObject, is_url
+
+URL = "https://example.com/data/genome.fa?X-Amz-Signature=abc123"
+CONTENT = b"0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _ranged_server(requests_mock, headers: dict, content: bytes = CONTENT):
+    def _callback(request, context):
+        context.headers.update(headers)
+        if m := re.fullmatch(r"bytes=(\d+)-(\d+)", request.headers.get("Range", "")):
+            if "If-Range" in request.headers and request.headers["If-Range"] != headers.get("ETag"):
+                context.status_code = 200
+                return content
+            start, end = int(m.group(1)), int(m.group(2))
+            context.status_code = 206
+            context.headers["Content-Range"] = f"bytes {start}-{end}/{len(content)}"
+            return content[start:end + 1]
+        context.status_code = 200
+        return content
+
+    return requests_mock.get(URL, content=_callback)
+
+
+@pytest.fixture(autouse=True)
+def small_parts(monkeypatch):
+    monkeypatch.setattr(web, "PART_SIZE", 10)
+
+
+@pytest.mark.parametrize("path, expect", [
+    ("https://example.com/file", True),
+    ("http://example.com/file", True),
+    ("s3://bucket/file", False),
+    ("file", False),
+])
+def test_is_url(path, expect):
+    assert is_url(path) == expect
+
+
+def test_web_object(requests_mock):
+    _ranged_server(requests_mock, {"ETag": '"v1"'})
+    result = WebObject(URL)
+    assert result.name == "genome.fa"
+    assert result.content_length == len(CONTENT)
+    assert result.accepts_ranges is True
+    assert result.e_tag == '"v1"'
+
+
+def test_web_object_not_found(requests_mock):
+    requests_mock.get(URL, status_code=404)
+    with pytest.raises(FileNotFoundError, match="genome.fa"):
+        WebObject(URL)
+
+
+def test_cache_tag(requests_mock):
+    _ranged_server(requests_mock, {"ETag": '"v1"'})
+    tag1 = WebObject(URL).cache_tag
+
+    # re-signed URL, same object
+    requests_mock.get("https://example.com/data/genome.fa?X-Amz-Signature=xyz789", headers={"ETag": '"v1"'})
+    tag2 = WebObject("https://example.com/data/genome.fa?X-Amz-Signature=xyz789").cache_tag
+    assert tag1 == tag2
+
+    _ranged_server(requests_mock, {"ETag": '"v2"'})
+    assert WebObject(URL).cache_tag != tag1
+
+    _ranged_server(requests_mock, {})
+    assert WebObject(URL).cache_tag is None
+
+
+def test_download_file_ranged(requests_mock, tmp_path):
+    mock = _ranged_server(requests_mock, {"ETag": '"v1"'})
+    dest = tmp_path / "dest"
+    WebObject(URL).download_file(str(dest))
+    assert dest.read_bytes() == CONTENT
+    ranges = sorted(r.headers["Range"] for r in mock.request_history[1:])
+    assert ranges == ["bytes=0-9", "bytes=10-19", "bytes=20-29", "bytes=30-35"]
+    assert all(r.headers["If-Range"] == '"v1"' for r in mock.request_history[1:])
+
+
+def test_download_file_no_ranges(requests_mock, tmp_path):
+    requests_mock.get(URL, content=CONTENT)
+    src = WebObject(URL)
+    assert src.accepts_ranges is False
+
+    dest = tmp_path / "dest"
+    src.download_file(str(dest))
+    assert dest.read_bytes() == CONTENT
+
+
+def test_download_file_changed(requests_mock, tmp_path):
+    _ranged_server(requests_mock, {"ETag": '"v1"'})
+    src = WebObject(URL)
+    _ranged_server(requests_mock, {"ETag": '"v2"'})
+    with pytest.raises(RuntimeError, match="changed during download"):
+        src.download_file(str(tmp_path / "dest"))
+    assert list(tmp_path.iterdir()) == []
@@ -1,12 +1,15 @@
+import fcntl
 import os
 import json
 import logging
 import subprocess
+import time
 
 import pytest
 
 from ..src import runner
-from ..src.runner.workspace import workspace, write_job_data_file, run_commands, run_commands, UserCommandsFailed
+from ..src.runner.workspace import workspace, write_job_data_file, run_commands, run_commands, UserCommandsFailed, \
+    sweep_scratch, native_workspace, _try_lock, WORKSPACE_PREFIX, NATIVE_WORKSPACE_PREFIX, TRASH_DIR
 
 logging.basicConfig(level=logging.INFO)
 
@@ -24,6 +27,85 @@ def test_workspace(monkeypatch, tmp_path):
     assert not os.path.isdir(wrk)
 
 
+def test_sweep_scratch(tmp_path):
+    long_ago = time.time() - 3600
+
+    orphan = tmp_path / f"{WORKSPACE_PREFIX}orphan"
+    orphan.mkdir()
+    (orphan / "leftover.txt").write_text("leftover")
+    os.utime(orphan, (long_ago, long_ago))
+
+    live = tmp_path / f"{WORKSPACE_PREFIX}live"
+    live.mkdir()
+    os.utime(live, (long_ago + 60, long_ago + 60))
+
+    newborn = tmp_path / f"{WORKSPACE_PREFIX}newborn"
+    newborn.mkdir()
+
+    native_orphan = tmp_path / f"{NATIVE_WORKSPACE_PREFIX}dead-job"
+    native_orphan.mkdir()
+    os.utime(native_orphan, (long_ago, long_ago))
+
+    # between containers: unlocked, but touched recently
+    native_handoff = tmp_path / f"{NATIVE_WORKSPACE_PREFIX}live-job"
+    native_handoff.mkdir()
+    os.utime(native_handoff, (time.time() - 300, time.time() - 300))
+
+    stale_lock = tmp_path / "stale_etag.lock"
+    stale_lock.touch()
+    os.utime(stale_lock, (long_ago, long_ago))
+
+    fresh_lock = tmp_path / "fresh_etag.lock"
+    fresh_lock.touch()
+
+    cache_dir = tmp_path / "some_etag"
+    cache_dir.mkdir()
+    os.utime(cache_dir, (long_ago, long_ago))
+
+    trash = tmp_path / TRASH_DIR
+    trash.mkdir()
+    (trash / "old_workspace").mkdir()
+
+    live_fd = os.open(live, os.O_RDONLY)
+    fcntl.flock(live_fd, fcntl.LOCK_SH)
+    try:
+        sweep_scratch(str(tmp_path))
+    finally:
+        os.close(live_fd)
+
+    assert not orphan.exists()
+    assert live.is_dir()
+    assert newborn.is_dir()
+    assert not native_orphan.exists()
+    assert native_handoff.is_dir()
+    assert not stale_lock.exists()
+    assert fresh_lock.exists()
+    assert cache_dir.is_dir()
+    assert list(trash.iterdir()) == []
+
+
+@pytest.mark.parametrize("cleanup", [True, False])
+def test_native_workspace(monkeypatch, tmp_path, cleanup):
+    monkeypatch.setenv("BC_SCRATCH_PATH", str(tmp_path))
+    monkeypatch.setenv("AWS_BATCH_JOB_ID", "job-123")
+    orig_dir = os.getcwd()
+
+    with native_workspace(cleanup) as wrk:
+        assert wrk == str(tmp_path / f"{NATIVE_WORKSPACE_PREFIX}job-123")
+        assert os.getcwd() == wrk
+        # sweep_scratch can't take it
+        assert _try_lock(wrk) is None
+
+    assert os.getcwd() == orig_dir
+    if cleanup:
+        assert not os.path.isdir(wrk)
+    else:
+        assert os.path.isdir(wrk)
+        fd = _try_lock(wrk)
+        assert fd is not None
+        os.close(fd)
+
+
 def test_write_job_data_file(tmp_path):
     job_data = {
         "one": 1,
@@ -41,7 +123,7 @@ def test_write_job_data_file(tmp_path):
     assert jdf_contents == job_data
 
 
-def fake_container(image_tag: str, command: str, work_dir: str, job_data_file) -> int:
+def fake_container(image_tag: str, command: str, work_dir: str, job_data_file, limits: dict) -> int:
     response = subprocess.run(command, shell=True)
     return response.returncode
 
@@ -58,7 +140,7 @@ def test_run_commands(tmp_path, monkeypatch, caplog):
     ]
 
     os.chdir(tmp_path)
-    response = run_commands("fake/image:tag", commands, tmp_path, "fake/job/data/file.json", "sh")
+    response = run_commands("fake/image:tag", commands, tmp_path, "fake/job/data/file.json", "sh", {})
 
     assert "command block succeeded" in caplog.text
     assert f.exists()
@@ -79,7 +161,7 @@ def test_exit_on_command_fail1(tmp_path, monkeypatch):
 
     os.chdir(tmp_path)
     with pytest.raises(UserCommandsFailed) as ucf:
-        run_commands("fake/image:tag", commands, tmp_path, "fake/job/data/file.json", "sh")
+        run_commands("fake/image:tag", commands, tmp_path, "fake/job/data/file.json", "sh", {})
         assert ucf.value.exit_code != 0
 
     assert f.exists()
@@ -100,7 +182,7 @@ def test_exit_on_undef_var1(tmp_path, monkeypatch):
 
     os.chdir(tmp_path)
     with pytest.raises(UserCommandsFailed) as ucf:
-        run_commands("fake/image:tag", commands, tmp_path, "fake/job/data/file.json", "sh")
+        run_commands("fake/image:tag", commands, tmp_path, "fake/job/data/file.json", "sh", {})
         assert ucf.value.exit_code != 0
 
     assert f.exists()
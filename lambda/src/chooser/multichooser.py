@@ -8,6 +8,7 @@ from typing import Generator, Tuple, Any
 import boto3
 from box import Box, BoxList
 
+from codec import object_body
 from lambda_logs import log_preamble, log_event
 from substitutions import substitute_job_data
 
@@ -30,7 +31,7 @@ def load_s3_object(repo: str, input_file: str) -> Any:
 
     bucket, key = s3_path.split("/", 3)[2:]
     response = s3.get_object(Bucket=bucket, Key=key)
-    with closing(response["Body"]) as fp:
+    with closing(object_body(response)) as fp:
         ret = json.load(fp)
 
     return ret
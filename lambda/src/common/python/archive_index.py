@@ -0,0 +1,47 @@
+from contextlib import closing
+import fnmatch
+import json
+from typing import List
+
+import boto3
+
+from repo_utils import S3File
+
+# bclaw_runner writes the index of each archived directory output to a folder next to it, which globs
+# skip; see bclaw_runner/src/runner/archive.py
+INDEX_DIR = "_archive_index_"
+
+
+def index_key(archive_key: str) -> str:
+    """
+    Returns the key (or URI) of the index of the archive at archive_key (or URI),
+    e.g. path/to/_archive_index_/archive.json
+    """
+    head, sep, name = archive_key.rpartition("/")
+    return f"{head}{sep}{INDEX_DIR}/{name}.json"
+
+
+def is_index_key(key: str) -> bool:
+    return INDEX_DIR in key.split("/")[:-1]
+
+
+def list_archive_members(archive: S3File) -> List[str]:
+    """
+    Returns the names of the files in an archived directory output, in archive order.
+    """
+    index_obj = boto3.resource("s3").Object(archive.bucket, index_key(archive.key))
+    response = index_obj.get()
+    with closing(response["Body"]) as fp:
+        index = json.load(fp)
+    ret = [m["name"] for m in index["members"]]
+    return ret
+
+
+def expand_archive_glob(archive: S3File, member_glob: str) -> List[str]:
+    """
+    Returns archive#member references for the members of an archived directory output that
+    match member_glob.
+    """
+    members = fnmatch.filter(list_archive_members(archive), member_glob)
+    ret = [f"{archive}#{m}" for m in members]
+    return ret
@@ -0,0 +1,48 @@
+import gzip
+
+try:
+    from compression import zstd
+except ImportError:
+    zstd = None
+
+# bclaw_runner records the codec of compressed outputs under this metadata key; see bclaw_runner/src/runner/codec.py
+CODEC_METADATA_KEY = "bclaw_codec"
+
+
+class DecompressedBody(object):
+    """
+    Stands in for the StreamingBody of a compressed object, providing the parts of its interface
+    (read, iter_lines, close) that the lambdas use.
+    """
+    def __init__(self, body, codec: str):
+        self.body = body
+        if codec == "gzip":
+            self.stream = gzip.GzipFile(fileobj=body, mode="rb")
+        elif codec == "zstd":
+            if zstd is None:
+                raise RuntimeError("zstd decompression requires Python 3.14 or later")
+            self.stream = zstd.ZstdFile(body, mode="rb")
+        else:
+            raise ValueError(f"unsupported codec {codec}")
+
+    def read(self, size: int = -1) -> bytes:
+        return self.stream.read(size)
+
+    def iter_lines(self):
+        for line in self.stream:
+            yield line.rstrip(b"\r\n")
+
+    def close(self):
+        self.stream.close()
+        self.body.close()
+
+
+def object_body(response: dict):
+    """
+    Returns the body of an S3 get_object response, decompressing it if bclaw_runner compressed
+    the object when uploading it.
+    """
+    codec = response.get("Metadata", {}).get(CODEC_METADATA_KEY)
+    if codec is None:
+        return response["Body"]
+    return DecompressedBody(response["Body"], codec)
@@ -1,26 +1,128 @@
 from contextlib import closing
 import csv
+from functools import lru_cache
+import itertools
 import json
 import re
+from typing import Callable, Generator, Iterable, NamedTuple, Optional, Tuple
 
 import boto3
+import ijson
 from jsonpath import jsonpath
 import yaml
 
+from codec import object_body
+
 # matches:
 #   s3://(bucket)/(key/key/key.ext):(jsonpath)
 #   s3://(bucket)/(key/key/key.ext)
 PARSER = re.compile(r"^s3://(.+?)/([^:]+)(?::(.+))?$")
 
+# matches selectors that pick elements out of an array, e.g. $.samples[*].id or $[10:20]:
+#   $(.path.to.array)([*] or [start:stop])(rest of the selector)
+ELEMENT_SELECTOR = re.compile(r"^\$(?P<path>(?:\.[A-Za-z_]\w*)*)"
+                              r"(?:\[\*\]|\[(?P<start>\d*):(?P<stop>\d*)\])"
+                              r"(?P<rest>.*)$")
+FIELDS = re.compile(r"(?:\.[A-Za-z_]\w*)+")
+
+
+class ElementSelector(NamedTuple):
+    path: Tuple[str, ...]
+    start: Optional[int]
+    stop: Optional[int]
+    fields: Optional[Tuple[str, ...]]
+    select: Callable[[object], list]
+
+
+def _select_fields(fields: Tuple[str, ...]) -> Callable[[object], list]:
+    def _impl(item) -> list:
+        for field in fields:
+            if not isinstance(item, dict) or field not in item:
+                return []
+            item = item[field]
+        return [item]
+    return _impl
+
+
+def _select_jsonpath(selector: str) -> Callable[[object], list]:
+    def _impl(item) -> list:
+        ret = jsonpath(item, selector)
+        return ret if isinstance(ret, list) else []
+    return _impl
+
+
+@lru_cache(maxsize=None)
+def compile_selector(selector: str) -> Optional[ElementSelector]:
+    """
+    Splits a selector that picks out elements of an array, e.g. $.samples[*].id, into the path to the
+    array ("samples"), the range of elements it takes, and a function that applies the rest of the
+    selector (".id") to one element. Returns None if the selector can't be applied one element at a time.
+    """
+    if (m := ELEMENT_SELECTOR.fullmatch(selector)) is None:
+        return None
+
+    path = tuple(p for p in m.group("path").split(".") if p)
+    start = int(m.group("start")) if m.group("start") else None
+    stop = int(m.group("stop")) if m.group("stop") else None
+    rest = m.group("rest")
+
+    if rest == "":
+        fields = ()
+        select = _select_fields(fields)
+    elif FIELDS.fullmatch(rest):
+        # plain field lookups are common enough to skip jsonpath for
+        fields = tuple(rest[1:].split("."))
+        select = _select_fields(fields)
+    else:
+        fields = None
+        select = _select_jsonpath("$" + rest)
+
+    return ElementSelector(path, start, stop, fields, select)
+
 
 def read_json(body):
     ret = json.load(body)
     return ret
 
 
-def read_json_lines(body):
-    ret = [json.loads(l) for l in body.iter_lines()]
-    return ret
+def read_json_elements(body, path: Iterable[str] = ()) -> Generator[object, None, None]:
+    """
+    Yields the elements of the array (or the values of the object) found at path in a JSON document,
+    one at a time, without reading the whole document into memory.
+    """
+    prefix = ".".join(path)
+    events = ijson.parse(body, use_float=True)
+
+    for p, event, _ in events:
+        if p == prefix and event in ("start_array", "start_map"):
+            break
+    else:
+        return
+
+    depth = 0
+    builder = None
+    for _, event, value in events:
+        if depth == 0:
+            if event in ("end_array", "end_map"):
+                return
+            if event == "map_key":
+                continue
+            builder = ijson.ObjectBuilder()
+
+        builder.event(event, value)
+        if event in ("start_array", "start_map"):
+            depth += 1
+        elif event in ("end_array", "end_map"):
+            depth -= 1
+
+        if depth == 0:
+            yield builder.value
+
+
+def read_json_lines(body) -> Generator[object, None, None]:
+    for l in body.iter_lines():
+        if l.strip():
+            yield json.loads(l)
 
 
 def read_yaml(body):
@@ -28,15 +130,46 @@ def read_yaml(body):
     return ret
 
 
-def read_csv(body, delim=","):
+def read_csv(body, delim=",") -> Generator[dict, None, None]:
     text = (l.decode("utf-8") for l in body.iter_lines())
-    ret = list(csv.DictReader(text, delimiter=delim))
-    return ret
-
-
-def slurp(body):
-    ret = [l.decode("utf-8") for l in body.iter_lines()]
-    return ret
+    yield from csv.DictReader(text, delimiter=delim)
+
+
+def slurp(body) -> Generator[str, None, None]:
+    for l in body.iter_lines():
+        yield l.decode("utf-8")
+
+
+def read_parquet(bucket: str, key: str, columns: list = None) -> Generator[dict, None, None]:
+    """
+    Yields the rows of a Parquet file as dicts, one record batch at a time. If columns is given, only
+    those columns are read. Needs pyarrow, which isn't in the Lambda layer by default.
+    """
+    try:
+        import pyarrow.fs
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("pyarrow is required to read Parquet files")
+
+    fs, path = pyarrow.fs.FileSystem.from_uri(f"s3://{bucket}/{key}")
+    with fs.open_input_file(path) as fp:
+        parquet_file = pyarrow.parquet.ParquetFile(fp)
+        if columns is not None:
+            columns = [c for c in columns if c in parquet_file.schema_arrow.names]
+            if not columns:
+                return
+        for batch in parquet_file.iter_batches(columns=columns):
+            yield from batch.to_pylist()
+
+
+# readers that yield a file's contents as an array, one element at a time
+ROW_READERS = {
+    ".jsonl": read_json_lines,
+    ".ndjson": read_json_lines,
+    ".csv": read_csv,
+    ".tsv": lambda body: read_csv(body, delim="\t"),
+    ".tab": lambda body: read_csv(body, delim="\t"),
+}
 
 
 def stringify(item) -> str:
@@ -46,33 +179,76 @@ def stringify(item) -> str:
         return str(item)
 
 
-def select_file_contents(s3_path: str) -> list:
-    bucket, key, selector = PARSER.fullmatch(s3_path).groups()
+def _extension(key: str) -> str:
+    m = re.search(r"\.[^./]+$", key)
+    return m.group(0) if m else ""
+
+
+def _read_all(body, extension: str):
+    if extension == ".json":
+        return read_json(body)
+    if extension in (".yaml", ".yml"):
+        return read_yaml(body)
+    return list(ROW_READERS.get(extension, slurp)(body))
+
+
+def _select_parquet(bucket: str, key: str, selector: Optional[str]) -> Generator[object, None, None]:
+    # without a selector, every row is a scatter value
+    compiled = compile_selector(selector or "$[*]")
+    if compiled is None or compiled.path:
+        contents = list(read_parquet(bucket, key))
+        ret = jsonpath(contents, selector)
+        if not isinstance(ret, list):
+            raise AssertionError("selector did not create a list")
+        yield from ret
+        return
+
+    columns = [compiled.fields[0]] if compiled.fields else None
+    for row in itertools.islice(read_parquet(bucket, key, columns), compiled.start, compiled.stop):
+        yield from compiled.select(row)
+
+
+def _select(bucket: str, key: str, selector: Optional[str]) -> Generator[object, None, None]:
+    extension = _extension(key)
+    if extension == ".parquet":
+        yield from _select_parquet(bucket, key, selector)
+        return
 
     s3 = boto3.client("s3")
     response = s3.get_object(Bucket=bucket, Key=key)
-    with closing(response["Body"]) as fp:
+    with closing(object_body(response)) as fp:
         if selector is None:
-            ret0 = slurp(fp)
+            yield from slurp(fp)
+            return
+
+        compiled = compile_selector(selector)
+        if compiled is not None and extension == ".json":
+            elements = read_json_elements(fp, compiled.path)
+        elif compiled is not None and not compiled.path and extension not in (".yaml", ".yml"):
+            elements = ROW_READERS.get(extension, slurp)(fp)
         else:
-            if key.endswith(".json"):
-                contents = read_json(fp)
-            elif key.endswith(".jsonl") or key.endswith(".ndjson"):
-                contents = read_json_lines(fp)
-            elif key.endswith(".yaml") or key.endswith(".yml"):
-                contents = read_yaml(fp)
-            elif key.endswith(".csv"):
-                contents = read_csv(fp)
-            elif key.endswith(".tsv") or key.endswith(".tab"):
-                contents = read_csv(fp, delim="\t")
-            else:
-                contents = slurp(fp)
-
-            ret0 = jsonpath(contents, selector)
-
-    if not isinstance(ret0, list):
-        raise AssertionError("selector did not create a list")
+            ret = jsonpath(_read_all(fp, extension), selector)
+            if not isinstance(ret, list):
+                raise AssertionError("selector did not create a list")
+            yield from ret
+            return
+
+        for element in itertools.islice(elements, compiled.start, compiled.stop):
+            yield from compiled.select(element)
+
+
+def select_file_contents(s3_path: str) -> Generator[str, None, None]:
+    """
+    Yields the values picked out of an S3 file by a JSON Path selector, or each line of the file if there
+    is no selector. Selectors that take elements of an array, like $[*].name or $.samples[10:20], are
+    applied as the file is read, so the file never has to fit in memory; anything else reads the whole file.
+    """
+    bucket, key, selector = PARSER.fullmatch(s3_path).groups()
 
-    ret = [stringify(i) for i in ret0]
+    empty = True
+    for item in _select(bucket, key, selector):
+        empty = False
+        yield stringify(item)
 
-    return ret
+    if empty and selector is not None:
+        raise AssertionError("selector did not create a list")
@@ -1,9 +1,21 @@
 from dataclasses import dataclass
+from datetime import datetime
 import json
 
+import boto3
+
 
 SYSTEM_FILE_TAG = "bclaw.system=true"
 
+# bookkeeping in a scatter step's repo, shared by the scatter and gather lambdas
+BRANCH_FIELD = "_branch"
+INDEX_FIELD = "_index"
+MAP_RESULTS_DIR = "_results_"
+FAILED_BRANCHES_FILE = "failed.csv"
+SCATTER_SIGNATURE = "scatter-signature"
+
+PART_SIZE = 8 * 1024 ** 2
+
 # @dataclass
 # class S3File:
 #     bucket: str
@@ -16,12 +28,15 @@ SYSTEM_FILE_TAG = "bclaw.system=true"
 #     #     return self.bucket == other.bucket and self.key == other.key
 
 class S3File(str):
-    def __new__(cls, bucket: str, key: str):
+    def __new__(cls, bucket: str, key: str, size: int = None, last_modified: datetime = None):
         return str.__new__(cls, f"s3://{bucket}/{key}")
 
-    def __init__(self, bucket: str, key: str):
+    def __init__(self, bucket: str, key: str, size: int = None, last_modified: datetime = None):
         self.bucket = bucket
         self.key = key
+        # object size in bytes and modification time, when they come for free with a listing
+        self.size = size
+        self.last_modified = last_modified
 
 
 # @dataclass
@@ -108,3 +123,49 @@ class Repo(dict):
 #             return {"bucket": o.bucket, "prefix": o.prefix, "uri": str(o)}
 #         else:
 #             return super().default(o)
+
+
+class MultipartWriter(object):
+    """
+    Text file-like object that streams whatever is written to it into an S3 multipart upload, holding
+    no more than about PART_SIZE bytes in memory. The upload is completed when the context exits
+    normally, and aborted otherwise.
+    """
+    def __init__(self, s3_file: S3File, part_size: int = PART_SIZE, **kwargs):
+        self.s3 = boto3.client("s3")
+        self.s3_file = s3_file
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts = []
+        response = self.s3.create_multipart_upload(Bucket=s3_file.bucket, Key=s3_file.key, **kwargs)
+        self.upload_id = response["UploadId"]
+
+    def _upload_part(self) -> None:
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(Bucket=self.s3_file.bucket, Key=self.s3_file.key,
+                                       UploadId=self.upload_id, PartNumber=part_number,
+                                       Body=bytes(self.buffer))
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.buffer.clear()
+
+    def write(self, text: str) -> int:
+        self.buffer += text.encode("utf-8")
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+        return len(text)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            # the last part may be smaller than the minimum, and there must be at least one
+            if self.buffer or not self.parts:
+                self._upload_part()
+            self.s3.complete_multipart_upload(Bucket=self.s3_file.bucket, Key=self.s3_file.key,
+                                              UploadId=self.upload_id,
+                                              MultipartUpload={"Parts": self.parts})
+        else:
+            self.s3.abort_multipart_upload(Bucket=self.s3_file.bucket, Key=self.s3_file.key,
+                                           UploadId=self.upload_id)
+        return False
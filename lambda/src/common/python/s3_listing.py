@@ -0,0 +1,263 @@
+from collections import deque
+from contextlib import closing
+import csv
+from datetime import datetime
+import fnmatch
+import gzip
+import io
+import itertools
+import json
+import queue
+import re
+import threading
+from typing import Generator, List
+from urllib.parse import unquote_plus
+
+import boto3
+
+from archive_index import is_index_key
+from repo_utils import S3File
+
+LISTING_WORKERS = 32
+PAGE_SIZE = 1000
+PAGES_AHEAD = 2
+MAX_SPLIT_DEPTH = 3
+
+# partition boundaries for listings that can't be split on a delimiter, in UTF-8 byte order
+BOUNDARIES = sorted("-.0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz")
+
+
+def _matcher(key_glob: str):
+    match = re.compile(fnmatch.translate(key_glob)).match
+    return lambda key: match(key) and not is_index_key(key)
+
+
+def _invariant_prefix(key_glob: str) -> str:
+    # the part of the glob before the first wildcard, e.g. dir1/dir2/dir*/yada_yada.txt --> dir1/dir2/dir
+    return re.search(r"(^.*?)(?:[\[\]*?]|$)", key_glob).group(1)
+
+
+# -------- S3 Inventory --------
+
+def _parse_timestamp(timestamp: str) -> datetime:
+    # e.g. 2026-10-18T01:23:45.000Z
+    return datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+
+
+def _inventory_csv_keys(s3, bucket: str, key: str, schema: List[str]) -> Generator[tuple, None, None]:
+    bucket_col = schema.index("Bucket")
+    key_col = schema.index("Key")
+    size_col = schema.index("Size") if "Size" in schema else None
+    modified_col = schema.index("LastModifiedDate") if "LastModifiedDate" in schema else None
+    is_latest_col = schema.index("IsLatest") if "IsLatest" in schema else None
+    delete_marker_col = schema.index("IsDeleteMarker") if "IsDeleteMarker" in schema else None
+
+    response = s3.get_object(Bucket=bucket, Key=key)
+    with closing(response["Body"]) as body, \
+            io.TextIOWrapper(gzip.GzipFile(fileobj=body), encoding="utf-8", newline="") as text:
+        for row in csv.reader(text):
+            if is_latest_col is not None and row[is_latest_col] == "false":
+                continue
+            if delete_marker_col is not None and row[delete_marker_col] == "true":
+                continue
+            size = int(row[size_col]) if size_col is not None and row[size_col] else None
+            last_modified = _parse_timestamp(row[modified_col]) if modified_col is not None and row[modified_col] \
+                else None
+            # inventory reports URL-encode the object keys
+            yield row[bucket_col], unquote_plus(row[key_col]), size, last_modified
+
+
+def _inventory_parquet_keys(bucket: str, key: str) -> Generator[tuple, None, None]:
+    try:
+        import pyarrow.fs
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError("pyarrow is required to read Parquet inventory reports")
+
+    fs, path = pyarrow.fs.FileSystem.from_uri(f"s3://{bucket}/{key}")
+    with fs.open_input_file(path) as fp:
+        parquet_file = pyarrow.parquet.ParquetFile(fp)
+        columns = [c for c in ("bucket", "key", "size", "last_modified_date", "is_latest", "is_delete_marker")
+                   if c in parquet_file.schema_arrow.names]
+        for batch in parquet_file.iter_batches(columns=columns):
+            for row in batch.to_pylist():
+                if row.get("is_latest") is False or row.get("is_delete_marker") is True:
+                    continue
+                yield row["bucket"], row["key"], row.get("size"), row.get("last_modified_date")
+
+
+def expand_inventory(manifest: S3File, key_glob: str = None) -> Generator[S3File, None, None]:
+    """
+    Yields the objects listed in an S3 Inventory report, in report order, given the location of the report's
+    manifest.json file. If key_glob is given, only objects with keys matching it are returned. Noncurrent
+    versions and delete markers are skipped.
+
+    CSV reports are streamed. Parquet reports need pyarrow, which isn't in the Lambda layer by default.
+    ORC reports are not supported.
+    """
+    s3 = boto3.client("s3")
+    response = s3.get_object(Bucket=manifest.bucket, Key=manifest.key)
+    with closing(response["Body"]) as fp:
+        manifest_data = json.load(fp)
+
+    # destinationBucket is an ARN: arn:aws:s3:::bucket-name
+    report_bucket = manifest_data["destinationBucket"].rsplit(":", 1)[-1]
+    file_format = manifest_data["fileFormat"].upper()
+    schema = [f.strip() for f in manifest_data["fileSchema"].split(",")]
+    match = _matcher(key_glob) if key_glob is not None else None
+
+    for report_file in manifest_data["files"]:
+        if file_format == "CSV":
+            rows = _inventory_csv_keys(s3, report_bucket, report_file["key"], schema)
+        elif file_format == "PARQUET":
+            rows = _inventory_parquet_keys(report_bucket, report_file["key"])
+        else:
+            raise RuntimeError(f"unsupported inventory report format: {manifest_data['fileFormat']}")
+
+        for bucket, key, size, last_modified in rows:
+            if match is None or match(key):
+                yield S3File(bucket, key, size, last_modified)
+
+
+# -------- parallel listing --------
+
+class _Partition(object):
+    """
+    A range of keys in a parallel listing: keys starting with prefix, greater than start_after (if given) and
+    less than or equal to last_key (if given). A thread lists the range and puts each page of matching objects
+    on a queue as it arrives, holding no more than PAGES_AHEAD pages while it waits for its turn.
+
+    If the first page shows that the range holds more than a page of keys, the rest of it is split up again on
+    the next character (see split) and the sub-partitions are handed back through the queue instead, so that
+    key spaces crowded onto a few leading characters still get listed in parallel.
+    """
+    def __init__(self, bucket: str, prefix: str, start_after: str = None, last_key: str = None, depth: int = 0):
+        self.bucket = bucket
+        self.prefix = prefix
+        self.start_after = start_after
+        self.last_key = last_key
+        self.depth = depth
+        self.pages = queue.Queue(maxsize=PAGES_AHEAD)
+        self.started = False
+
+    def split(self, last_seen: str) -> List["_Partition"]:
+        # Split what's left after last_seen at every boundary character appended to the start of the range.
+        # e.g. (data/S, data/T] becomes (data/S0999.bam, data/S1], (data/S1, data/S2], ... (data/Sz, data/T]
+        stem = self.start_after if self.start_after is not None else self.prefix
+        lo_bytes = last_seen.encode("utf-8")
+        hi_bytes = self.last_key.encode("utf-8") if self.last_key is not None else None
+        bounds = [b for b in (stem + c for c in BOUNDARIES)
+                  if lo_bytes < b.encode("utf-8") and (hi_bytes is None or b.encode("utf-8") < hi_bytes)]
+        if not bounds:
+            return []
+
+        ret = []
+        for lo, hi in zip([last_seen, *bounds], [*bounds, self.last_key]):
+            ret.append(_Partition(self.bucket, self.prefix, lo, hi, self.depth + 1))
+        return ret
+
+    def _put(self, message: tuple, stop: threading.Event) -> None:
+        while not stop.is_set():
+            try:
+                self.pages.put(message, timeout=1)
+                return
+            except queue.Full:
+                pass
+
+    def _list(self, s3, match, stop: threading.Event) -> None:
+        try:
+            last_bytes = self.last_key.encode("utf-8") if self.last_key is not None else None
+            params = {"Prefix": self.prefix}
+            if self.start_after is not None:
+                params["StartAfter"] = self.start_after
+
+            paginator = s3.get_paginator("list_objects_v2")
+            for n, page in enumerate(paginator.paginate(Bucket=self.bucket, PaginationConfig={"PageSize": PAGE_SIZE},
+                                                        **params)):
+                ret = []
+                for obj in page.get("Contents", []):
+                    key = obj["Key"]
+                    # S3 lists keys in UTF-8 byte order
+                    if last_bytes is not None and key.encode("utf-8") > last_bytes:
+                        self._put(("page", ret), stop)
+                        self._put(("done", None), stop)
+                        return
+                    if match(key):
+                        ret.append(S3File(self.bucket, key, obj["Size"], obj["LastModified"]))
+                self._put(("page", ret), stop)
+
+                if n == 0 and page.get("IsTruncated") and self.depth < MAX_SPLIT_DEPTH and \
+                        (sub_partitions := self.split(page["Contents"][-1]["Key"])):
+                    self._put(("split", sub_partitions), stop)
+                    return
+
+                if stop.is_set():
+                    return
+
+            self._put(("done", None), stop)
+
+        except Exception as e:
+            self._put(("error", e), stop)
+
+    def start(self, s3, match, stop: threading.Event) -> None:
+        self.started = True
+        threading.Thread(target=self._list, args=(s3, match, stop), daemon=True).start()
+
+
+def _partitions(s3, bucket: str, prefix: str, rest: str) -> List[_Partition]:
+    # If the glob continues into subdirectories, each subdirectory under the prefix is its own partition.
+    # Objects directly under the prefix can't match, because the glob requires another "/".
+    if "/" in rest:
+        ret = []
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix, Delimiter="/"):
+            ret.extend(_Partition(bucket, cp["Prefix"]) for cp in page.get("CommonPrefixes", []))
+        return ret
+
+    # Otherwise, split the key space after the prefix into character ranges. Each partition covers
+    # keys greater than its start_after and less than or equal to its last_key.
+    bounds = [prefix + c for c in BOUNDARIES]
+    ret = [_Partition(bucket, prefix, None, bounds[0])]
+    for lo, hi in zip(bounds, bounds[1:]):
+        ret.append(_Partition(bucket, prefix, lo, hi))
+    ret.append(_Partition(bucket, prefix, bounds[-1], None))
+    return ret
+
+
+def parallel_glob(globby_file: S3File) -> Generator[S3File, None, None]:
+    """
+    Yields the objects matching an S3 glob, in the same order as a plain listing would. The key space under
+    the glob's invariant prefix is split into partitions, by subdirectory if the glob spans directories and
+    by character ranges otherwise, and up to LISTING_WORKERS of them are listed at once. Partitions that turn
+    out to hold more than a page of keys are split again, up to MAX_SPLIT_DEPTH times. Each page is yielded
+    as soon as everything before it has been, so only a few pages per partition are held in memory.
+    """
+    s3 = boto3.client("s3")
+    prefix = _invariant_prefix(globby_file.key)
+    match = _matcher(globby_file.key)
+    pending = deque(_partitions(s3, globby_file.bucket, prefix, globby_file.key[len(prefix):]))
+
+    stop = threading.Event()
+    active = 0
+    try:
+        while pending:
+            # the partition at the head is always listing, and up to LISTING_WORKERS more are listing ahead of it
+            for i, partition in enumerate(itertools.islice(pending, LISTING_WORKERS)):
+                if not partition.started and (i == 0 or active < LISTING_WORKERS):
+                    partition.start(s3, match, stop)
+                    active += 1
+
+            kind, value = pending[0].pages.get()
+            if kind == "page":
+                yield from value
+            elif kind == "split":
+                pending.popleft()
+                pending.extendleft(reversed(value))
+                active -= 1
+            elif kind == "done":
+                pending.popleft()
+                active -= 1
+            else:
+                raise value
+    finally:
+        stop.set()
@@ -4,13 +4,30 @@ import math
 import os
 import re
 from typing import Generator, List, Union
+import urllib.request
 
+import boto3
 import humanfriendly
 
 from .util import Step, Resource, State, make_logical_name, time_string_to_seconds
 
 SCRATCH_PATH = "/_bclaw_scratch"
 
+# container names for native mode job definitions
+STAGE_IN_CONTAINER = "stage_in"
+USER_CONTAINER = "user_commands"
+STAGE_OUT_CONTAINER = "stage_out"
+NATIVE_CONTAINERS = [STAGE_IN_CONTAINER, USER_CONTAINER, STAGE_OUT_CONTAINER]
+
+# the stage-in runner writes this script into a workspace named after the Batch job ID
+NATIVE_USER_COMMAND = 'sh "${BC_SCRATCH_PATH}/bclaw_native_${AWS_BATCH_JOB_ID}/_bclaw_native.sh"'
+NATIVE_RUNNER_MEMORY = 1024
+
+ECR_IMAGE = re.compile(r"^(?:(?P<account>\d+)\.dkr\.ecr\.(?P<region>[\w-]+)\.amazonaws\.com/)?"
+                       r"(?P<repo>[^.:@$]+?)(?::(?P<tag>[\w.-]+)|@(?P<digest>sha256:[0-9a-f]+))?$")
+MANIFEST_TYPES = ["application/vnd.docker.distribution.manifest.v2+json",
+                  "application/vnd.oci.image.manifest.v1+json"]
+
 
 def expand_image_uri(image_spec: dict) -> Union[str, dict]:
     uri = image_spec["name"]
@@ -103,45 +120,81 @@ def get_resource_requirements(step: Step) -> dict:
     return ret
 
 
-def get_volume_info(step: Step) -> dict:
+def get_container_limits(compute_spec: dict) -> dict:
+    # these are applied by bclaw_runner to the user's container, rather than to the runner's own container
+    ret = {}
+
+    if compute_spec.get("hard_cpu_limit"):
+        ret["nano_cpus"] = compute_spec["cpus"] * 1_000_000_000
+
+    if (cpuset := compute_spec.get("cpuset")) is not None:
+        ret["cpuset_cpus"] = cpuset
+
+    if (numa_nodes := compute_spec.get("numa_nodes")) is not None:
+        ret["cpuset_mems"] = numa_nodes
+
+    if (shm_size := compute_spec.get("shm_size")) is not None:
+        ret["shm_size"] = f"{get_memory_in_mibs(shm_size)}m"
+
+    if ulimits := compute_spec.get("ulimits"):
+        ret["ulimits"] = []
+        for name, limit in ulimits.items():
+            if isinstance(limit, dict):
+                ret["ulimits"].append({"name": name, "soft": limit["soft"], "hard": limit["hard"]})
+            else:
+                ret["ulimits"].append({"name": name, "soft": limit, "hard": limit})
+
+    return ret
+
+
+def get_volume_info(step: Step, native: bool = False) -> dict:
     volumes = [
-        {
-            "Name": "docker_socket",
-            "Host": {
-                "SourcePath": "/var/run/docker.sock",
-            },
-        },
         {
             "Name": "scratch",
             "Host": {
                 "SourcePath": "/scratch",
             },
         },
-        {
-            "Name": "docker_scratch",
-            "Host": {
-                "SourcePath": "/docker_scratch"
-            },
-        }
     ]
     mount_points = [
-        {
-            "SourceVolume": "docker_socket",
-            "ContainerPath": "/var/run/docker.sock",
-            "ReadOnly": False,
-        },
         {
             "SourceVolume": "scratch",
             "ContainerPath": SCRATCH_PATH,
             "ReadOnly": False,
         },
-        {
-            "SourceVolume": "docker_scratch",
-            "ContainerPath": "/.scratch",
-            "ReadOnly": False,
-        }
     ]
 
+    # native mode jobs don't start docker containers of their own
+    if not native:
+        volumes = [
+            {
+                "Name": "docker_socket",
+                "Host": {
+                    "SourcePath": "/var/run/docker.sock",
+                },
+            },
+            *volumes,
+            {
+                "Name": "docker_scratch",
+                "Host": {
+                    "SourcePath": "/docker_scratch"
+                },
+            }
+        ]
+        mount_points = [
+            {
+                "SourceVolume": "docker_socket",
+                "ContainerPath": "/var/run/docker.sock",
+                "ReadOnly": False,
+            },
+            *mount_points,
+            {
+                "SourceVolume": "docker_scratch",
+                "ContainerPath": "/.scratch",
+                "ReadOnly": False,
+            }
+        ]
+
     for filesystem in step.spec["filesystems"]:
         volume_name = f"{filesystem['efs_id']}-volume"
         volumes.append({
@@ -197,6 +250,142 @@ def get_consumable_resource_properties(spec: dict) -> dict:
         return {}
 
 
+def get_runner_command(native_phase: str = None) -> list:
+    ret = [
+        "python", "/bclaw_runner/src/runner_cli.py",
+        "-c", "Ref::command",
+        "-e", "Ref::engine",
+        "-f", "Ref::references",
+        "-i", "Ref::inputs",
+        "-k", "Ref::skip",
+        "-l", "Ref::limits",
+        "-m", "Ref::image",
+        "-o", "Ref::outputs",
+        "-p", "Ref::checkpoint",
+        "-q", "Ref::qc",
+        "-r", "Ref::repo",
+        "-s", "Ref::shell",
+        "-t", "Ref::s3tags",
+    ]
+    if native_phase is not None:
+        ret += ["-n", native_phase]
+    return ret
+
+
+def get_container_properties(step: Step, task_role: str) -> dict:
+    ret = {
+        "ContainerProperties": {
+            "Image": os.environ["RUNNER_REPO_URI"] + ":" + os.environ["SOURCE_VERSION"],
+            "Command": get_runner_command(),
+            "JobRoleArn": task_role,
+            **get_environment(step),
+            **get_resource_requirements(step),
+            **get_volume_info(step),
+        },
+    }
+    return ret
+
+
+def image_entrypoint(image_name: str) -> List[str] | None:
+    """
+    Returns the ENTRYPOINT of an image in ECR (a bare image name means this account's ECR), or None if it
+    doesn't have one. Images in other registries, and images that can't be inspected -- not pushed yet,
+    multi-platform, no permission -- are assumed not to have one.
+    """
+    logger = logging.getLogger(__name__)
+    if (m := ECR_IMAGE.fullmatch(image_name)) is None:
+        logger.info(f"{image_name} is not in ECR, not checking it for an ENTRYPOINT")
+        return None
+
+    try:
+        ecr = boto3.client("ecr", region_name=m.group("region"))
+        registry = {"registryId": m.group("account")} if m.group("account") else {}
+        image_id = {"imageDigest": m.group("digest")} if m.group("digest") else {"imageTag": m.group("tag") or "latest"}
+        response = ecr.batch_get_image(**registry, repositoryName=m.group("repo"), imageIds=[image_id],
+                                       acceptedMediaTypes=MANIFEST_TYPES)
+        manifest = json.loads(response["images"][0]["imageManifest"])
+        url = ecr.get_download_url_for_layer(**registry, repositoryName=m.group("repo"),
+                                             layerDigest=manifest["config"]["digest"])["downloadUrl"]
+        with urllib.request.urlopen(url) as fp:
+            config = json.load(fp)
+    except Exception:
+        logger.warning(f"unable to check {image_name} for an ENTRYPOINT")
+        return None
+
+    return config.get("config", {}).get("Entrypoint") or None
+
+
+def get_ecs_properties(step: Step, task_role: str) -> dict:
+    # Native mode runs the user's image directly, as the middle container of a three-container job:
+    # the runner stages inputs in, the user's commands run, then the runner stages outputs out.
+    # This avoids starting a second, nested container, and doesn't require the docker socket.
+    image_spec = expand_image_uri(step.spec["image"])
+    if "${!" in image_spec["name"]:
+        raise RuntimeError(f"step {step.name}: job data substitutions in image names are not supported in native mode")
+    if image_spec.get("auth"):
+        raise RuntimeError(f"step {step.name}: private registry credentials are not supported in native mode")
+    # Batch can't override an image's ENTRYPOINT in a multi-container job, so it would run the user command block
+    if image_entrypoint(step.spec["image"]["name"]) is not None:
+        raise RuntimeError(f"step {step.name}: images with an ENTRYPOINT are not supported in native mode")
+
+    volume_info = get_volume_info(step, native=True)
+    scratch_mount = [mp for mp in volume_info["MountPoints"] if mp["SourceVolume"] == "scratch"]
+
+    def _runner_container(name: str, phase: str, depends_on: list) -> dict:
+        ret = {
+            "Name": name,
+            "Image": os.environ["RUNNER_REPO_URI"] + ":" + os.environ["SOURCE_VERSION"],
+            "Command": get_runner_command(phase),
+            "Essential": name == STAGE_OUT_CONTAINER,
+            "DependsOn": depends_on,
+            **get_environment(step),
+            "MountPoints": scratch_mount,
+            "ResourceRequirements": [
+                {
+                    "Type": "MEMORY",
+                    "Value": str(NATIVE_RUNNER_MEMORY),
+                },
+            ],
+        }
+        return ret
+
+    user_container = {
+        "Name": USER_CONTAINER,
+        "Image": {"Fn::Sub": image_spec["name"]},
+        "Command": ["sh", "-c", NATIVE_USER_COMMAND],
+        "Essential": False,
+        "DependsOn": [{"ContainerName": STAGE_IN_CONTAINER, "Condition": "SUCCESS"}],
+        **get_environment(step),
+        **get_resource_requirements(step),
+        "MountPoints": volume_info["MountPoints"],
+    }
+
+    limits = get_container_limits(step.spec["compute"])
+    if "shm_size" in limits:
+        user_container["LinuxParameters"] = {"SharedMemorySize": get_memory_in_mibs(step.spec["compute"]["shm_size"])}
+    if "ulimits" in limits:
+        user_container["Ulimits"] = [{"Name": u["name"], "SoftLimit": u["soft"], "HardLimit": u["hard"]}
+                                     for u in limits["ulimits"]]
+
+    ret = {
+        "EcsProperties": {
+            "TaskProperties": [
+                {
+                    "Containers": [
+                        _runner_container(STAGE_IN_CONTAINER, "stage-in", []),
+                        user_container,
+                        _runner_container(STAGE_OUT_CONTAINER, "stage-out",
+                                          [{"ContainerName": USER_CONTAINER, "Condition": "COMPLETE"}]),
+                    ],
+                    "TaskRoleArn": task_role,
+                    "Volumes": volume_info["Volumes"],
+                },
+            ],
+        },
+    }
+    return ret
+
+
 def job_definition_rc(step: Step,
                       task_role: str,
                       shell_opt: str,
@@ -204,6 +393,11 @@ def job_definition_rc(step: Step,
                       job_tags: dict) -> Generator[Resource, None, str]:
     logical_name = make_logical_name(f"{step.name}.job.defz")
 
+    if step.spec["compute"].get("native"):
+        properties = get_ecs_properties(step, task_role)
+    else:
+        properties = get_container_properties(step, task_role)
+
     job_def = {
         "Type": "AWS::Batch::JobDefinition",
         "UpdateReplacePolicy": "Retain",
@@ -223,27 +417,11 @@ def job_definition_rc(step: Step,
                 "shell": shell_opt,
                 "skip": "sss",
                 "s3tags": json.dumps(s3_tags, separators=(",", ":")),
+                "limits": json.dumps(get_container_limits(step.spec["compute"]), separators=(",", ":")),
+                "checkpoint": json.dumps(step.spec.get("checkpoint", {}), separators=(",", ":")),
+                "engine": step.spec["compute"].get("transfer_engine", "auto"),
             },
-            "ContainerProperties": {
-                "Image": os.environ["RUNNER_REPO_URI"] + ":" + os.environ["SOURCE_VERSION"],
-                "Command": [
-                    "python", "/bclaw_runner/src/runner_cli.py",
-                    "-c", "Ref::command",
-                    "-f", "Ref::references",
-                    "-i", "Ref::inputs",
-                    "-k", "Ref::skip",
-                    "-m", "Ref::image",
-                    "-o", "Ref::outputs",
-                    "-q", "Ref::qc",
-                    "-r", "Ref::repo",
-                    "-s", "Ref::shell",
-                    "-t", "Ref::s3tags",
-                ],
-                "JobRoleArn": task_role,
-                **get_environment(step),
-                **get_resource_requirements(step),
-                **get_volume_info(step),
-            },
+            **properties,
             **get_consumable_resource_properties(step.spec["compute"]["consumes"]),
             "SchedulingPriority": 1,
             **get_timeout(step),
@@ -284,6 +462,45 @@ def get_output_uris(output_specs: dict) -> dict:
     return ret
 
 
+def get_environment_overrides(step: Step) -> dict:
+    environment = [
+        {
+            "Name": "BC_BRANCH_IDX",
+            "Value.$": "$.index",
+        },
+        {
+            "Name": "BC_EXECUTION_ID",
+            "Value.$": "$$.Execution.Name",
+        },
+        {
+            "Name": "BC_LAUNCH_BUCKET",
+            "Value.$": "$.job_file.bucket",
+        },
+        {
+            "Name": "BC_LAUNCH_KEY",
+            "Value.$": "$.job_file.key",
+        },
+        {
+            "Name": "BC_LAUNCH_VERSION",
+            "Value.$": "$.job_file.version",
+        },
+    ]
+
+    if step.spec["compute"].get("native"):
+        ret = {
+            "EcsPropertiesOverride": {
+                "TaskProperties": [
+                    {
+                        "Containers": [{"Name": name, "Environment": environment} for name in NATIVE_CONTAINERS],
+                    },
+                ],
+            },
+        }
+    else:
+        ret = {"ContainerOverrides": {"Environment": environment}}
+    return ret
+
+
 def batch_step(step: Step,
                job_definition_logical_name: str,
                scattered: bool,
@@ -331,30 +548,7 @@ def batch_step(step: Step,
                 "outputs": json.dumps(step.spec["outputs"], separators=(",", ":")),
                 "skip": skip_behavior,
             },
-            "ContainerOverrides": {
-                "Environment": [
-                    {
-                        "Name": "BC_BRANCH_IDX",
-                        "Value.$": "$.index",
-                    },
-                    {
-                        "Name": "BC_EXECUTION_ID",
-                        "Value.$": "$$.Execution.Name",
-                    },
-                    {
-                        "Name": "BC_LAUNCH_BUCKET",
-                        "Value.$": "$.job_file.bucket",
-                    },
-                    {
-                        "Name": "BC_LAUNCH_KEY",
-                        "Value.$": "$.job_file.key",
-                    },
-                    {
-                        "Name": "BC_LAUNCH_VERSION",
-                        "Value.$": "$.job_file.version",
-                    },
-                ],
-            },
+            **get_environment_overrides(step),
             "Tags": {
                 "bclaw:jobfile.$": "$.job_file.key",
             },
@@ -1,12 +1,62 @@
 import json
 import logging
+import math
 import os
 import re
 from typing import Generator, List
 
+import humanfriendly
+
 from . import state_machine_resources as sm
 from .util import Step, Resource, State, lambda_logging_block, lambda_retry
 
+# most child executions a Distributed Map will run at once
+MAP_CONCURRENCY_LIMIT = 10000
+
+
+def batch_spec(spec: dict) -> dict:
+    ret = {"max_items": spec.get("max_items")}
+    max_size = spec.get("max_size")
+    if isinstance(max_size, str):
+        max_size = humanfriendly.parse_size(max_size, binary=True)
+    ret["max_size"] = max_size
+    return ret
+
+
+def rerun_markers(steps: list) -> List[str]:
+    """
+    Returns the names of the child steps whose completion markers show that a branch has finished, provided
+    every child step is a batch step with skip_on_rerun set. Otherwise returns an empty list, since part of
+    each branch would run again anyway.
+    """
+    ret = []
+    for raw_step in steps:
+        name, spec = next(iter(raw_step.items()))
+        if "commands" not in spec or not spec.get("skip_on_rerun", False):
+            return []
+        ret.append(name)
+    return ret
+
+
+def shard_concurrency(step: Step) -> int:
+    # the number of shards to run at once: just enough to keep each shard's Map within MAP_CONCURRENCY_LIMIT
+    return math.ceil(step.spec.get("max_concurrency", 0) / MAP_CONCURRENCY_LIMIT)
+
+
+def shard_size(step: Step) -> int | None:
+    """
+    Returns the number of branches to put in each shard of a scatter that may need more concurrency than a
+    single Distributed Map can provide, or None if the scatter can never need sharding.
+
+    max_concurrency is split evenly across the shards that run at once, and each shard holds as many branches
+    as its Map can run at once. How many shards there are depends on the number of items, which only the
+    scatter lambda knows: if they all fit in one shard, the outer Map just runs that one.
+    """
+    max_concurrency = step.spec.get("max_concurrency", 0)
+    if max_concurrency > MAP_CONCURRENCY_LIMIT:
+        return max_concurrency // shard_concurrency(step)
+    return None
+
 
 def scatter_step(step: Step, map_step_name: str) -> dict:
     ret = {
@@ -25,6 +75,24 @@ def scatter_step(step: Step, map_step_name: str) -> dict:
         "Next": map_step_name
     }
 
+    if step.spec.get("scatter_mode", "product") != "product":
+        ret["Parameters"]["scatter_mode"] = step.spec["scatter_mode"]
+
+    if step.spec.get("filter") is not None:
+        ret["Parameters"]["filter"] = step.spec["filter"]
+
+    if step.spec.get("batch") is not None:
+        ret["Parameters"]["batch"] = json.dumps(batch_spec(step.spec["batch"]))
+
+    if markers := rerun_markers(step.spec.get("steps", [])):
+        ret["Parameters"]["rerun_markers"] = json.dumps(markers)
+
+    if (size := shard_size(step)) is not None:
+        ret["Parameters"]["shard_size"] = size
+
+    if step.spec.get("skip_on_rerun", False):
+        ret["Parameters"]["redrive"] = True
+
     return ret
 
 
@@ -39,12 +107,19 @@ def error_tolerance(spec) -> dict:
     return ret
 
 
-def map_step(step: Step, sub_branch: dict, gather_step_name: str) -> dict:
+def branch_index(map_depth: int) -> str:
+    # inside another scatter, prefix the enclosing branch's index so that batch job names stay unique
+    if map_depth > 0:
+        return "States.Format('{}-{}', $.index, $$.Map.Item.Value._index)"
+    return "$$.Map.Item.Value._index"
+
+
+def map_step(step: Step, sub_branch: dict, gather_step_name: str, map_depth: int = 0) -> dict:
     label = re.sub(r"\W", "", step.name)
 
     ret = {
         "Type": "Map",
-        "MaxConcurrency": step.spec["max_concurrency"],
+        "MaxConcurrency": min(step.spec["max_concurrency"], MAP_CONCURRENCY_LIMIT),
         **error_tolerance(step.spec["error_tolerance"]),
         "Label": label[:40],
         "ItemReader": {
@@ -59,11 +134,18 @@ def map_step(step: Step, sub_branch: dict, gather_step_name: str) -> dict:
             }
         },
         "ItemSelector": {
-            "index.$": "States.Format('{}', $$.Map.Item.Index)",  # stringify the index
+            # completed branches may have been left out of the items file, so use the original branch number.
+            # _branch is the same number zero-padded, which is only used to name the branch repo
+            "index.$": branch_index(map_depth),
             "job_file.$": "$.job_file",
             "prev_outputs": {},
             "scatter.$": "$$.Map.Item.Value",
-            "repo.$": "$.scatter.repo",
+            # the scatter lambda writes each branch's job data and records the branch name in the items file
+            "repo": {
+                "bucket.$": "$.scatter.repo.bucket",
+                "prefix.$": "States.Format('{}/{}', $.scatter.repo.prefix, $$.Map.Item.Value._branch)",
+                "uri.$": "States.Format('{}/{}', $.scatter.repo.uri, $$.Map.Item.Value._branch)",
+            },
             "share_id.$": "$.share_id"
         },
         "ItemProcessor": {
@@ -73,6 +155,14 @@ def map_step(step: Step, sub_branch: dict, gather_step_name: str) -> dict:
             },
             **sub_branch
         },
+        # child execution results go to the scatter repo, where the gather lambda uses them to find the failed branches
+        "ResultWriter": {
+            "Resource": "arn:aws:states:::s3:putObject",
+            "Parameters": {
+                "Bucket.$": "$.scatter.repo.bucket",
+                "Prefix.$": "States.Format('{}/_results_', $.scatter.repo.prefix)",
+            },
+        },
         "ResultPath": None,
         "Next": gather_step_name,
     }
@@ -80,22 +170,78 @@ def map_step(step: Step, sub_branch: dict, gather_step_name: str) -> dict:
     return ret
 
 
-def scatter_init_step(parent_step_name: str) ->  dict:
-    step_name = f"{parent_step_name}.initialize"
+def shard_map_step(step: Step, sub_branch: dict, gather_step_name: str, map_depth: int = 0) -> dict:
+    """
+    Two-level Map for scatters that need more than MAP_CONCURRENCY_LIMIT concurrent branches: an outer
+    Distributed Map over the shard files listed by the scatter lambda, each child of which runs an inner
+    Distributed Map over the branches in its shard. The inner Map is the same as an unsharded scatter's,
+    except that it runs all of the shard's branches at once.
+
+    error_tolerance is applied to each inner Map, and the outer Map fails if any shard does. A percentage
+    is therefore a percentage of each shard. A count applies to each shard too, which lets the scatter
+    fail as soon as one shard exceeds it; the gather step checks it against the total.
+    """
+    label = re.sub(r"\W", "", step.name)
+
+    inner = map_step(step, sub_branch, gather_step_name, map_depth)
+    del inner["Next"]
+    inner["End"] = True
+    inner["MaxConcurrency"] = shard_size(step)
+
     ret = {
-        step_name: {
-            "Type": "Task",
-            "Resource": os.environ["SCATTER_INIT_LAMBDA_ARN"],
+        "Type": "Map",
+        "MaxConcurrency": shard_concurrency(step),
+        "ToleratedFailureCount": 0,
+        "Label": f"{label[:34]}shards",
+        "ItemReader": {
+            "Resource": "arn:aws:states:::s3:getObject",
+            "ReaderConfig": {
+                "InputType": "CSV",
+                "CSVHeaderLocation": "FIRST_ROW",
+            },
             "Parameters": {
-                "index.$": "$.index",
-                "repo.$": "$.repo",
-                "scatter.$": "$.scatter",
-                **lambda_logging_block(step_name)
+                "Bucket.$": "$.scatter.shards.bucket",
+                "Key.$": "$.scatter.shards.key",
+            }
+        },
+        "ItemSelector": {
+            "index.$": "$.index",
+            "job_file.$": "$.job_file",
+            "scatter": {
+                "items": {
+                    "bucket.$": "$.scatter.shards.bucket",
+                    "key.$": "$$.Map.Item.Value.items",
+                },
+                "repo.$": "$.scatter.repo",
+            },
+            "share_id.$": "$.share_id"
+        },
+        "ItemProcessor": {
+            "ProcessorConfig": {
+                "Mode": "DISTRIBUTED",
+                "ExecutionType": "STANDARD"
+            },
+            "StartAt": f"{step.name}.shard",
+            "States": {
+                f"{step.name}.shard": inner,
             },
-            **lambda_retry(max_attempts=10),
-            "ResultPath": "$.repo",
-            "_stet": True,
         },
+        "ResultPath": None,
+        "Next": gather_step_name,
+    }
+
+    return ret
+
+
+def map_failure_catcher(failures_step_name: str) -> dict:
+    ret = {
+        "Catch": [
+            {
+                "ErrorEquals": ["States.ALL"],
+                "ResultPath": "$.map_error",
+                "Next": failures_step_name,
+            },
+        ],
     }
     return ret
 
@@ -106,6 +252,7 @@ def gather_step(step: Step) -> dict:
         "Resource": os.environ["GATHER_LAMBDA_ARN"],
         "Parameters": {
             "repo.$": "$.repo.uri",
+            "scatter.$": "$.scatter",
             "outputs": json.dumps(step.spec["outputs"]),
             "step_name": step.name,
             **lambda_logging_block(step.name),
@@ -116,6 +263,41 @@ def gather_step(step: Step) -> dict:
         **step.next_or_end,
     }
 
+    # a sharded scatter can't count failed branches across shards, so the gather lambda does
+    if shard_size(step) is not None and isinstance(step.spec["error_tolerance"], int):
+        ret["Parameters"]["tolerated_failures"] = step.spec["error_tolerance"]
+
+    return ret
+
+
+def failures_step(step: Step, fail_step_name: str) -> dict:
+    # records the branches that didn't succeed when the Map state fails, so that they can be redriven
+    ret = {
+        "Type": "Task",
+        "Resource": os.environ["GATHER_LAMBDA_ARN"],
+        "Parameters": {
+            "repo.$": "$.repo.uri",
+            "scatter.$": "$.scatter",
+            "outputs": "{}",
+            "failed": True,
+            "step_name": step.name,
+            **lambda_logging_block(step.name),
+        },
+        **lambda_retry(),
+        "ResultPath": None,
+        "Next": fail_step_name,
+    }
+
+    return ret
+
+
+def fail_step() -> dict:
+    ret = {
+        "Type": "Fail",
+        "ErrorPath": "$.map_error.Error",
+        "CausePath": "$.map_error.Cause",
+    }
+
     return ret
 
 
@@ -126,20 +308,25 @@ def handle_scatter_gather(step: Step,
     logger = logging.getLogger(__name__)
     logger.info(f"making scatter gather steps for {step.name}")
 
-    if map_depth > 0:
-        raise RuntimeError("Nested Scatter steps are not supported")
-
-    sub_branch = yield from sm.make_branch([scatter_init_step(step.name)] + step.spec["steps"],
+    sub_branch = yield from sm.make_branch(step.spec["steps"],
                                            options, depth=map_depth + 1)
 
+    make_map = map_step if shard_size(step) is None else shard_map_step
+
     scatter_step_name = step.name
     map_step_name = f"{step.name}.map"
     gather_step_name = f"{step.name}.gather"
 
+    failures_step_name = f"{step.name}.failures"
+    fail_step_name = f"{step.name}.failed"
+
     ret = [
         State(scatter_step_name, scatter_step(step, map_step_name)),
-        State(map_step_name, map_step(step, sub_branch, gather_step_name)),
-        State(gather_step_name, gather_step(step))
+        State(map_step_name, {**make_map(step, sub_branch, gather_step_name, map_depth),
+                              **map_failure_catcher(failures_step_name)}),
+        State(gather_step_name, gather_step(step)),
+        State(failures_step_name, failures_step(step, fail_step_name)),
+        State(fail_step_name, fail_step()),
     ]
 
     return ret
@@ -1,6 +1,7 @@
 from collections import Counter
 from functools import reduce
 from itertools import chain
+import signal
 from typing import Any, Callable
 
 from voluptuous import *
@@ -9,6 +10,9 @@ from .util import Step
 
 DEFAULT_IMAGE = "public.ecr.aws/ubuntu/ubuntu:latest"
 
+# the names the runner can look up in signal.Signals
+SIGNAL_NAMES = frozenset(n for n in signal.Signals.__members__ if n.startswith("SIG") and not n.startswith("SIG_"))
+
 
 class CompilerError(Exception):
     def __init__(self, invalid_exception: Invalid, where=None):
@@ -54,12 +58,32 @@ def no_shared_keys(*field_names: str) -> Callable:
     return _impl
 
 
+def native_compatible(record: dict) -> dict:
+    # native mode jobs run the user's image as an ECS container, which has no equivalent of these docker options
+    compute = record.get("compute", {})
+    if compute.get("native"):
+        unsupported = [k for k in ("cpuset", "numa_nodes") if compute.get(k) is not None]
+        if compute.get("hard_cpu_limit"):
+            unsupported.insert(0, "hard_cpu_limit")
+        if unsupported:
+            raise Invalid(f"{', '.join(unsupported)} not supported in native mode", path=["compute"])
+    return record
+
+
 def no_substitutions(s: str) -> str:
     if re.search(r"\${.+}", s):
         raise Invalid("string substitutions are not allowed")
     return s
 
 
+def python_expression(s: str) -> str:
+    try:
+        compile(s, "<expression>", "eval")
+    except SyntaxError as se:
+        raise Invalid(f"invalid expression: {se.msg}")
+    return s
+
+
 image_credentials = re.compile(r"^(?!\+)(?P<name>\S+?)(?:\s+\+auth:\s+(?P<auth>[A-Za-z0-9/_+=.@-]+))?$")
 
 def shorthand_image_spec(spec: str) -> dict:
@@ -72,6 +96,15 @@ def shorthand_image_spec(spec: str) -> dict:
 
 
 splitter = re.compile(r"(?<=\s)\+(\w+):\s+")
+upload_modes = ("early", "stream")
+compression_codecs = ("gzip", "zstd")
+
+# shorthand output spec options that are not s3 tags
+output_options = {
+    "archive": ("tar",),
+    "compress": compression_codecs,
+    "upload": upload_modes,
+}
 src_dest = re.compile(r"^(\S+?(?<![>/])) (?:\s+->\s+ (s3://.+/))?$", flags=re.X)
 
 def shorthand_output_spec(spec: str) -> dict:
@@ -88,11 +121,42 @@ def shorthand_output_spec(spec: str) -> dict:
 
     ret["s3_tags"] = {}
     for k, v in itertools.batched(tags, 2):
-        ret["s3_tags"][k.strip()] = v.strip()
+        k, v = k.strip(), v.strip()
+        if k in output_options:
+            if v not in output_options[k]:
+                raise Invalid(f"invalid {k} option: '{v}'")
+            ret[k] = v
+        else:
+            ret["s3_tags"][k] = v
 
     return ret
 
 
+def s3_path_or_url(v: str) -> str:
+    if not isinstance(v, str) or not v.startswith(("s3://", "https://", "http://")):
+        raise Invalid("must be an S3 path starting with 's3://' or an http(s) URL")
+    return v
+
+
+byte_range = re.compile(r"^(?:\d+-\d*|-\d+)$")
+
+def input_file_spec(spec: str) -> str:
+    file, *options = splitter.split(spec)
+    if len(options) > 2:
+        raise Invalid(f"only one of +range, +select, or +access is allowed: '{spec}'")
+    if options:
+        k, v = options[0].strip(), options[1].strip()
+        if k == "range":
+            if not (byte_range.fullmatch(v) or "${" in v):
+                raise Invalid(f"invalid byte range: '{v}'")
+        elif k == "access":
+            if v != "lazy":
+                raise Invalid(f"invalid access option: '{v}'")
+        elif k != "select":
+            raise Invalid(f"invalid input option: '{k}'")
+    return spec
+
+
 def s3_path(v: str) -> str:
     if not isinstance(v, str) or not v.startswith("s3://"):
         raise Invalid("must be an S3 path starting with 's3://'")
@@ -106,6 +170,9 @@ output_spec = Schema({
             Required("name", msg="output file name is required"): str,
             Optional("dest"): s3_path,
             Optional("s3_tags", default={}): {str: str},
+            Optional("archive"): Any("tar", msg="invalid archive format"),
+            Optional("compress"): Any(*compression_codecs, msg="invalid compression codec"),
+            Optional("upload"): Any(*upload_modes, msg="invalid upload option"),
         }
     )
 })
@@ -149,6 +216,9 @@ filesystem_block = {
                                            no_substitutions),
 }
 
+# e.g. 0-3,8,10-11
+cpu_list = re.compile(r"^\d+(?:-\d+)?(?:,\d+(?:-\d+)?)*$")
+
 batch_step_schema = Schema(All(
     {
         Optional("image", default={"name": DEFAULT_IMAGE}): Or(
@@ -162,9 +232,9 @@ batch_step_schema = Schema(All(
         # None is used as a signal that inputs was not specified at all, and should be copied from previous outputs.
         # inputs = {} can be used to explicitly specify a step has no inputs at all, with no copy from previous output.
         ## remove  Optional("inputs", default=None): Any(None, {str: str}),
-        Optional("inputs", default=None): file_list(Any(None, {str: str})),
+        Optional("inputs", default=None): file_list(Any(None, {str: And(str, input_file_spec)})),
         ## remove  Optional("references", default={}): {str: Match(r"^s3://", msg="reference values must be s3 paths")},
-        Optional("references", default={}): file_list({str: s3_path}),
+        Optional("references", default={}): file_list({str: s3_path_or_url}),
         Required("commands", msg="commands list is required"): listified(str, min=1),
         Optional("s3_tags", default={}): {str: Coerce(str)},
         Optional("job_tags", default={}): {str: Coerce(str)},
@@ -181,19 +251,41 @@ batch_step_schema = Schema(All(
         Optional("outputs", default={}): file_list(output_spec),
         Exclusive("skip_if_output_exists", "skip_behavior", msg=skip_msg): bool,
         Exclusive("skip_on_rerun", "skip_behavior", msg=skip_msg): bool,
+        Optional("checkpoint", default={}): {
+            Optional("files", default=[]): listified(str),
+            Optional("signal", default=None): Maybe(In(SIGNAL_NAMES),
+                                                    msg="checkpoint signal must be a signal name, e.g. SIGUSR1"),
+            Optional("wait", default=60): All(int, Range(min=0, max=100,
+                                                         msg="checkpoint wait must be between 0 and 100 seconds")),
+        },
         Optional("compute", default={}): {
             Optional("consumes", default={}): {str: All(int, Range(min=1))},
             Optional("cpus", default=1): All(int, Range(min=1)),
+            Optional("cpuset", default=None): Maybe(All(Coerce(str), Match(cpu_list,
+                                                                           msg="cpuset must be a list of cpu numbers or ranges"))),
             Optional("gpu", default=0): Or(
                 All(int, Range(min=0)),
                 "all",
                 msg="gpu spec must be a nonnegative integer or 'all'"
             ),
+            Optional("hard_cpu_limit", default=False): bool,
             Optional("memory", default="1 Gb"): Any(float, int, str, msg="memory must be a number or string"),
+            Optional("native", default=False): bool,
+            Optional("numa_nodes", default=None): Maybe(All(Coerce(str), Match(cpu_list,
+                                                                               msg="numa_nodes must be a list of node numbers or ranges"))),
             Optional("queue_name", default=None): Maybe(str),
             Optional("shell", default=None): Any(None, "bash", "sh", "sh-pipefail",
                                                  msg="shell option must be bash, sh, or sh-pipefail"),
+            Optional("shm_size", default=None): Any(None, float, int, str, msg="shm_size must be a number or string"),
             Optional("spot", default=True): bool,
+            Optional("transfer_engine", default="auto"): Any("auto", "boto3", "crt", "ranged",
+                                                             msg="transfer_engine must be auto, boto3, crt, or ranged"),
+            Optional("ulimits", default={}): {str: Or(All(int, Range(min=-1)),
+                                                      {
+                                                          Required("soft"): All(int, Range(min=-1)),
+                                                          Required("hard"): All(int, Range(min=-1)),
+                                                      },
+                                                      msg="ulimit values must be an integer or a soft/hard pair")},
         },
         Optional("filesystems", default=[]): listified(filesystem_block),
         Optional("qc_check", default=[]): listified(qc_check_block),
@@ -209,6 +301,7 @@ batch_step_schema = Schema(All(
         **next_or_end,
     },
     no_shared_keys("inputs", "outputs", "references"),
+    native_compatible,
 ))
 
 
@@ -256,6 +349,9 @@ chooser_step_schema = Schema(
 scatter_step_schema = Schema(All(
     {
         Required("scatter"): {str: Any(str, list)},
+        Optional("scatter_mode", default="product"): Any("product", "zip",
+                                                          msg="scatter_mode must be 'product' or 'zip'"),
+        Optional("filter", default=None): Maybe(All(str, python_expression)),
         Optional("inputs", default=None): file_list(Any(None, {str: str})),
             ## remove  Maybe({str: str}),
         Required("steps", "steps list is required"): listified({str: dict}, min=1),
@@ -266,6 +362,14 @@ scatter_step_schema = Schema(All(
         Optional("error_tolerance", default=0): Or(All(int, Range(min=0)),          # integer >= 0
                                                    Match(r"^0*(?:\d{1,2}|100)%$"),  # percentage, 0 - 100%
                                                    msg="invalid error tolerance request"),
+        Optional("skip_on_rerun", default=False): bool,
+        Optional("batch", default=None): Maybe(All(
+            {
+                Optional("max_items"): All(Coerce(int), Range(min=1, msg="max_items must be 1 or greater")),
+                Optional("max_size"): Any(All(int, Range(min=1)), str, msg="max_size must be a number or string"),
+            },
+            Length(min=1, msg="batch needs max_items, max_size, or both")
+        )),
         **next_or_end,
     },
     # It's technically OK if scatter shares keys with these, because it's namespaced as ${scatter.foo}
@@ -1,23 +1,133 @@
 from contextlib import closing
+import csv
+from datetime import datetime
+import io
 from itertools import groupby
 import json
 import logging
 from os.path import basename
+from typing import Generator, Iterable, List, Set
 
 import boto3
 
+from archive_index import list_archive_members, index_key, is_index_key
 from lambda_logs import log_preamble, log_event
-from repo_utils import SYSTEM_FILE_TAG
+from repo_utils import (BRANCH_FIELD, FAILED_BRANCHES_FILE, MAP_RESULTS_DIR, SCATTER_SIGNATURE, SYSTEM_FILE_TAG,
+                        MultipartWriter, S3File)
 from substitutions import substitute_job_data
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
+class TooManyFailures(Exception):
+    pass
+
+
+def branch_order(uri: str) -> tuple:
+    # Sorts files by name, then by branch. Branch names are zero-padded to five digits, but scatters with more
+    # than 100,000 branches have longer ones, so compare numeric path components by length first.
+    # e.g. .../99999/x.txt comes before .../100000/x.txt
+    ret = (basename(uri), [(len(p), p) if p.isdigit() else (0, p) for p in uri.split("/")])
+    return ret
+
+
+def _read_json(s3, bucket: str, key: str):
+    response = s3.get_object(Bucket=bucket, Key=key)
+    with closing(response["Body"]) as fp:
+        ret = json.load(fp)
+    return ret
+
+
+def _read_csv(s3, bucket: str, key: str) -> csv.DictReader:
+    response = s3.get_object(Bucket=bucket, Key=key)
+    ret = csv.DictReader(io.TextIOWrapper(response["Body"], encoding="utf-8", newline=""))
+    return ret
+
+
+def _result_manifests(s3, scatter_repo: dict, since: datetime) -> Generator[dict, None, None]:
+    # the manifests that the Map state's ResultWriter left for Map Runs that finished after since
+    results_prefix = f"{scatter_repo['prefix']}/{MAP_RESULTS_DIR}/"
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=scatter_repo["bucket"], Prefix=results_prefix):
+        for obj in page.get("Contents", []):
+            if obj["Key"].endswith("/manifest.json") and obj["LastModified"] >= since:
+                yield _read_json(s3, scatter_repo["bucket"], obj["Key"])
+
+
+def _branches(s3, manifests: List[dict], statuses: Iterable[str]) -> Set[str]:
+    # the branches of the child executions listed in the manifests' result files with the given statuses
+    ret = set()
+    for manifest in manifests:
+        for status in statuses:
+            for result_file in manifest["ResultFiles"].get(status, []):
+                for execution in _read_json(s3, manifest["DestinationBucket"], result_file["Key"]):
+                    ret.add(json.loads(execution["Input"])["scatter"][BRANCH_FIELD])
+    return ret
+
+
+def record_failures(scatter: dict, map_failed: bool = False) -> int:
+    """
+    Writes the items of the branches that didn't succeed to {scatter repo}/failed.csv, in the same format as
+    the items file so that a redrive can use it as is. failed.csv is tagged with the scatter's signature, so
+    the scatter lambda can tell whether it still applies. Returns the number of branches that didn't succeed.
+
+    If the Map state succeeded, every branch ran, so only the (usually few) failed and pending child executions
+    have to be read, and nothing at all is done if there weren't any -- except removing a failed.csv left by an
+    earlier run. If the Map state failed, some branches may never have started, so the failures are the items
+    that aren't listed as succeeded.
+    """
+    s3 = boto3.client("s3")
+    scatter_repo = scatter["repo"]
+    failed_file = S3File(scatter_repo["bucket"], f"{scatter_repo['prefix']}/{FAILED_BRANCHES_FILE}")
+
+    # scatter = {items: {bucket, key}, repo: {...}, signature: str} or {shards: {bucket, key}, repo: {...}, ...}
+    sharded = "shards" in scatter
+    items = scatter["shards"] if sharded else scatter["items"]
+    items_head = s3.head_object(Bucket=items["bucket"], Key=items["key"])
+    manifests = list(_result_manifests(s3, scatter_repo, items_head["LastModified"]))
+
+    if map_failed:
+        succeeded = _branches(s3, manifests, ["SUCCEEDED"])
+        is_failure = lambda branch: branch not in succeeded
+    else:
+        failures = _branches(s3, manifests, ["FAILED", "PENDING"])
+        if not failures:
+            s3.delete_object(Bucket=failed_file.bucket, Key=failed_file.key)
+            return 0
+        is_failure = lambda branch: branch in failures
+
+    if sharded:
+        item_keys = [row["items"] for row in _read_csv(s3, items["bucket"], items["key"])]
+    else:
+        item_keys = [items["key"]]
+
+    count = 0
+    with MultipartWriter(failed_file, Tagging=SYSTEM_FILE_TAG,
+                         Metadata={SCATTER_SIGNATURE: scatter.get("signature", "")}) as fp:
+        writer = None
+        for key in item_keys:
+            reader = _read_csv(s3, items["bucket"], key)
+            if writer is None:
+                writer = csv.DictWriter(fp, fieldnames=reader.fieldnames, dialect="unix")
+                writer.writeheader()
+            for row in reader:
+                if is_failure(row[BRANCH_FIELD]):
+                    writer.writerow(row)
+                    count += 1
+
+    if count:
+        logger.warning(f"{count} branches did not succeed, see {failed_file}")
+    return count
+
+
 def lambda_handler(event: dict, context: object):
     # event = {
     #   outputs: str
     #   repo: str
+    #   scatter: {items|shards: {bucket, key}, repo: {bucket, prefix, uri}, signature: str} (optional)
+    #   failed: bool (optional)
+    #   tolerated_failures: int (optional)
     #   step_name: str
     #   logging: {
     #     branch: str
@@ -33,6 +143,19 @@ def lambda_handler(event: dict, context: object):
     log_preamble(**event["logging"], logger=logger)
     log_event(logger, event)
 
+    map_failed = event.get("failed", False)
+    if "scatter" in event:
+        failures = record_failures(event["scatter"], map_failed)
+
+        # sharded scatters apply error_tolerance to each shard, so check the total here
+        tolerated = event.get("tolerated_failures")
+        if not map_failed and tolerated is not None and failures > tolerated:
+            raise TooManyFailures(f"{failures} branches failed, more than the {tolerated} tolerated")
+
+    # if the Map state failed, just record the failures
+    if map_failed:
+        return {}
+
     parent_outputs = json.loads(event["outputs"])
     if parent_outputs:
         step_name = event["step_name"]
@@ -50,8 +173,17 @@ def lambda_handler(event: dict, context: object):
         bucket = boto3.resource("s3").Bucket(parent_repo_bucket)
         prefix = f"{parent_repo_prefix}/{step_name}"
         scatter_output_objs = bucket.objects.filter(Prefix=prefix)
-        scatter_output_uris = [f"s3://{o.bucket_name}/{o.key}" for o in scatter_output_objs]
-        scatter_output_uris.sort(key=basename)
+        results_prefix = f"{prefix}/{MAP_RESULTS_DIR}/"
+        scatter_output_uris = []
+        index_uris = set()
+        for o in scatter_output_objs:
+            if o.key.startswith(results_prefix):
+                continue
+            if is_index_key(o.key):
+                index_uris.add(f"s3://{o.bucket_name}/{o.key}")
+            else:
+                scatter_output_uris.append(f"s3://{o.bucket_name}/{o.key}")
+        scatter_output_uris.sort(key=branch_order)
 
         filename2group = {k: list(g) for k, g in groupby(scatter_output_uris, key=basename)}
         manifest = {}
@@ -62,6 +194,12 @@ def lambda_handler(event: dict, context: object):
                 logger.warning(f"no files named {filename} found")
                 manifest[key] = []
 
+            # for archived directory outputs, also list the files inside the archives
+            if archives := [uri for uri in manifest[key] if index_key(uri) in index_uris]:
+                manifest[f"{key}#members"] = [f"{uri}#{member}"
+                                              for uri in archives
+                                              for member in list_archive_members(S3File(*uri.split("/", 3)[2:]))]
+
         manifest_filename = f"{step_name}_manifest.json"
         manifest_path = f"{parent_repo}/{manifest_filename}"
         manifest_bucket, manifest_key = manifest_path.split("/", 3)[2:]
@@ -1,23 +1,38 @@
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 from contextlib import closing
 import csv
+from datetime import datetime, timedelta, timezone
 import fnmatch
+import hashlib
+import io
 import itertools
 import json
 import logging
+import math
+import os
 import re
-from typing import Any, Dict, Generator, Tuple
+from typing import Any, Dict, Generator, Iterable, Iterator, List, Tuple
 
 import boto3
+from botocore.exceptions import ClientError
+from box import Box
 import jmespath
 
+from archive_index import expand_archive_glob, is_index_key
 from file_select import select_file_contents
 from lambda_logs import log_preamble, log_event
-from repo_utils import SYSTEM_FILE_TAG, Repo, S3File
+from repo_utils import (BRANCH_FIELD, FAILED_BRANCHES_FILE, INDEX_FIELD, SCATTER_SIGNATURE, SYSTEM_FILE_TAG,
+                        MultipartWriter, Repo, S3File)
+from s3_listing import expand_inventory, parallel_glob
 from substitutions import substitute_job_data
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+WRITE_WORKERS = 32
+MAX_PENDING_WRITES = WRITE_WORKERS * 4
+
 
 def get_job_data(repo: Repo) -> dict:
     job_data = repo.qualify("_JOB_DATA_")
@@ -34,15 +49,14 @@ def expand_glob(globby_file: S3File) -> Generator[S3File, None, None]:
     # this will be used to limit the number of s3 objects to search
     prefix = re.search(r'(^.*?)[\[\]*?]+', globby_file.key).group(1)
 
-    bucket = boto3.resource("s3").Bucket(globby_file.bucket)
-    object_summaries = bucket.objects.filter(Prefix=prefix)
-    object_keys = [o.key for o in object_summaries]
-
-    target_keys = fnmatch.filter(object_keys, globby_file.key)
+    matcher = re.compile(fnmatch.translate(globby_file.key))
 
-    for key in target_keys:
-        yld = S3File(globby_file.bucket, key)
-        yield yld
+    # the listing is paged, so only one page of keys is held in memory at a time
+    bucket = boto3.resource("s3").Bucket(globby_file.bucket)
+    for object_summary in bucket.objects.filter(Prefix=prefix):
+        if matcher.match(object_summary.key) and not is_index_key(object_summary.key):
+            yld = S3File(globby_file.bucket, object_summary.key, object_summary.size, object_summary.last_modified)
+            yield yld
 
 
 def expand_scatter_data(scatter_spec: dict, repo: Repo, job_data: dict) -> Generator[Tuple, None, None]:
@@ -53,16 +67,15 @@ def expand_scatter_data(scatter_spec: dict, repo: Repo, job_data: dict) -> Gener
 def _expand_scatter_data_impl(key: str, vals: Any, repo: Repo, job_data: dict) -> Generator[Tuple, None, None]:
     logger.info(f"expanding: {vals=}")
 
-    # case 1: static list
-    if isinstance(vals, list):
+    # case 1: static list, or an iterator from one of the cases below
+    if isinstance(vals, (list, Iterator)):
         yield key, vals
 
     elif isinstance(vals, str):
         # case 2: reference to something in an extended job data file field
 
-        # it is not likely that anything will be found in the parent or scatter fields of the job data
-        # object, since they will be populated only inside of a scatter step and nested scatters are
-        # not allowed (yet). This may change in future versions.
+        # the parent and scatter fields of the job data object are only populated inside of a scatter
+        # step, so they can only be referenced by a nested scatter.
         if (is_job_data_ref := re.search(r"\${((?:job|parent|scatter)\..+?)}", vals)) is not None:
             field_name = is_job_data_ref.group(1)  # e.g. "job.list_of_stuff"
 
@@ -91,11 +104,25 @@ def _expand_scatter_data_impl(key: str, vals: Any, repo: Repo, job_data: dict) -
             path = repo.qualify(vals[1:])
             result = select_file_contents(str(path))
 
-        # case 4: file glob
+        # case 4: objects listed in an S3 Inventory report, e.g. inventory:s3://bucket/.../manifest.json:*.bam
+        elif (is_inventory := re.fullmatch(r"inventory:((?:s3://)?[^:]+)(?::(.+))?", vals)) is not None:
+            manifest, key_glob = is_inventory.groups()
+            result = expand_inventory(repo.qualify(manifest), key_glob)
+
+        # case 5: file glob, listed in parallel
+        elif vals.startswith("parallel:"):
+            result = parallel_glob(repo.qualify(vals[len("parallel:"):]))
+
+        # case 6: members of an archived directory output, e.g. per_gene_dir#*.json
+        elif "#" in vals:
+            archive, member_glob = vals.split("#", 1)
+            result = expand_archive_glob(repo.qualify(archive), member_glob)
+
+        # case 7: file glob
         elif re.search(r'[\[\]*?]', vals):
-            result = list(expand_glob(repo.qualify(vals)))
+            result = expand_glob(repo.qualify(vals))
 
-        # case 5: single filename
+        # case 8: single filename
         else:
             result = [repo.qualify(vals)]
 
@@ -105,29 +132,378 @@ def _expand_scatter_data_impl(key: str, vals: Any, repo: Repo, job_data: dict) -
         pass
 
 
-def scatterator(scatter_data: Dict[Any, list]) -> Generator[dict, None, None]:
-    keys = scatter_data.keys()
-    vals = scatter_data.values()
-    for p in itertools.product(*vals):
+def _zipperator(scatter_data: Dict[Any, Iterable]) -> Generator[dict, None, None]:
+    # every field is streamed
+    keys = list(scatter_data.keys())
+    missing = object()
+    for n, p in enumerate(itertools.zip_longest(*scatter_data.values(), fillvalue=missing)):
+        if missing in p:
+            short = [k for k, v in zip(keys, p) if v is missing]
+            raise RuntimeError(f"zip scatter: {', '.join(short)} ran out of values after {n}")
         combo = dict(zip(keys, p))
         yield combo
 
 
-def write_job_data_template(parent_job_data: dict,
-                            repoized_inputs: dict,
-                            jobby_outputs: dict,
-                            scatter_repo: Repo) -> S3File:
-    job_data_template = {
+def scatterator(scatter_data: Dict[Any, Iterable], mode: str = "product") -> Generator[dict, None, None]:
+    """
+    Yields a dict for each combination of scatter values. In product mode, that's every combination
+    (the cartesian product). In zip mode, values are paired up by position, and all of the scatter
+    fields must have the same number of values.
+    """
+    if mode == "zip":
+        yield from _zipperator(scatter_data)
+        return
+
+    # The first scatter field is streamed; the others have to be read into memory because the cartesian
+    # product goes through them once for each value of the first. It's the same order itertools.product
+    # produces.
+    keys = list(scatter_data.keys())
+    if not keys:
+        yield {}
+        return
+
+    head, *tail = scatter_data.values()
+    tail = [list(t) for t in tail]
+    for h in head:
+        for t in itertools.product(*tail):
+            combo = dict(zip(keys, (h, *t)))
+            yield combo
+
+
+class FilterFile(str):
+    """
+    An S3 file scatter value as a filter expression sees it: the file's S3 URI, with its metadata as attributes.
+    Metadata that didn't come with the listing is fetched the first time it's used.
+    """
+    def __new__(cls, s3_file: S3File, s3):
+        return str.__new__(cls, s3_file)
+
+    def __init__(self, s3_file: S3File, s3):
+        self.s3 = s3
+        self.bucket = s3_file.bucket
+        self.key = s3_file.key
+        self.name = os.path.basename(s3_file.key)
+        self._size = s3_file.size
+        self._last_modified = s3_file.last_modified
+        self._head = None
+        self._tags = None
+
+    def head(self) -> dict:
+        if self._head is None:
+            self._head = self.s3.head_object(Bucket=self.bucket, Key=self.key)
+        return self._head
+
+    @property
+    def size(self) -> int:
+        return self._size if self._size is not None else self.head()["ContentLength"]
+
+    @property
+    def last_modified(self) -> datetime:
+        return self._last_modified if self._last_modified is not None else self.head()["LastModified"]
+
+    @property
+    def metadata(self) -> dict:
+        return self.head()["Metadata"]
+
+    @property
+    def tags(self) -> dict:
+        if self._tags is None:
+            response = self.s3.get_object_tagging(Bucket=self.bucket, Key=self.key)
+            self._tags = {t["Key"]: t["Value"] for t in response["TagSet"]}
+        return self._tags
+
+
+def filterator(items: Iterable[dict], expression: str, job_data: dict) -> Generator[dict, None, None]:
+    """
+    Yields the scatter items for which a Python expression is true. The expression sees each scatter field by
+    name, with S3 files as FilterFiles, plus the job data (job), the current time (now), and the datetime,
+    timedelta, timezone, math and re modules. Items are evaluated in parallel, since looking up metadata takes
+    an S3 request per item, but come out in their original order.
+    """
+    code = compile(expression, "<filter>", "eval")
+    s3 = boto3.client("s3")
+    env = {
+        "job": Box(job_data["job"]),
+        "now": datetime.now(timezone.utc),
+        "datetime": datetime,
+        "timedelta": timedelta,
+        "timezone": timezone,
+        "math": math,
+        "re": re,
+    }
+
+    def _keep(item: dict) -> bool:
+        names = {k: FilterFile(v, s3) if isinstance(v, S3File) else v for k, v in item.items()}
+        return bool(eval(code, env, names))
+
+    def _evaluated() -> Generator[Tuple[dict, Future], None, None]:
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+            for item in items:
+                pending.append((item, executor.submit(_keep, item)))
+                if len(pending) >= MAX_PENDING_WRITES:
+                    yield pending.popleft()
+            yield from pending
+
+    dropped = 0
+    for item, keep in _evaluated():
+        if keep.result():
+            yield item
+        else:
+            dropped += 1
+
+    logger.info(f"filter dropped {dropped} scatter items")
+
+
+def _item_size(item: dict) -> int:
+    # only S3 objects found by a listing have a size; everything else counts as zero bytes
+    ret = sum(getattr(v, "size", None) or 0 for v in item.values())
+    return ret
+
+
+def batcherator(items: Iterable[dict], max_items: int = None, max_size: int = None) -> Generator[dict, None, None]:
+    """
+    Groups consecutive scatter items into batches of no more than max_items items and max_size total bytes,
+    yielding each batch as a dict of lists. An item bigger than max_size gets a batch of its own. Items are
+    packed in order, as they arrive, so a huge scatter never has to be held in memory.
+    """
+    batch = []
+    batch_size = 0
+    for item in items:
+        item_size = _item_size(item)
+        if batch and ((max_items is not None and len(batch) >= max_items) or
+                      (max_size is not None and batch_size + item_size > max_size)):
+            yield {k: [b[k] for b in batch] for k in batch[0]}
+            batch = []
+            batch_size = 0
+        batch.append(item)
+        batch_size += item_size
+
+    if batch:
+        yield {k: [b[k] for b in batch] for k in batch[0]}
+
+
+def make_job_data_template(parent_job_data: dict, repoized_inputs: dict, jobby_outputs: dict) -> dict:
+    ret = {
         "job": parent_job_data["job"],
-        "scatter": {},
+        "scatter": parent_job_data.get("scatter", {}),
         "parent": {**parent_job_data["parent"], **repoized_inputs, **jobby_outputs},
     }
-    template_file = scatter_repo.qualify("_JOB_DATA_")
-    template_obj = boto3.resource("s3").Object(template_file.bucket, template_file.key)
-    template_obj.put(Body=json.dumps(job_data_template).encode("utf-8"),
+    return ret
+
+
+def write_job_data(job_data: dict, repo: Repo) -> S3File:
+    job_data_file = repo.qualify("_JOB_DATA_")
+    job_data_obj = boto3.resource("s3").Object(job_data_file.bucket, job_data_file.key)
+    job_data_obj.put(Body=json.dumps(job_data).encode("utf-8"),
                      ServerSideEncryption="AES256",
                      Tagging=SYSTEM_FILE_TAG)
-    return template_file
+    return job_data_file
+
+
+def write_job_data_template(parent_job_data: dict,
+                            repoized_inputs: dict,
+                            jobby_outputs: dict,
+                            scatter_repo: Repo) -> S3File:
+    job_data_template = make_job_data_template(parent_job_data, repoized_inputs, jobby_outputs)
+    return write_job_data(job_data_template, scatter_repo)
+
+
+def completed_branches(scatter_repo: Repo, markers: List[str]) -> Dict[str, str]:
+    """
+    Finds the branches left over from a previous run that have a completion marker for every one of
+    the given steps, in a single listing of the scatter repo. Returns {branch name: ETag of the branch's
+    _JOB_DATA_ file}, so that callers can check that the branch ran with the same job data.
+    """
+    finder = re.compile(rf"{re.escape(scatter_repo.prefix)}/(\d+)/(?:_JOB_DATA_|_control_/(.+)\.complete)")
+    job_data_etags = {}
+    found_markers = defaultdict(set)
+
+    paginator = boto3.client("s3").get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=scatter_repo.bucket, Prefix=f"{scatter_repo.prefix}/"):
+        for obj in page.get("Contents", []):
+            if (m := finder.fullmatch(obj["Key"])) is not None:
+                branch, marker = m.groups()
+                if marker is None:
+                    job_data_etags[branch] = obj["ETag"]
+                else:
+                    found_markers[branch].add(marker)
+
+    required = set(markers)
+    ret = {b: e for b, e in job_data_etags.items() if found_markers[b] >= required}
+    return ret
+
+
+def _branch_rows(job_data_template: dict,
+                 items: Iterable[dict],
+                 scatter_repo: Repo,
+                 completed: Dict[str, str]) -> Generator[dict, None, None]:
+    # writes each branch's job data file in parallel, with a bounded number of writes in flight, and yields
+    # the branch's row for the items file
+    skipped = 0
+
+    # clients are thread safe, resources aren't
+    s3 = boto3.client("s3")
+
+    def _write(body: bytes, branch_repo: Repo) -> None:
+        job_data_file = branch_repo.qualify("_JOB_DATA_")
+        s3.put_object(Bucket=job_data_file.bucket, Key=job_data_file.key,
+                      Body=body,
+                      ServerSideEncryption="AES256",
+                      Tagging=SYSTEM_FILE_TAG)
+
+    with ThreadPoolExecutor(max_workers=WRITE_WORKERS) as executor:
+        pending = set()
+        for i, combo in enumerate(items):
+            # five digits keeps the names of existing scatters unchanged; bigger scatters just get longer names
+            branch = f"{i:05}"
+
+            # inside a nested scatter, the enclosing branch's scatter values are still available
+            body = json.dumps({**job_data_template,
+                               "scatter": {**job_data_template["scatter"], **combo}}).encode("utf-8")
+
+            # the ETag of an object uploaded in one piece with SSE-S3 is the MD5 of its contents
+            if completed.get(branch) == f'"{hashlib.md5(body).hexdigest()}"':
+                skipped += 1
+                continue
+
+            yield {**{k: json.dumps(v) if isinstance(v, list) else v for k, v in combo.items()},
+                   BRANCH_FIELD: branch,
+                   INDEX_FIELD: str(i)}
+            pending.add(executor.submit(_write, body, scatter_repo.sub_repo(branch)))
+
+            if len(pending) >= MAX_PENDING_WRITES:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+
+        for future in pending:
+            future.result()
+
+    if skipped:
+        logger.info(f"skipping {skipped} branches completed by a previous run")
+
+
+def _write_csv(s3_file: S3File, fieldnames: List[str], rows: Iterable[dict]) -> None:
+    with MultipartWriter(s3_file, Tagging=SYSTEM_FILE_TAG) as fp:
+        writer = csv.DictWriter(fp, fieldnames=fieldnames, dialect="unix")
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def _write_item_files(scatter_repo: Repo,
+                      fieldnames: List[str],
+                      rows: Iterable[dict],
+                      shard_size: int = None) -> S3File:
+    if shard_size is None:
+        items_file = scatter_repo.qualify("items.csv")
+        _write_csv(items_file, fieldnames, rows)
+        return items_file
+
+    shard_files = []
+    for n in itertools.count():
+        shard = list(itertools.islice(rows, shard_size))
+        if not shard:
+            break
+        shard_file = scatter_repo.qualify(f"items/{n:05}.csv")
+        _write_csv(shard_file, fieldnames, shard)
+        shard_files.append({"items": shard_file.key})
+
+    shards_file = scatter_repo.qualify("shards.csv")
+    _write_csv(shards_file, ["items"], shard_files)
+    logger.info(f"wrote {len(shard_files)} shards of up to {shard_size} branches")
+    return shards_file
+
+
+def write_items(job_data_template: dict,
+                fieldnames: List[str],
+                items: Iterable[dict],
+                scatter_repo: Repo,
+                completed: Dict[str, str] = None,
+                shard_size: int = None) -> S3File:
+    """
+    Streams the scatter items to {scatter_repo}/items.csv, and writes each branch's job data file to
+    {scatter_repo}/{branch}/_JOB_DATA_. The branch name is written to the items file in the BRANCH_FIELD
+    column so the Map state can find the branch repo without another Lambda call, and the unpadded branch
+    number in the INDEX_FIELD column, which becomes the branch's BC_BRANCH_IDX. The job data files
+    are written in parallel, with a bounded number of writes in flight.
+
+    List values (from batcherator) are written to the items file as JSON.
+
+    Branches found in completed (see completed_branches) whose job data hasn't changed are left out of
+    the items file, so they don't run again. The remaining branches keep their original names.
+
+    If shard_size is given, the items are split into files of shard_size rows, {scatter_repo}/items/00000.csv
+    and so on, and the returned file, {scatter_repo}/shards.csv, lists them in its items column. Branch
+    names run on across shards, so the branch repos are laid out the same either way.
+    """
+    rows = _branch_rows(job_data_template, items, scatter_repo, completed or {})
+    ret = _write_item_files(scatter_repo, [*fieldnames, BRANCH_FIELD, INDEX_FIELD], rows, shard_size)
+    return ret
+
+
+def scatter_hasher(job_data_template: dict, event: dict):
+    # starts the signature of a scatter with everything that decides which branches it makes and what they get,
+    # except the source data, which signed() adds as it goes by
+    spec = [job_data_template, *(event.get(k) for k in ("scatter", "scatter_mode", "filter", "batch"))]
+    ret = hashlib.md5(json.dumps(spec, sort_keys=True).encode("utf-8"))
+    return ret
+
+
+def signed(items: Iterable[dict], hasher) -> Generator[dict, None, None]:
+    """
+    Passes the scatter items through, folding each one into hasher. Once the items are used up, the
+    hasher's digest identifies both the scatter definition and the data it was expanded from: new files
+    matching a glob or changed @file contents change it.
+    """
+    for item in items:
+        hasher.update(json.dumps(item, sort_keys=True).encode("utf-8"))
+        hasher.update(b"\n")
+        yield item
+
+
+def redrive_items(scatter_repo: Repo,
+                  items: Iterable[dict],
+                  hasher,
+                  shard_size: int = None) -> S3File | None:
+    """
+    Writes the items of the branches that didn't succeed in the last run of this scatter, as recorded in
+    {scatter_repo}/failed.csv by the gather lambda, to a new items file, so that exactly those branches run
+    again in their original branch repos. Their job data files are left as they are.
+
+    items are the signed() items of the scatter as it stands now. They are only read to finish the signature,
+    nothing is written for them. Returns None, and leaves the items file alone, if no failures were recorded or
+    if they were recorded for a different signature (the job data, the scatter definition or its source data
+    have changed since).
+    """
+    s3 = boto3.client("s3")
+    failed_file = scatter_repo.qualify(FAILED_BRANCHES_FILE)
+    try:
+        head = s3.head_object(Bucket=failed_file.bucket, Key=failed_file.key)
+    except ClientError as ce:
+        if ce.response["Error"]["Code"] != "404":
+            raise
+        logger.info("no failed branches recorded, scattering from scratch")
+        return None
+
+    for _ in items:
+        pass
+    if head["Metadata"].get(SCATTER_SIGNATURE) != hasher.hexdigest():
+        logger.info("job data, scatter definition or scatter data changed since the last run, scattering from scratch")
+        return None
+
+    response = s3.get_object(Bucket=failed_file.bucket, Key=failed_file.key)
+    with closing(response["Body"]) as body:
+        reader = csv.DictReader(io.TextIOWrapper(body, encoding="utf-8", newline=""))
+        fieldnames = reader.fieldnames or [BRANCH_FIELD]
+        # failures recorded by older versions have no index column
+        if INDEX_FIELD not in fieldnames:
+            fieldnames = [*fieldnames, INDEX_FIELD]
+        rows = ({**row, INDEX_FIELD: str(int(row[BRANCH_FIELD]))} for row in reader)
+        logger.info(f"redriving branches recorded in {failed_file}")
+        ret = _write_item_files(scatter_repo, fieldnames, rows, shard_size)
+
+    return ret
 
 
 def lambda_handler(event: dict, context: object):
@@ -139,6 +515,12 @@ def lambda_handler(event: dict, context: object):
     #   inputs: str
     #   outputs: str
     #   scatter: str
+    #   scatter_mode: str (optional)
+    #   filter: str (optional)
+    #   batch: str (optional)
+    #   rerun_markers: str (optional)
+    #   shard_size: int (optional)
+    #   redrive: bool (optional)
     #   step_name: str
     #   logging: {
     #     branch: str
@@ -160,6 +542,11 @@ def lambda_handler(event: dict, context: object):
     parent_inputs = json.loads(event["inputs"])
     parent_outputs = json.loads(event["outputs"])
     scatter_data = json.loads(event["scatter"])
+    mode = event.get("scatter_mode", "product")
+    batch = json.loads(event.get("batch", "null"))
+    markers = json.loads(event.get("rerun_markers", "[]"))
+    shard_size = event.get("shard_size")
+    redrive = event.get("redrive", False)
     step_name = event["step_name"]
 
     scatter_repo = parent_repo.sub_repo(step_name)
@@ -167,24 +554,38 @@ def lambda_handler(event: dict, context: object):
     jobby_inputs = substitute_job_data(parent_inputs, parent_job_data)
     jobby_outputs = substitute_job_data(parent_outputs, parent_job_data)
     repoized_inputs = {k: parent_repo.qualify(v) for k, v in jobby_inputs.items()}
-    _ = write_job_data_template(parent_job_data, repoized_inputs, jobby_outputs, scatter_repo)
-
-    expanded_scatter_data = dict(expand_scatter_data(scatter_data, parent_repo, parent_job_data))
-
-    with open("/tmp/items.csv", "w") as fp:
-        writer = csv.DictWriter(fp, fieldnames=expanded_scatter_data.keys(), dialect="unix")
-        writer.writeheader()
-        writer.writerows(scatterator(expanded_scatter_data))
-
-    items_file = scatter_repo.qualify("items.csv")
-    items_obj = boto3.resource("s3").Object(items_file.bucket, items_file.key)
-    items_obj.upload_file("/tmp/items.csv", ExtraArgs={"Tagging": SYSTEM_FILE_TAG})
-
+    job_data_template = make_job_data_template(parent_job_data, repoized_inputs, jobby_outputs)
+    _ = write_job_data(job_data_template, scatter_repo)
+
+    def _scatter_items() -> Tuple[List[str], Iterable[dict]]:
+        expanded_scatter_data = dict(expand_scatter_data(scatter_data, parent_repo, parent_job_data))
+        items = scatterator(expanded_scatter_data, mode)
+        if "filter" in event:
+            items = filterator(items, event["filter"], parent_job_data)
+        if batch is not None:
+            items = batcherator(items, **batch)
+        return list(expanded_scatter_data.keys()), items
+
+    items_file = None
+    if redrive:
+        hasher = scatter_hasher(job_data_template, event)
+        _, items = _scatter_items()
+        items_file = redrive_items(scatter_repo, signed(items, hasher), hasher, shard_size)
+
+    if items_file is None:
+        hasher = scatter_hasher(job_data_template, event)
+        fieldnames, items = _scatter_items()
+        completed = completed_branches(scatter_repo, markers) if markers else None
+        items_file = write_items(job_data_template, fieldnames, signed(items, hasher), scatter_repo,
+                                 completed, shard_size)
+
+    result_field = "items" if shard_size is None else "shards"
     ret = {
-        "items": {
+        result_field: {
             "bucket": items_file.bucket,
             "key": items_file.key
         },
         "repo": dict(scatter_repo),
+        "signature": hasher.hexdigest(),
     }
     return ret
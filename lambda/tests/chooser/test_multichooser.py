@@ -1,3 +1,4 @@
+import gzip
 import json
 import logging
 
@@ -88,12 +89,19 @@ def mock_repo():
             Key=f"{repo_name}/file5.json"
         )
 
+        bucket.put_object(
+            Body=gzip.compress(json.dumps(data1).encode("utf-8")),
+            Key=f"{repo_name}/compressed.json",
+            Metadata={"bclaw_codec": "gzip"}
+        )
+
         yield f"s3://{bucket_name}/{repo_name}"
 
 
 @pytest.mark.parametrize("input_file", [
     "file1.json",
     "s3://repo-bucket/repo/file1.json",
+    "compressed.json",
 ])
 def test_load_s3_object(input_file, mock_repo):
     result = load_s3_object(mock_repo, input_file)
@@ -0,0 +1,45 @@
+import json
+
+import boto3
+import moto
+import pytest
+
+from ...src.common.python.archive_index import list_archive_members, expand_archive_glob
+from ...src.common.python.repo_utils import S3File
+
+TEST_BUCKET = "test-bucket"
+INDEX = {
+    "format": "tar",
+    "codec": None,
+    "members": [
+        {"name": "a.json", "offset": 512, "size": 10},
+        {"name": "b.json", "offset": 1536, "size": 10},
+        {"name": "sub/c.txt", "offset": 2560, "size": 10},
+    ],
+}
+
+
+@pytest.fixture(scope="module")
+def archive_obj():
+    with moto.mock_aws():
+        bucket = boto3.resource("s3", region_name="us-east-1").Bucket(TEST_BUCKET)
+        bucket.create()
+        bucket.put_object(Key="repo/path/outdir", Body=b"archive")
+        bucket.put_object(Key="repo/path/_archive_index_/outdir.json", Body=json.dumps(INDEX).encode("utf-8"))
+        yield S3File(TEST_BUCKET, "repo/path/outdir")
+
+
+def test_list_archive_members(archive_obj):
+    result = list_archive_members(archive_obj)
+    assert result == ["a.json", "b.json", "sub/c.txt"]
+
+
+@pytest.mark.parametrize("member_glob, expect", [
+    ("*.json", ["a.json", "b.json"]),
+    ("sub/*", ["sub/c.txt"]),
+    ("*", ["a.json", "b.json", "sub/c.txt"]),
+    ("nothing*", []),
+])
+def test_expand_archive_glob(archive_obj, member_glob, expect):
+    result = expand_archive_glob(archive_obj, member_glob)
+    assert result == [f"s3://{TEST_BUCKET}/repo/path/outdir#{m}" for m in expect]
@@ -0,0 +1,46 @@
+import gzip
+import io
+
+import pytest
+
+from ...src.common.python.codec import object_body, DecompressedBody, zstd
+
+needs_zstd = pytest.mark.skipif(zstd is None, reason="zstd needs Python 3.14")
+
+data = b"line 1\nline 2\r\n\nline 4\n"
+
+
+def test_object_body_uncompressed():
+    body = io.BytesIO(data)
+    result = object_body({"Body": body, "Metadata": {}})
+    assert result is body
+
+
+@pytest.mark.parametrize("codec", [
+    "gzip",
+    pytest.param("zstd", marks=needs_zstd),
+])
+def test_object_body_compressed(codec):
+    if codec == "gzip":
+        compressed = gzip.compress(data)
+    else:
+        compressed = zstd.compress(data)
+    body = io.BytesIO(compressed)
+
+    result = object_body({"Body": body, "Metadata": {"bclaw_codec": codec}})
+    assert isinstance(result, DecompressedBody)
+    assert result.read() == data
+
+    result.close()
+    assert body.closed
+
+
+def test_decompressed_body_iter_lines():
+    body = DecompressedBody(io.BytesIO(gzip.compress(data)), "gzip")
+    result = list(body.iter_lines())
+    assert result == [b"line 1", b"line 2", b"", b"line 4"]
+
+
+def test_decompressed_body_unsupported():
+    with pytest.raises(ValueError, match="unsupported codec"):
+        DecompressedBody(io.BytesIO(data), "lzma")
@@ -1,3 +1,6 @@
+import gzip
+import io
+import itertools
 import json as j
 import os
 
@@ -5,7 +8,8 @@ import boto3
 import moto
 import pytest
 
-from ...src.common.python.file_select import select_file_contents, read_json, read_yaml
+from ...src.common.python.file_select import select_file_contents, read_json, read_yaml, compile_selector, \
+    read_json_elements
 
 csv = b"""\
 id,one,two,three,four
@@ -68,6 +72,20 @@ data:
 """
 
 
+nested_json = b"""\
+{
+    "run": {"id": "run1", "date": "2026-10-19"},
+    "samples": [
+        {"name": "s1", "reads": {"r1": "s1_1.fq", "r2": "s1_2.fq"}, "qc": [1, 2]},
+        {"name": "s2", "reads": {"r1": "s2_1.fq", "r2": "s2_2.fq"}, "qc": [3.5]},
+        {"reads": {"r1": "s3_1.fq"}},
+        {"name": "s4", "reads": {"r1": "s4_1.fq", "r2": "s4_2.fq"}, "qc": []}
+    ],
+    "lanes": {"L1": 100, "L2": 200}
+}
+"""
+
+
 @pytest.fixture(scope="module")
 def src_bucket():
     with moto.mock_aws():
@@ -79,6 +97,9 @@ def src_bucket():
         yld.put_object(Key="test-data/file.tsv", Body=tsv)
         yld.put_object(Key="test-data/file.txt", Body=txt)
         yld.put_object(Key="test-data/file.yaml", Body=yaml)
+        yld.put_object(Key="test-data/nested.json", Body=nested_json)
+        yld.put_object(Key="test-data/compressed.csv", Body=gzip.compress(csv), Metadata={"bclaw_codec": "gzip"})
+        yld.put_object(Key="test-data/compressed.json", Body=gzip.compress(json), Metadata={"bclaw_codec": "gzip"})
         yield yld
 
 
@@ -91,13 +112,89 @@ def src_bucket():
     ("s3://test-bucket/test-data/file.csv:$[*].two", ["12", "22", "32", "42"]),         # select column "two"
     ("s3://test-bucket/test-data/file.txt:$[2:4]", ["row3", "row4"]),                   # select lines 2 and 3 (zero-based)
     ("s3://test-bucket/test-data/file.txt", ["row1", "row2", "row3", "row4", "row5"]),  # select all lines
+    ("s3://test-bucket/test-data/file.csv:$[1:3].id", ["b", "c"]),                      # slice of rows
+    ("s3://test-bucket/test-data/file.tsv:$[*].four", ["14", "24", "34", "44"]),        # tab delimited
+    ("s3://test-bucket/test-data/file.jsonl:$[2:]", ['{"a": 31, "b": 32, "c": 33, "d": 34}',
+                                                     '{"a": 41, "b": 42, "c": 43, "d": 44}']),
+    ("s3://test-bucket/test-data/file.json:$[?(@.a > 20)].b", ["22", "32", "42"]),      # not streamed
+    ("s3://test-bucket/test-data/nested.json:$.samples[*].name", ["s1", "s2", "s4"]),
+    ("s3://test-bucket/test-data/nested.json:$.samples[*].reads.r2", ["s1_2.fq", "s2_2.fq", "s4_2.fq"]),
+    ("s3://test-bucket/test-data/nested.json:$.samples[:2].qc", ["[1, 2]", "[3.5]"]),
+    ("s3://test-bucket/test-data/nested.json:$.samples[*].qc[0]", ["1", "3.5"]),
+    ("s3://test-bucket/test-data/nested.json:$.lanes[*]", ["100", "200"]),              # object values
+    ("s3://test-bucket/test-data/nested.json:$..r1", ["s1_1.fq", "s2_1.fq", "s3_1.fq", "s4_1.fq"]),
+    ("s3://test-bucket/test-data/compressed.csv:$[*].two", ["12", "22", "32", "42"]),   # bclaw_runner compressed
+    ("s3://test-bucket/test-data/compressed.json:$[*].d", ["14", "24", "34", "44"]),
 ])
 def test_select_file_contents(src_bucket, query, expect):
-    result = select_file_contents(query)
+    result = list(select_file_contents(query))
     print(str(result))
     assert result == expect
 
 
+@pytest.mark.parametrize("query", [
+    "s3://test-bucket/test-data/nested.json:$.nothing[*]",
+    "s3://test-bucket/test-data/nested.json:$.samples[*].nothing",
+    "s3://test-bucket/test-data/file.csv:$[10:20]",
+    "s3://test-bucket/test-data/file.yaml:$.nothing",
+])
+def test_select_file_contents_no_match(src_bucket, query):
+    with pytest.raises(AssertionError, match="selector did not create a list"):
+        list(select_file_contents(query))
+
+
+class Chunked(object):
+    # a file that's read in chunks and counts the reads
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.reads = 0
+
+    def read(self, size=-1) -> bytes:
+        if size == 0:
+            return b""
+        self.reads += 1
+        return next(self.chunks, b"")
+
+
+def test_read_json_elements_streams():
+    chunks = itertools.chain([b'{"x": {"items": [{"a": 1}, [2, 3], "four", 5.5, {"b": {"c": null}}'],
+                             (b', {"a": 1}' * 1000 for _ in range(1000)),
+                             [b"]}}"])
+    body = Chunked(chunks)
+    result = list(itertools.islice(read_json_elements(body, ["x", "items"]), 5))
+    assert result == [{"a": 1}, [2, 3], "four", 5.5, {"b": {"c": None}}]
+    assert body.reads < 5
+
+
+def test_read_json_elements_not_found():
+    body = io.BytesIO(b'{"x": {"items": [1, 2, 3]}}')
+    result = list(read_json_elements(body, ["y"]))
+    assert result == []
+
+
+@pytest.mark.parametrize("selector, expect", [
+    ("$[*]", ((), None, None, ())),
+    ("$[*].a", ((), None, None, ("a",))),
+    ("$.samples[2:10].reads.r1", (("samples", ), 2, 10, ("reads", "r1"))),
+    ("$.samples[:3]", (("samples", ), None, 3, ())),
+    ("$[*].qc[0]", ((), None, None, None)),
+    ("$[?(@.a > 1)]", None),
+    ("$..name", None),
+    ("$[-2:]", None),
+    ("$.samples", None),
+])
+def test_compile_selector(selector, expect):
+    result = compile_selector(selector)
+    if expect is None:
+        assert result is None
+    else:
+        assert result[:4] == expect
+
+
+def test_compile_selector_cached():
+    assert compile_selector("$[*].x") is compile_selector("$[*].x")
+
+
 """
 Tests: file_select.read_json(body)
 This converts a file with a JSON-like structure into JSON format
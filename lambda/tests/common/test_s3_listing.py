@@ -0,0 +1,168 @@
+import csv
+import fnmatch
+import gzip
+import io
+import json
+from urllib.parse import quote_plus
+
+import boto3
+import moto
+import pytest
+
+from ...src.common.python import s3_listing
+from ...src.common.python.s3_listing import expand_inventory, parallel_glob, LISTING_WORKERS
+from ...src.common.python.repo_utils import S3File
+
+TEST_BUCKET = "test-bucket"
+INVENTORY_BUCKET = "inventory-bucket"
+KEYS = [
+    "data/sample!.txt",
+    "data/sample-.txt",
+    "data/sample-",
+    "data/sample0.txt",
+    "data/sample1.txt",
+    "data/sample9.bam",
+    "data/sampleA.txt",
+    "data/sample_x.txt",
+    "data/samplez",
+    "data/samplez.txt",
+    "data/sample~.txt",
+    "data/sampleé.txt",
+    "data/sample with space.txt",
+    "data/other.txt",
+    "nested/a/one.txt",
+    "nested/a/deeper/two.txt",
+    "nested/b/one.txt",
+    "nested/c/one.bam",
+    "nested/top.txt",
+]
+
+
+def _inventory_report(rows) -> bytes:
+    text = io.StringIO()
+    csv.writer(text, quoting=csv.QUOTE_ALL).writerows(rows)
+    return gzip.compress(text.getvalue().encode("utf-8"))
+
+
+@pytest.fixture(scope="module")
+def bucket():
+    with moto.mock_aws():
+        s3 = boto3.resource("s3", region_name="us-east-1")
+        yld = s3.Bucket(TEST_BUCKET)
+        yld.create()
+        for key in KEYS:
+            yld.put_object(Key=key, Body=b"")
+
+        inventory = s3.Bucket(INVENTORY_BUCKET)
+        inventory.create()
+        inventory.put_object(Key="inv/data/1.csv.gz",
+                             Body=_inventory_report([[TEST_BUCKET, quote_plus(k), "true", "false"] for k in KEYS[:10]]))
+        inventory.put_object(Key="inv/data/2.csv.gz",
+                             Body=_inventory_report([[TEST_BUCKET, quote_plus(k), "true", "false"] for k in KEYS[10:]] +
+                                                    [[TEST_BUCKET, "old/version.txt", "false", "false"],
+                                                     [TEST_BUCKET, "deleted.txt", "true", "true"]]))
+        manifest = {
+            "sourceBucket": TEST_BUCKET,
+            "destinationBucket": f"arn:aws:s3:::{INVENTORY_BUCKET}",
+            "version": "2016-11-30",
+            "fileFormat": "CSV",
+            "fileSchema": "Bucket, Key, IsLatest, IsDeleteMarker",
+            "files": [
+                {"key": "inv/data/1.csv.gz", "size": 1, "MD5checksum": "x"},
+                {"key": "inv/data/2.csv.gz", "size": 1, "MD5checksum": "x"},
+            ],
+        }
+        inventory.put_object(Key="inv/manifest.json", Body=json.dumps(manifest).encode("utf-8"))
+        yield yld
+
+
+def test_expand_inventory(bucket):
+    result = list(expand_inventory(S3File(INVENTORY_BUCKET, "inv/manifest.json")))
+    assert result == [S3File(TEST_BUCKET, k) for k in KEYS]
+
+
+def test_expand_inventory_glob(bucket):
+    result = list(expand_inventory(S3File(INVENTORY_BUCKET, "inv/manifest.json"), "*.bam"))
+    assert result == [S3File(TEST_BUCKET, "data/sample9.bam"), S3File(TEST_BUCKET, "nested/c/one.bam")]
+
+
+def test_expand_inventory_unsupported(bucket):
+    manifest = {"destinationBucket": f"arn:aws:s3:::{INVENTORY_BUCKET}", "fileFormat": "ORC",
+                "fileSchema": "bucket, key", "files": [{"key": "inv/data/1.orc"}]}
+    boto3.client("s3").put_object(Bucket=INVENTORY_BUCKET, Key="orc/manifest.json",
+                                  Body=json.dumps(manifest).encode("utf-8"))
+    with pytest.raises(RuntimeError, match="unsupported inventory report format"):
+        list(expand_inventory(S3File(INVENTORY_BUCKET, "orc/manifest.json")))
+
+
+@pytest.mark.parametrize("glob", [
+    "data/sample*",
+    "data/sample*.txt",
+    "data/*",
+    "data/samplez",
+    "nested/*/one.txt",
+    "nested/*/*.txt",
+    "nested/?/one.*",
+    "*",
+    "nothing*",
+])
+def test_parallel_glob(bucket, glob):
+    result = list(parallel_glob(S3File(TEST_BUCKET, glob)))
+    expect = [S3File(TEST_BUCKET, k)
+              for k in sorted(KEYS, key=lambda k: k.encode("utf-8"))
+              if fnmatch.fnmatchcase(k, glob)]
+    assert len(expect) > 0 or glob == "nothing*"
+    assert result == expect
+
+
+def test_parallel_glob_skips_archive_indexes(bucket):
+    s3 = boto3.client("s3")
+    s3.put_object(Bucket=INVENTORY_BUCKET, Key="archived/outdir", Body=b"archive")
+    s3.put_object(Bucket=INVENTORY_BUCKET, Key="archived/_archive_index_/outdir.json", Body=b"{}")
+    result = list(parallel_glob(S3File(INVENTORY_BUCKET, "archived/*")))
+    assert result == [S3File(INVENTORY_BUCKET, "archived/outdir")]
+
+
+def test_parallel_glob_many_partitions(bucket, monkeypatch):
+    # more partitions than workers, so results have to come back in submission order
+    monkeypatch.setattr(f"{parallel_glob.__module__}.LISTING_WORKERS", 2)
+    result = list(parallel_glob(S3File(TEST_BUCKET, "data/sample*")))
+    expect = [S3File(TEST_BUCKET, k)
+              for k in sorted(KEYS, key=lambda k: k.encode("utf-8"))
+              if k.startswith("data/sample")]
+    assert LISTING_WORKERS > 2
+    assert result == expect
+
+
+@pytest.mark.parametrize("glob, split", [
+    ("data/S*.bam", True),
+    ("data/*/x.txt", False),  # one partition per subdirectory already
+])
+def test_parallel_glob_skewed(bucket, monkeypatch, glob, split):
+    # every key shares its first character after the prefix, so the first-level partitions don't help
+    skewed = boto3.resource("s3").Bucket("skewed-bucket")
+    skewed.create()
+    keys = [f"data/S{i:04}.bam" for i in range(300)] + [f"data/S{i:04}/x.txt" for i in range(0, 300, 7)]
+    for key in keys:
+        skewed.put_object(Key=key, Body=b"")
+
+    monkeypatch.setattr(s3_listing, "PAGE_SIZE", 10)
+    monkeypatch.setattr(s3_listing, "PAGES_AHEAD", 1)
+    monkeypatch.setattr(s3_listing, "LISTING_WORKERS", 4)
+    splits = []
+    orig_split = s3_listing._Partition.split
+
+    def _split(self, last_seen):
+        ret = orig_split(self, last_seen)
+        splits.append((self.depth, len(ret)))
+        return ret
+
+    monkeypatch.setattr(s3_listing._Partition, "split", _split)
+
+    result = list(parallel_glob(S3File("skewed-bucket", glob)))
+    expect = [S3File("skewed-bucket", k) for k in sorted(keys) if fnmatch.fnmatchcase(k, glob)]
+    assert result == expect
+    assert any(depth > 0 and n > 1 for depth, n in splits) == split
+
+    skewed.objects.all().delete()
+    skewed.delete()
@@ -19,7 +19,6 @@ def compiler_env():
         "LOGGING_DESTINATION_ARN": "logging_destination_arn",
         "RESOURCE_BUCKET_NAME": "resource_bucket_name",
         "RUNNER_REPO_URI": "runner_repo_uri",
-        "SCATTER_INIT_LAMBDA_ARN": "scatter_init_lambda_arn",
         "SCATTER_LAMBDA_ARN": "scatter_lambda_arn",
         "SOURCE_VERSION": "1234567",
         "SPOT_GPU_QUEUE_ARN": "spot_gpu_queue_arn",
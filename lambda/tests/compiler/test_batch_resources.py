@@ -1,3 +1,4 @@
+import io
 import json
 import textwrap
 
@@ -8,10 +9,17 @@ import yaml
 
 from ...src.compiler.pkg.batch_resources import (expand_image_uri, get_job_queue, get_memory_in_mibs,
     get_skip_behavior, get_environment, get_resource_requirements, get_volume_info, get_timeout, handle_qc_check,
-    get_consumable_resource_properties, get_output_uris, batch_step, job_definition_rc, handle_batch, SCRATCH_PATH)
+    get_consumable_resource_properties, get_container_limits, get_output_uris, get_ecs_properties, get_runner_command,
+    batch_step, job_definition_rc, handle_batch, image_entrypoint, SCRATCH_PATH, NATIVE_USER_COMMAND)
 from ...src.compiler.pkg.util import Step, Resource, State
 
 
+@pytest.fixture(autouse=True)
+def no_entrypoint(monkeypatch):
+    # keep native mode tests from looking images up in ECR
+    monkeypatch.setattr("lambda.src.compiler.pkg.batch_resources.image_entrypoint", lambda _: None)
+
+
 # Docker image tag format:
 #   https://docs.docker.com/engine/reference/commandline/tag/#description
 @pytest.mark.parametrize("uri, expected", [
@@ -152,6 +160,13 @@ def test_get_volume_info(step_efs_specs):
                       "ReadOnly": False,}
 
 
+def test_get_volume_info_native():
+    step = Step("test_step", {"filesystems": [{"efs_id": "fs-12345", "host_path": "/efs1", "root_dir": "/"}]}, "next_step")
+    result = get_volume_info(step, native=True)
+    assert [v["Name"] for v in result["Volumes"]] == ["scratch", "fs-12345-volume"]
+    assert [mp["ContainerPath"] for mp in result["MountPoints"]] == [SCRATCH_PATH, "/efs1"]
+
+
 @pytest.mark.parametrize("timeout, expect", [
     (None, None),
     ("10 s", 60),
@@ -199,6 +214,22 @@ def test_get_consumable_resource_properties(spec, expect):
     assert result == expect
 
 
+@pytest.mark.parametrize("spec, expect", [
+    ({"cpus": 4}, {}),
+    ({"cpus": 4, "hard_cpu_limit": False, "cpuset": None, "numa_nodes": None, "shm_size": None, "ulimits": {}}, {}),
+    ({"cpus": 4, "hard_cpu_limit": True}, {"nano_cpus": 4000000000}),
+    ({"cpus": 4, "cpuset": "0-3", "numa_nodes": "0"}, {"cpuset_cpus": "0-3", "cpuset_mems": "0"}),
+    ({"cpus": 4, "shm_size": "2 Gb"}, {"shm_size": "2048m"}),
+    ({"cpus": 4, "shm_size": 512}, {"shm_size": "512m"}),
+    ({"cpus": 4, "ulimits": {"nofile": 65536, "memlock": {"soft": -1, "hard": -1}}},
+     {"ulimits": [{"name": "nofile", "soft": 65536, "hard": 65536},
+                  {"name": "memlock", "soft": -1, "hard": -1}]}),
+])
+def test_get_container_limits(spec, expect):
+    result = get_container_limits(spec)
+    assert result == expect
+
+
 @pytest.fixture(scope="function")
 def sample_batch_step():
     ret = yaml.safe_load(textwrap.dedent("""
@@ -215,10 +246,15 @@ def sample_batch_step():
              --adapter_fasta ${adapter}
              --length_required 25
              --json ${trim_log}
+          checkpoint:
+            files: [outt/*]
+            signal: SIGUSR1
           compute:
             cpus: 4
             memory: 4 Gb
+            shm_size: 1 Gb
             spot: true
+            transfer_engine: ranged
             type: memory
             gpu: 2
             shell: bash
@@ -322,17 +358,23 @@ def test_job_definition_rc(sample_batch_step, compiler_env):
             "shell": "sh",
             "skip": "sss",
             "s3tags": json.dumps(s3_tags, separators=(",", ":")),
+            "limits": json.dumps({"shm_size": "1024m"}, separators=(",", ":")),
+            "checkpoint": json.dumps({"files": ["outt/*"], "signal": "SIGUSR1"}, separators=(",", ":")),
+            "engine": "ranged",
         },
         "ContainerProperties": {
             "Image": "runner_repo_uri:1234567",
             "Command": [
                 "python", "/bclaw_runner/src/runner_cli.py",
                 "-c", "Ref::command",
+                "-e", "Ref::engine",
                 "-f", "Ref::references",
                 "-i", "Ref::inputs",
                 "-k", "Ref::skip",
+                "-l", "Ref::limits",
                 "-m", "Ref::image",
                 "-o", "Ref::outputs",
+                "-p", "Ref::checkpoint",
                 "-q", "Ref::qc",
                 "-r", "Ref::repo",
                 "-s", "Ref::shell",
@@ -415,6 +457,122 @@ def test_job_definition_rc(sample_batch_step, compiler_env):
         assert resource.spec == expected_rc_spec
 
 
+def test_get_ecs_properties(sample_batch_step, compiler_env):
+    sample_batch_step["compute"]["native"] = True
+    sample_batch_step["compute"]["ulimits"] = {"nofile": 4096}
+    sample_batch_step["image"] = {"name": "docker.io/library/ubuntu:22.04", "auth": ""}
+    step = Step("skim3-fastp", sample_batch_step, "next_step")
+
+    result = get_ecs_properties(step, "arn:task:role")
+    task_props = result["EcsProperties"]["TaskProperties"][0]
+    assert task_props["TaskRoleArn"] == "arn:task:role"
+    assert [v["Name"] for v in task_props["Volumes"]] == ["scratch", "fs-12345-volume"]
+
+    stage_in, user, stage_out = task_props["Containers"]
+
+    assert stage_in["Name"] == "stage_in"
+    assert stage_in["Image"] == "runner_repo_uri:1234567"
+    assert stage_in["Command"] == get_runner_command() + ["-n", "stage-in"]
+    assert stage_in["Essential"] is False
+    assert stage_in["DependsOn"] == []
+    assert stage_in["MountPoints"] == [{"SourceVolume": "scratch", "ContainerPath": SCRATCH_PATH, "ReadOnly": False}]
+
+    assert user["Name"] == "user_commands"
+    assert user["Image"] == {"Fn::Sub": "docker.io/library/ubuntu:22.04"}
+    assert user["Command"] == ["sh", "-c", NATIVE_USER_COMMAND]
+    assert user["Essential"] is False
+    assert user["DependsOn"] == [{"ContainerName": "stage_in", "Condition": "SUCCESS"}]
+    assert user["ResourceRequirements"] == [
+        {"Type": "VCPU", "Value": "4"},
+        {"Type": "MEMORY", "Value": "4096"},
+        {"Type": "GPU", "Value": "2"},
+    ]
+    assert user["LinuxParameters"] == {"SharedMemorySize": 1024}
+    assert user["Ulimits"] == [{"Name": "nofile", "SoftLimit": 4096, "HardLimit": 4096}]
+    assert len(user["MountPoints"]) == 2
+
+    assert stage_out["Name"] == "stage_out"
+    assert stage_out["Command"] == get_runner_command() + ["-n", "stage-out"]
+    assert stage_out["Essential"] is True
+    assert stage_out["DependsOn"] == [{"ContainerName": "user_commands", "Condition": "COMPLETE"}]
+
+
+@pytest.mark.parametrize("image", [
+    {"name": "my_image:${job.version}", "auth": ""},
+    {"name": "third.party.repo/my_image", "auth": "my_secret"},
+])
+def test_get_ecs_properties_unsupported_image(image, sample_batch_step, compiler_env):
+    sample_batch_step["image"] = image
+    step = Step("skim3-fastp", sample_batch_step, "next_step")
+    with pytest.raises(RuntimeError, match="not supported in native mode"):
+        get_ecs_properties(step, "arn:task:role")
+
+
+def test_get_ecs_properties_entrypoint(sample_batch_step, compiler_env, monkeypatch):
+    monkeypatch.setattr("lambda.src.compiler.pkg.batch_resources.image_entrypoint", lambda _: ["/usr/bin/tool"])
+    sample_batch_step["compute"]["native"] = True
+    sample_batch_step["image"] = {"name": "my/tool:1.0", "auth": ""}
+    step = Step("skim3-fastp", sample_batch_step, "next_step")
+    with pytest.raises(RuntimeError, match="images with an ENTRYPOINT are not supported in native mode"):
+        get_ecs_properties(step, "arn:task:role")
+
+
+@pytest.mark.parametrize("image_name, entrypoint, expect_repo, expect_id, expect", [
+    ("my/image:1.0", ["/usr/bin/tool"], "my/image", {"imageTag": "1.0"}, ["/usr/bin/tool"]),
+    ("my/image", None, "my/image", {"imageTag": "latest"}, None),
+    ("my/image", [], "my/image", {"imageTag": "latest"}, None),
+    ("123456789012.dkr.ecr.us-west-2.amazonaws.com/image@sha256:abc123", ["x"],
+     "image", {"imageDigest": "sha256:abc123"}, ["x"]),
+])
+def test_image_entrypoint(image_name, entrypoint, expect_repo, expect_id, expect, mocker):
+    ecr = mocker.MagicMock()
+    ecr.batch_get_image.return_value = {"images": [{"imageManifest": json.dumps({"config": {"digest": "sha256:cfg"}})}]}
+    ecr.get_download_url_for_layer.return_value = {"downloadUrl": "https://config.url"}
+    client = mocker.patch("lambda.src.compiler.pkg.batch_resources.boto3.client", return_value=ecr)
+    config = {"config": {} if entrypoint is None else {"Entrypoint": entrypoint}}
+    mocker.patch("lambda.src.compiler.pkg.batch_resources.urllib.request.urlopen",
+                 return_value=io.BytesIO(json.dumps(config).encode("utf-8")))
+
+    result = image_entrypoint(image_name)
+    assert result == expect
+    assert ecr.batch_get_image.call_args.kwargs["repositoryName"] == expect_repo
+    assert ecr.batch_get_image.call_args.kwargs["imageIds"] == [expect_id]
+    if image_name.startswith("1234"):
+        client.assert_called_once_with("ecr", region_name="us-west-2")
+        assert ecr.batch_get_image.call_args.kwargs["registryId"] == "123456789012"
+
+
+@pytest.mark.parametrize("image_name", [
+    "docker.io/library/ubuntu:22.04",
+    "my/image:${tag}",
+])
+def test_image_entrypoint_not_checked(image_name, mocker):
+    client = mocker.patch("lambda.src.compiler.pkg.batch_resources.boto3.client")
+    assert image_entrypoint(image_name) is None
+    client.assert_not_called()
+
+
+def test_image_entrypoint_error(mocker):
+    ecr = mocker.MagicMock()
+    ecr.batch_get_image.side_effect = RuntimeError("ImageNotFoundException")
+    mocker.patch("lambda.src.compiler.pkg.batch_resources.boto3.client", return_value=ecr)
+    assert image_entrypoint("my/image") is None
+
+
+def test_job_definition_rc_native(sample_batch_step, compiler_env):
+    sample_batch_step["compute"]["native"] = True
+    sample_batch_step["image"] = {"name": "docker.io/library/ubuntu", "auth": ""}
+    step = Step("skim3-fastp", sample_batch_step, "next_step")
+
+    def helper():
+        _ = yield from job_definition_rc(step, "arn:task:role", "sh", {}, {})
+
+    for resource in helper():
+        assert "EcsProperties" in resource.spec["Properties"]
+        assert "ContainerProperties" not in resource.spec["Properties"]
+        assert resource.spec["Properties"]["Type"] == "container"
+
+
 @pytest.mark.parametrize("spec, expect", [
     ({}, "none"),
     ({"skip_if_output_exists": True}, "output"),
@@ -533,6 +691,18 @@ def test_batch_step(next_step_name, next_or_end, sample_batch_step, scattered, j
     assert result == expected_body
 
 
+def test_batch_step_native(sample_batch_step, compiler_env):
+    sample_batch_step["compute"]["native"] = True
+    step = Step("step_name", sample_batch_step, "next_step")
+    result = batch_step(step, "TestJobDef", False)
+
+    assert "ContainerOverrides" not in result["Parameters"]
+    containers = result["Parameters"]["EcsPropertiesOverride"]["TaskProperties"][0]["Containers"]
+    assert [c["Name"] for c in containers] == ["stage_in", "user_commands", "stage_out"]
+    for container in containers:
+        assert {"Name": "BC_BRANCH_IDX", "Value.$": "$.index"} in container["Environment"]
+
+
 @pytest.mark.parametrize("options", [
     {"no_task_role": "", "s3_tags": {}, "job_tags": {}},
     {"task_role": "arn:from:workflow:params", "s3_tags": {}, "job_tags": {}}
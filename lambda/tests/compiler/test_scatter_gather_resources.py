@@ -4,8 +4,9 @@ import textwrap
 import pytest
 import yaml
 
-from ...src.compiler.pkg.scatter_gather_resources import (scatter_step, error_tolerance, map_step, scatter_init_step,
-                                                          gather_step, handle_scatter_gather)
+from ...src.compiler.pkg.scatter_gather_resources import (batch_spec, rerun_markers, scatter_step, error_tolerance, map_step,
+                                                          shard_size, shard_concurrency, shard_map_step, gather_step,
+                                                          handle_scatter_gather)
 from ...src.compiler.pkg.util import Step, lambda_retry
 
 
@@ -60,6 +61,95 @@ def test_error_tolerance(spec, expect):
     assert result == expect
 
 
+@pytest.mark.parametrize("spec, expect", [
+    ({"max_items": 10}, {"max_items": 10, "max_size": None}),
+    ({"max_size": 1000}, {"max_items": None, "max_size": 1000}),
+    ({"max_size": "2 GB"}, {"max_items": None, "max_size": 2 * 1024 ** 3}),
+    ({"max_items": 5, "max_size": "10 MiB"}, {"max_items": 5, "max_size": 10 * 1024 ** 2}),
+])
+def test_batch_spec(spec, expect):
+    result = batch_spec(spec)
+    assert result == expect
+
+
+def test_scatter_step_zip(compiler_env):
+    spec = {
+        "scatter": {"r1": "*_R1.fq", "r2": "*_R2.fq"},
+        "scatter_mode": "zip",
+        "inputs": {},
+        "outputs": {},
+    }
+    test_step = Step("test_step", spec, "unused")
+    result = scatter_step(test_step, "map_step_name")
+    assert result["Parameters"]["scatter_mode"] == "zip"
+
+
+def test_scatter_step_filter(compiler_env):
+    spec = {
+        "scatter": {"stuff": "test*.txt"},
+        "filter": "stuff.size > 0",
+        "inputs": {},
+        "outputs": {},
+    }
+    test_step = Step("test_step", spec, "unused")
+    result = scatter_step(test_step, "map_step_name")
+    assert result["Parameters"]["filter"] == "stuff.size > 0"
+
+
+def test_scatter_step_batch(compiler_env):
+    spec = {
+        "scatter": {"stuff": "test*.txt"},
+        "inputs": {},
+        "outputs": {},
+        "batch": {"max_items": 100, "max_size": "1 KiB"},
+    }
+    test_step = Step("test_step", spec, "unused")
+    result = scatter_step(test_step, "map_step_name")
+    assert json.loads(result["Parameters"]["batch"]) == {"max_items": 100, "max_size": 1024}
+
+
+@pytest.mark.parametrize("skip_on_rerun", [True, False])
+def test_scatter_step_redrive(skip_on_rerun, compiler_env):
+    spec = {
+        "scatter": {"stuff": "test*.txt"},
+        "inputs": {},
+        "outputs": {},
+        "skip_on_rerun": skip_on_rerun,
+    }
+    test_step = Step("test_step", spec, "unused")
+    result = scatter_step(test_step, "map_step_name")
+    if skip_on_rerun:
+        assert result["Parameters"]["redrive"] is True
+    else:
+        assert "redrive" not in result["Parameters"]
+
+
+@pytest.mark.parametrize("steps, expect", [
+    ([{"a": {"commands": ["x"], "skip_on_rerun": True}}, {"b": {"commands": ["y"], "skip_on_rerun": True}}],
+     ["a", "b"]),
+    ([{"a": {"commands": ["x"], "skip_on_rerun": True}}, {"b": {"commands": ["y"]}}], []),
+    ([{"a": {"commands": ["x"], "skip_on_rerun": True}}, {"b": {"commands": ["y"], "skip_on_rerun": False}}], []),
+    ([{"a": {"commands": ["x"], "skip_if_output_exists": True}}], []),
+    ([{"a": {"commands": ["x"], "skip_on_rerun": True}}, {"b": {"Type": "Pass"}}], []),
+    ([], []),
+])
+def test_rerun_markers(steps, expect):
+    result = rerun_markers(steps)
+    assert result == expect
+
+
+def test_scatter_step_rerun_markers(compiler_env):
+    spec = {
+        "scatter": {"stuff": "test*.txt"},
+        "inputs": {},
+        "outputs": {},
+        "steps": [{"Child": {"commands": ["x"], "skip_on_rerun": True}}],
+    }
+    test_step = Step("test_step", spec, "unused")
+    result = scatter_step(test_step, "map_step_name")
+    assert json.loads(result["Parameters"]["rerun_markers"]) == ["Child"]
+
+
 @pytest.mark.parametrize("err_tol, expect_err_tol", [
     (88, {"ToleratedFailureCount": 88}),
     ("77%", {"ToleratedFailurePercentage": 77}),
@@ -96,11 +186,15 @@ def test_map_step(err_tol, expect_err_tol):
             },
         },
         "ItemSelector": {
-            "index.$": "States.Format('{}', $$.Map.Item.Index)",
+            "index.$": "$$.Map.Item.Value._index",
             "job_file.$": "$.job_file",
             "prev_outputs": {},
             "scatter.$": "$$.Map.Item.Value",
-            "repo.$": "$.scatter.repo",
+            "repo": {
+                "bucket.$": "$.scatter.repo.bucket",
+                "prefix.$": "States.Format('{}/{}', $.scatter.repo.prefix, $$.Map.Item.Value._branch)",
+                "uri.$": "States.Format('{}/{}', $.scatter.repo.uri, $$.Map.Item.Value._branch)",
+            },
             "share_id.$": "$.share_id",
         },
         "ItemProcessor": {
@@ -113,36 +207,15 @@ def test_map_step(err_tol, expect_err_tol):
                 {"fake": "branch"},
             ],
         },
-        "ResultPath": None,
-        "Next": "gather_step_name",
-    }
-    assert result == expect
-
-
-def test_scatter_init_step(compiler_env):
-    result = scatter_init_step("parent_step_name")
-    expect = {
-        "parent_step_name.initialize": {
-            "Type": "Task",
-            "Resource": "scatter_init_lambda_arn",
+        "ResultWriter": {
+            "Resource": "arn:aws:states:::s3:putObject",
             "Parameters": {
-                "index.$": "$.index",
-                "repo.$": "$.repo",
-                "scatter.$": "$.scatter",
-                "logging": {
-                    "branch.$": "$.index",
-                    "job_file_bucket.$": "$.job_file.bucket",
-                    "job_file_key.$": "$.job_file.key",
-                    "job_file_version.$": "$.job_file.version",
-                    "sfn_execution_id.$": "$$.Execution.Name",
-                    "step_name": "parent_step_name.initialize",
-                    "workflow_name": "${WorkflowName}",
-                },
+                "Bucket.$": "$.scatter.repo.bucket",
+                "Prefix.$": "States.Format('{}/_results_', $.scatter.repo.prefix)",
             },
-            **lambda_retry(max_attempts=10),
-            "ResultPath": "$.repo",
-            "_stet": True
-        }
+        },
+        "ResultPath": None,
+        "Next": "gather_step_name",
     }
     assert result == expect
 
@@ -165,6 +238,7 @@ def test_gather_step(next_step_name, next_or_end, compiler_env):
         "Resource": "gather_lambda_arn",
         "Parameters": {
             "repo.$": "$.repo.uri",
+            "scatter.$": "$.scatter",
             "outputs": json.dumps(spec["outputs"]),
             "step_name": "test_step",
             "logging": {
@@ -246,11 +320,22 @@ def test_handle_scatter_gather(sample_scatter_step, compiler_env):
         step = Step("step_name", sample_scatter_step, "next_step_name")
         states = yield from handle_scatter_gather(step, options, 0)
 
-        assert len(states) == 3
+        assert len(states) == 5
 
         assert states[0].name == "step_name"
         assert states[1].name == "step_name.map"
         assert states[2].name == "step_name.gather"
+        assert states[3].name == "step_name.failures"
+        assert states[4].name == "step_name.failed"
+
+        assert states[1].spec["Catch"] == [
+            {"ErrorEquals": ["States.ALL"], "ResultPath": "$.map_error", "Next": "step_name.failures"},
+        ]
+        assert states[3].spec["Resource"] == "gather_lambda_arn"
+        assert states[3].spec["Parameters"]["failed"] is True
+        assert states[3].spec["Parameters"]["scatter.$"] == "$.scatter"
+        assert states[3].spec["Next"] == "step_name.failed"
+        assert states[4].spec == {"Type": "Fail", "ErrorPath": "$.map_error.Error", "CausePath": "$.map_error.Cause"}
 
         inputs0 = json.loads(states[0].spec["Parameters"]["inputs"])
         assert inputs0["input1"] == "infile1.txt"
@@ -263,19 +348,13 @@ def test_handle_scatter_gather(sample_scatter_step, compiler_env):
         outputs1 = json.loads(states[1].spec["ItemProcessor"]["States"]["Step1"]["Parameters"]["Parameters"]["outputs"])
         assert outputs1["output3"] == {"name": "2_outfile3.txt", "s3_tags": {"s3_tag3": "file_s3_value3", "s3_tag4": "file_s3_value4"}}
 
-        assert len(states[1].spec["ItemProcessor"]["States"]) == 2
-        assert set(states[1].spec["ItemProcessor"]["States"]) == {"step_name.initialize", "Step1"}
-        assert states[1].spec["ItemProcessor"]["StartAt"] == "step_name.initialize"
+        assert set(states[1].spec["ItemProcessor"]["States"]) == {"Step1"}
+        assert states[1].spec["ItemProcessor"]["StartAt"] == "Step1"
 
-        substep1 = states[1].spec["ItemProcessor"]["States"]["step_name.initialize"]
+        substep1 = states[1].spec["ItemProcessor"]["States"]["Step1"]
         assert substep1["Type"] == "Task"
-        assert substep1["Resource"] == "scatter_init_lambda_arn"
-        assert substep1["Next"] == "Step1"
-
-        substep2 = states[1].spec["ItemProcessor"]["States"]["Step1"]
-        assert substep2["Type"] == "Task"
-        assert substep2["Resource"] == "arn:aws:states:::batch:submitJob.sync"
-        assert substep2["End"] is True
+        assert substep1["Resource"] == "arn:aws:states:::batch:submitJob.sync"
+        assert substep1["End"] is True
 
         outputs2 = json.loads(states[2].spec["Parameters"]["outputs"])
         assert outputs2["output1"] == "outfile1.txt"
@@ -298,11 +377,139 @@ def test_handle_scatter_gather(sample_scatter_step, compiler_env):
     assert cmd[0] == "ls -l ${scatter.stuff} > ${output3}"
 
 
-def test_handle_scatter_gather_too_deep():
+def test_handle_scatter_gather_nested(sample_scatter_step, compiler_env):
+    outer_spec = {
+        "scatter": {"sample": "${job.samples}"},
+        "inputs": {},
+        "steps": [{"Inner": sample_scatter_step}],
+        "outputs": {},
+        "max_concurrency": 0,
+        "error_tolerance": 0,
+    }
+
     def helper():
-        fake_step = Step("fake", {"fake": ""}, "fake_next_step")
-        with pytest.raises(RuntimeError, match=r"Nested Scatter steps are not supported"):
-            _ = yield from handle_scatter_gather(fake_step, {"wf": "params"}, 1)
+        options = {"wf": "params", "s3_tags": {}, "job_tags": {}}
+        step = Step("Outer", outer_spec, "")
+        states = yield from handle_scatter_gather(step, options, 0)
+
+        assert [s.name for s in states] == ["Outer", "Outer.map", "Outer.gather", "Outer.failures", "Outer.failed"]
+        assert states[1].spec["ItemSelector"]["index.$"] == "$$.Map.Item.Value._index"
+
+        inner_states = states[1].spec["ItemProcessor"]["States"]
+        assert set(inner_states) == {"Inner", "Inner.map", "Inner.gather", "Inner.failures", "Inner.failed"}
+        assert inner_states["Inner"]["Parameters"]["repo.$"] == "$.repo"
+        assert inner_states["Inner.map"]["ItemSelector"]["index.$"] == \
+               "States.Format('{}-{}', $.index, $$.Map.Item.Value._index)"
+        assert inner_states["Inner.gather"]["End"] is True
+
+        step1 = inner_states["Inner.map"]["ItemProcessor"]["States"]["Step1"]
+        assert step1["Resource"] == "arn:aws:states:::batch:submitJob.sync"
+
+    _ = list(helper())
+
+
+@pytest.mark.parametrize("max_concurrency, expect_size, expect_concurrency", [
+    (0, None, 0),
+    (10000, None, 1),
+    (10001, 5000, 2),
+    (15000, 7500, 2),
+    (25000, 8333, 3),
+    (50000, 10000, 5),
+])
+def test_shard_size(max_concurrency, expect_size, expect_concurrency):
+    step = Step("step", {"max_concurrency": max_concurrency}, "")
+    assert shard_size(step) == expect_size
+    assert shard_concurrency(step) == expect_concurrency
+    if expect_size is not None:
+        # the shards running at once never exceed max_concurrency, or a single Map's limit
+        assert expect_size * expect_concurrency <= max_concurrency
+        assert expect_size <= 10000
+
+
+def test_scatter_step_sharded(compiler_env):
+    spec = {
+        "scatter": {"stuff": "test*.txt"},
+        "inputs": {},
+        "outputs": {},
+        "max_concurrency": 25000,
+    }
+    test_step = Step("test_step", spec, "unused")
+    result = scatter_step(test_step, "map_step_name")
+    assert result["Parameters"]["shard_size"] == 8333
+
+
+def test_shard_map_step():
+    step = Step("test-step", {"max_concurrency": 25000, "error_tolerance": "5%"}, "unused")
+    sub_branch = {"StartAt": "fake", "States": {"fake": {"End": True}}}
+
+    result = shard_map_step(step, sub_branch, "gather_step_name")
+
+    assert result["MaxConcurrency"] == 3
+    assert result["ToleratedFailureCount"] == 0
+    assert result["Label"] == "teststepshards"
+    assert result["ItemReader"]["Parameters"] == {
+        "Bucket.$": "$.scatter.shards.bucket",
+        "Key.$": "$.scatter.shards.key",
+    }
+    assert result["ItemSelector"]["scatter"] == {
+        "items": {
+            "bucket.$": "$.scatter.shards.bucket",
+            "key.$": "$$.Map.Item.Value.items",
+        },
+        "repo.$": "$.scatter.repo",
+    }
+    assert result["Next"] == "gather_step_name"
+
+    assert result["ItemProcessor"]["StartAt"] == "test-step.shard"
+    inner = result["ItemProcessor"]["States"]["test-step.shard"]
+    expect_inner = map_step(step, sub_branch, "unused")
+    del expect_inner["Next"]
+    assert inner == {**expect_inner, "MaxConcurrency": 8333, "End": True}
+    assert inner["ToleratedFailurePercentage"] == 5
+
+
+@pytest.mark.parametrize("max_concurrency, expect", [
+    (5000, 5000),
+    (25000, 10000),
+])
+def test_map_step_concurrency_limit(max_concurrency, expect):
+    step = Step("test-step", {"max_concurrency": max_concurrency, "error_tolerance": 0}, "unused")
+    sub_branch = {"StartAt": "fake", "States": {"fake": {"End": True}}}
+    result = map_step(step, sub_branch, "gather_step_name")
+    assert result["MaxConcurrency"] == expect
+
+
+@pytest.mark.parametrize("max_concurrency, error_tolerance, expect", [
+    (25000, 3, 3),
+    (25000, "5%", None),
+    (5000, 3, None),
+])
+def test_gather_step_tolerated_failures(max_concurrency, error_tolerance, expect, compiler_env):
+    # count tolerances of sharded scatters are checked against the total by the gather lambda
+    step = Step("test-step", {"max_concurrency": max_concurrency, "error_tolerance": error_tolerance,
+                              "outputs": {}}, "next_step")
+    result = gather_step(step)
+    assert result["Parameters"].get("tolerated_failures") == expect
+
+
+def test_handle_scatter_gather_sharded(sample_scatter_step, compiler_env):
+    spec = {**sample_scatter_step, "max_concurrency": 20000}
+
+    def helper():
+        options = {"wf": "params", "s3_tags": {}, "job_tags": {}}
+        step = Step("step_name", spec, "next_step_name")
+        states = yield from handle_scatter_gather(step, options, 0)
+
+        assert [s.name for s in states] == ["step_name", "step_name.map", "step_name.gather", "step_name.failures",
+                                            "step_name.failed"]
+        assert states[0].spec["Parameters"]["shard_size"] == 10000
+        assert states[1].spec["MaxConcurrency"] == 2
+        assert states[1].spec["Catch"][0]["Next"] == "step_name.failures"
+        assert states[1].spec["ItemProcessor"]["StartAt"] == "step_name.shard"
+        inner = states[1].spec["ItemProcessor"]["States"]["step_name.shard"]
+        assert set(inner["ItemProcessor"]["States"]) == {"Step1"}
+        assert "Catch" not in inner
+        assert "ResultWriter" in inner
 
     _ = list(helper())
 
@@ -4,7 +4,8 @@ import pytest
 from voluptuous import Invalid
 
 from ...src.compiler.pkg.validation import (no_shared_keys, shorthand_image_spec, shorthand_output_spec,
-                                            file_list)
+                                            file_list, input_file_spec, s3_path_or_url, python_expression,
+                                            batch_step_schema)
 
 
 @pytest.fixture(scope="module")
@@ -90,17 +91,35 @@ ospec4 = dedent("""\
     file4*
 """)
 
+ospec5 = dedent("""\
+    file5 -> s3://bucket/yada/
+        +upload: stream
+        +tag5: value5
+        +compress: zstd
+""")
+
 @pytest.mark.parametrize("ospec, expect", [
     (ospec1, {"name": "file1", "dest": "s3://bucket/yada/yada/", "s3_tags": {"tag1": "value1", "tag2": "value2"}}),
     (ospec2, {"name": "${job.file2}", "dest": "s3://bucket/${job.yadayada}/", "s3_tags": {}}),
     (ospec3, {"name": "dirname/file3", "s3_tags": {"tag3": "colon:and+plus", "tag4": "value4 with spaces"}}),
     (ospec4, {"name": "file4*", "s3_tags": {}}),
+    (ospec5, {"name": "file5", "dest": "s3://bucket/yada/", "upload": "stream", "compress": "zstd",
+              "s3_tags": {"tag5": "value5"}}),
 ])
 def test_shorthand_output_spec(ospec, expect):
     result = shorthand_output_spec(ospec)
     assert result == expect
 
 
+@pytest.mark.parametrize("badspec, msg", [
+    ("file1 +upload: sometime", "invalid upload option: 'sometime'"),
+    ("file1 +compress: lzma", "invalid compress option: 'lzma'"),
+])
+def test_shorthand_output_spec_bad_option(badspec, msg):
+    with pytest.raises(Invalid, match=msg):
+        shorthand_output_spec(badspec)
+
+
 @pytest.mark.parametrize("ospec, expect", [
     (ospec1, {"name": "file1", "dest": "s3://bucket/yada/yada/", "s3_tags": {"tag1": "value1", "tag2": "value2"}}),
     (ospec2, {"name": "${job.file2}", "dest": "s3://bucket/${job.yadayada}/", "s3_tags": {}}),
@@ -136,6 +155,46 @@ def test_shorthand_output_spec_bad_tag(badspec):
         shorthand_output_spec(badspec)
 
 
+@pytest.mark.parametrize("ispec", [
+    "file1",
+    "file1 +range: 0-1023",
+    "file1 +range: 1024-",
+    "file1 +range: -1024",
+    "file1 +range: ${job.header_range}",
+    "file1.csv +select: SELECT s.gene FROM S3Object s WHERE s.chrom = 'chr1'",
+    "file1.bam +access: lazy",
+])
+def test_input_file_spec(ispec):
+    assert input_file_spec(ispec) == ispec
+
+
+@pytest.mark.parametrize("badspec, msg", [
+    ("file1 +range: 10", "invalid byte range: '10'"),
+    ("file1 +range: a-b", "invalid byte range: 'a-b'"),
+    ("file1 +offset: 10", "invalid input option: 'offset'"),
+    ("file1 +access: eager", "invalid access option: 'eager'"),
+    ("file1 +range: 0-10 +select: SELECT * FROM S3Object", "only one of"),
+])
+def test_input_file_spec_bad_option(badspec, msg):
+    with pytest.raises(Invalid, match=msg):
+        input_file_spec(badspec)
+
+
+@pytest.mark.parametrize("path, ok", [
+    ("s3://bucket/ref.fa", True),
+    ("https://ftp.ensembl.org/pub/ref.fa.gz", True),
+    ("http://example.com/ref.fa", True),
+    ("ftp://example.com/ref.fa", False),
+    ("ref.fa", False),
+])
+def test_s3_path_or_url(path, ok):
+    if ok:
+        assert s3_path_or_url(path) == path
+    else:
+        with pytest.raises(Invalid, match="must be an S3 path"):
+            s3_path_or_url(path)
+
+
 def test_file_list_dict():
     tester = file_list({str: str})
 
@@ -180,3 +239,53 @@ def test_file_list_empty():
     result = tester(spec)
     expect = {}
     assert result == expect
+
+
+@pytest.mark.parametrize("expr", [
+    "reads.size > 1000",
+    "reads.tags.get('status') != 'done' and sample.startswith('S')",
+    "reads.last_modified > now - timedelta(days=1)",
+])
+def test_python_expression(expr):
+    assert python_expression(expr) == expr
+
+
+@pytest.mark.parametrize("expr", [
+    "reads.size >",
+    "x = 1",
+    "import os",
+])
+def test_python_expression_fail(expr):
+    with pytest.raises(Invalid, match="invalid expression"):
+        python_expression(expr)
+
+
+@pytest.mark.parametrize("sig, ok", [
+    ("SIGUSR1", True),
+    ("SIGTERM", True),
+    ("SIGFOO", False),
+    ("SIG_DFL", False),
+])
+def test_checkpoint_signal(sig, ok):
+    spec = {"image": "test-image", "commands": ["ls"], "checkpoint": {"signal": sig}}
+    if ok:
+        result = batch_step_schema(spec)
+        assert result["checkpoint"]["signal"] == sig
+    else:
+        with pytest.raises(Invalid, match="checkpoint signal must be a signal name"):
+            batch_step_schema(spec)
+
+
+@pytest.mark.parametrize("compute, msg", [
+    ({"native": True, "shm_size": "1 Gb", "ulimits": {"nofile": 1024}}, None),
+    ({"native": False, "hard_cpu_limit": True, "cpuset": "0-3"}, None),
+    ({"native": True, "hard_cpu_limit": True}, "hard_cpu_limit not supported in native mode"),
+    ({"native": True, "cpuset": "0-3", "numa_nodes": "0"}, "cpuset, numa_nodes not supported in native mode"),
+])
+def test_native_compatible(compute, msg):
+    spec = {"image": "test-image", "commands": ["ls"], "compute": compute}
+    if msg is None:
+        batch_step_schema(spec)
+    else:
+        with pytest.raises(Invalid, match=msg):
+            batch_step_schema(spec)
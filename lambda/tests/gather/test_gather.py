@@ -6,7 +6,7 @@ import boto3
 import moto
 import pytest
 
-from ...src.gather.gather import lambda_handler
+from ...src.gather.gather import lambda_handler, record_failures, TooManyFailures
 
 logging.basicConfig(level=logging.INFO)
 
@@ -14,6 +14,12 @@ TEST_BUCKET = "test-bucket"
 JOB_DATA = {"job": {"job": "data"}, "parent": {}, "scatter": {}}
 
 
+@pytest.fixture(autouse=True)
+def no_chunked_uploads(monkeypatch):
+    # moto doesn't decode the aws-chunked bodies newer botocores send with multipart uploads
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+
+
 @pytest.fixture(scope="module")
 def repo_bucket():
     with moto.mock_aws():
@@ -34,6 +40,13 @@ def repo_bucket():
         yld.put_object(Key="repo/path/test-step/00002/output2", Body=b"00002.output2")
         yld.put_object(Key="repo/path/test-step/00002/unoutput", Body=b"00002.unoutput")
 
+        for i in ["00000", "00001"]:
+            yld.put_object(Key=f"repo/path/archive-step/{i}/outdir", Body=b"archive")
+            yld.put_object(Key=f"repo/path/archive-step/{i}/_archive_index_/outdir.json",
+                           Body=json.dumps({"format": "tar", "codec": None,
+                                            "members": [{"name": "x.txt", "offset": 512, "size": 1},
+                                                        {"name": "y.txt", "offset": 1536, "size": 1}]}).encode("utf-8"))
+
         yield yld
 
 
@@ -79,6 +92,38 @@ def test_lambda_handler(caplog, repo_bucket):
     assert "no files named output3 found" in caplog.text
 
 
+def test_lambda_handler_archives(repo_bucket):
+    event = {
+        "repo": f"s3://{repo_bucket.name}/repo/path",
+        "outputs": json.dumps({"dir": "outdir", "index": "outdir.json"}),
+        "step_name": "archive-step",
+        "logging": {
+            "step_name": "archive-step",
+        },
+    }
+
+    result = lambda_handler(event, {})
+    response = repo_bucket.Object(f"repo/path/{result['manifest']}").get()
+    with closing(response["Body"]) as fp:
+        manifest = json.load(fp)
+
+    expect = {
+        "dir": [
+            f"s3://{repo_bucket.name}/repo/path/archive-step/00000/outdir",
+            f"s3://{repo_bucket.name}/repo/path/archive-step/00001/outdir",
+        ],
+        "dir#members": [
+            f"s3://{repo_bucket.name}/repo/path/archive-step/00000/outdir#x.txt",
+            f"s3://{repo_bucket.name}/repo/path/archive-step/00000/outdir#y.txt",
+            f"s3://{repo_bucket.name}/repo/path/archive-step/00001/outdir#x.txt",
+            f"s3://{repo_bucket.name}/repo/path/archive-step/00001/outdir#y.txt",
+        ],
+        # archive indexes aren't outputs
+        "index": [],
+    }
+    assert manifest == expect
+
+
 def test_lambda_handler_no_manifest(caplog, repo_bucket):
     event = {
         "repo": f"s3://{repo_bucket.name}/repo/path",
@@ -91,3 +136,197 @@ def test_lambda_handler_no_manifest(caplog, repo_bucket):
 
     result = lambda_handler(event, {})
     assert result == {}
+
+
+def test_lambda_handler_many_branches(repo_bucket):
+    # branch names get longer past 99999; the manifest still lists the files in branch order
+    for branch in ["99998", "100000", "99999", "100001", "1000000"]:
+        repo_bucket.put_object(Key=f"repo/path/big-step/{branch}/output1", Body=b"")
+
+    event = {
+        "repo": f"s3://{repo_bucket.name}/repo/path",
+        "outputs": json.dumps({"out1": "output1"}),
+        "step_name": "big-step",
+        "logging": {
+            "step_name": "big-step",
+        },
+    }
+    result = lambda_handler(event, {})
+
+    manifest = json.loads(repo_bucket.Object(f"repo/path/{result['manifest']}").get()["Body"].read())
+    assert manifest == {
+        "out1": [f"s3://{repo_bucket.name}/repo/path/big-step/{b}/output1"
+                 for b in ["99998", "99999", "100000", "100001", "1000000"]],
+    }
+
+
+def _results(bucket, prefix: str, run_id: str, succeeded: list, failed: list = ()) -> None:
+    # what a Map state's ResultWriter leaves behind
+    result_files = {"FAILED": [], "PENDING": [], "SUCCEEDED": []}
+    for status, branches in [("SUCCEEDED", succeeded), ("FAILED", failed)]:
+        if branches:
+            executions = [{"Input": json.dumps({"index": b, "scatter": {"x": "?", "_branch": b}}), "Status": status}
+                          for b in branches]
+            key = f"{prefix}/_results_/{run_id}/{status}_0.json"
+            bucket.put_object(Key=key, Body=json.dumps(executions).encode("utf-8"))
+            result_files[status].append({"Key": key, "Size": 1})
+    manifest = {
+        "DestinationBucket": bucket.name,
+        "MapRunArn": f"arn:aws:states:us-east-1:123456789012:mapRun:sm/label:{run_id}",
+        "ResultFiles": result_files,
+    }
+    bucket.put_object(Key=f"{prefix}/_results_/{run_id}/manifest.json", Body=json.dumps(manifest).encode("utf-8"))
+
+
+def _read_failed(bucket, prefix: str):
+    obj = bucket.Object(f"{prefix}/failed.csv").get()
+    rows = obj["Body"].read().decode("utf-8").splitlines()
+    return rows, obj["Metadata"]
+
+
+def test_record_failures(repo_bucket):
+    prefix = "repo/path/failing-step"
+    repo_bucket.put_object(Key=f"{prefix}/items.csv",
+                           Body=b'"x","_branch"\n"a","00000"\n"b","00001"\n"c","00002"\n"d","00003"\n')
+    # branch 1 failed and branch 3 never started
+    _results(repo_bucket, prefix, "run1", ["00000", "00002"], ["00001"])
+
+    scatter = {
+        "items": {"bucket": repo_bucket.name, "key": f"{prefix}/items.csv"},
+        "repo": {"bucket": repo_bucket.name, "prefix": prefix, "uri": f"s3://{repo_bucket.name}/{prefix}"},
+        "signature": "abc123",
+    }
+    result = record_failures(scatter, map_failed=True)
+    assert result == 2
+
+    rows, metadata = _read_failed(repo_bucket, prefix)
+    assert rows == ['"x","_branch"', '"b","00001"', '"d","00003"']
+    assert metadata == {"scatter-signature": "abc123"}
+
+
+def test_record_failures_tolerated(repo_bucket):
+    # the Map state succeeded within its error tolerance, so only the failed executions are read
+    prefix = "repo/path/tolerant-step"
+    repo_bucket.put_object(Key=f"{prefix}/items.csv",
+                           Body=b'"x","_branch"\n"a","00000"\n"b","00001"\n"c","00002"\n')
+    _results(repo_bucket, prefix, "run1", [], ["00001"])
+
+    scatter = {
+        "items": {"bucket": repo_bucket.name, "key": f"{prefix}/items.csv"},
+        "repo": {"bucket": repo_bucket.name, "prefix": prefix, "uri": f"s3://{repo_bucket.name}/{prefix}"},
+        "signature": "abc123",
+    }
+    result = record_failures(scatter)
+    assert result == 1
+
+    rows, metadata = _read_failed(repo_bucket, prefix)
+    assert rows == ['"x","_branch"', '"b","00001"']
+    assert metadata == {"scatter-signature": "abc123"}
+
+
+def test_record_failures_none(repo_bucket):
+    prefix = "repo/path/perfect-step"
+    repo_bucket.put_object(Key=f"{prefix}/failed.csv", Body=b'"x","_branch"\n"b","00001"\n')
+    repo_bucket.put_object(Key=f"{prefix}/items.csv", Body=b'"x","_branch"\n"a","00000"\n"b","00001"\n')
+    _results(repo_bucket, prefix, "run1", ["00000", "00001"])
+
+    scatter = {
+        "items": {"bucket": repo_bucket.name, "key": f"{prefix}/items.csv"},
+        "repo": {"bucket": repo_bucket.name, "prefix": prefix, "uri": f"s3://{repo_bucket.name}/{prefix}"},
+        "signature": "abc123",
+    }
+    result = record_failures(scatter)
+    assert result == 0
+
+    # the failures left over from the last run are gone, so a rerun starts from scratch
+    keys = [o.key for o in repo_bucket.objects.filter(Prefix=prefix)]
+    assert f"{prefix}/failed.csv" not in keys
+
+
+def test_record_failures_sharded(repo_bucket):
+    prefix = "repo/path/sharded-step"
+    repo_bucket.put_object(Key=f"{prefix}/items/00000.csv", Body=b'"x","_branch"\n"a","00000"\n"b","00001"\n')
+    repo_bucket.put_object(Key=f"{prefix}/items/00001.csv", Body=b'"x","_branch"\n"c","00002"\n')
+    repo_bucket.put_object(Key=f"{prefix}/shards.csv",
+                           Body=f'"items"\n"{prefix}/items/00000.csv"\n"{prefix}/items/00001.csv"\n'.encode("utf-8"))
+    _results(repo_bucket, prefix, "shard0", ["00000"])
+    _results(repo_bucket, prefix, "shard1", ["00002"])
+
+    scatter = {
+        "shards": {"bucket": repo_bucket.name, "key": f"{prefix}/shards.csv"},
+        "repo": {"bucket": repo_bucket.name, "prefix": prefix, "uri": f"s3://{repo_bucket.name}/{prefix}"},
+        "signature": "def456",
+    }
+    result = record_failures(scatter, map_failed=True)
+    assert result == 1
+
+    rows, metadata = _read_failed(repo_bucket, prefix)
+    assert rows == ['"x","_branch"', '"b","00001"']
+    assert metadata == {"scatter-signature": "def456"}
+
+
+def test_lambda_handler_failed(repo_bucket):
+    prefix = "repo/path/failed-step"
+    repo_bucket.put_object(Key=f"{prefix}/items.csv", Body=b'"x","_branch"\n"a","00000"\n"b","00001"\n')
+    repo_bucket.put_object(Key=f"{prefix}/00000/output1", Body=b"")
+    _results(repo_bucket, prefix, "run1", ["00000"])
+
+    event = {
+        "repo": f"s3://{repo_bucket.name}/repo/path",
+        "scatter": {
+            "items": {"bucket": repo_bucket.name, "key": f"{prefix}/items.csv"},
+            "repo": {"bucket": repo_bucket.name, "prefix": prefix, "uri": f"s3://{repo_bucket.name}/{prefix}"},
+        },
+        "outputs": "{}",
+        "failed": True,
+        "step_name": "failed-step",
+        "logging": {
+            "step_name": "failed-step",
+        },
+    }
+    result = lambda_handler(event, {})
+    assert result == {}
+
+    rows, _ = _read_failed(repo_bucket, prefix)
+    assert rows == ['"x","_branch"', '"b","00001"']
+    assert "failed-step_manifest.json" not in [o.key.rsplit("/", 1)[-1] for o in repo_bucket.objects.all()]
+
+
+@pytest.mark.parametrize("tolerated, ok", [
+    (2, True),
+    (1, False),
+])
+def test_lambda_handler_tolerated_failures(repo_bucket, tolerated, ok):
+    # each shard failed one branch, within its own tolerance of 1, but together they failed two
+    prefix = f"repo/path/sharded-tolerant-step-{tolerated}"
+    repo_bucket.put_object(Key=f"{prefix}/items/00000.csv", Body=b'"x","_branch"\n"a","00000"\n"b","00001"\n')
+    repo_bucket.put_object(Key=f"{prefix}/items/00001.csv", Body=b'"x","_branch"\n"c","00002"\n"d","00003"\n')
+    repo_bucket.put_object(Key=f"{prefix}/shards.csv",
+                           Body=f'"items"\n"{prefix}/items/00000.csv"\n"{prefix}/items/00001.csv"\n'.encode("utf-8"))
+    _results(repo_bucket, prefix, "shard0", ["00000"], ["00001"])
+    _results(repo_bucket, prefix, "shard1", ["00002"], ["00003"])
+
+    event = {
+        "repo": f"s3://{repo_bucket.name}/repo/path",
+        "scatter": {
+            "shards": {"bucket": repo_bucket.name, "key": f"{prefix}/shards.csv"},
+            "repo": {"bucket": repo_bucket.name, "prefix": prefix, "uri": f"s3://{repo_bucket.name}/{prefix}"},
+        },
+        "outputs": "{}",
+        "tolerated_failures": tolerated,
+        "step_name": f"sharded-tolerant-step-{tolerated}",
+        "logging": {
+            "step_name": f"sharded-tolerant-step-{tolerated}",
+        },
+    }
+
+    if ok:
+        result = lambda_handler(event, {})
+        assert result == {}
+    else:
+        with pytest.raises(TooManyFailures, match="2 branches failed, more than the 1 tolerated"):
+            lambda_handler(event, {})
+
+    # either way, the failures are recorded for a redrive
+    rows, _ = _read_failed(repo_bucket, prefix)
+    assert rows == ['"x","_branch"', '"b","00001"', '"d","00003"']
@@ -1,5 +1,7 @@
 from contextlib import closing
 import csv
+import hashlib
+import itertools
 import json
 import re
 
@@ -8,7 +10,11 @@ import moto
 import pytest
 
 from ...src.scatter.scatter import (get_job_data, expand_glob, expand_scatter_data, scatterator,
-                                    write_job_data_template, lambda_handler)
+                                    write_job_data_template, write_items, batcherator, completed_branches,
+                                    redrive_items, scatter_hasher, signed,
+                                    filterator,
+                                    MultipartWriter,
+                                    lambda_handler)
 # https://stackoverflow.com/a/46709888
 from repo_utils import Repo, S3File
 
@@ -28,6 +34,12 @@ OTHER_FILE_CONTENT = json.dumps({"x": {"a": 1, "b": 2},
                                  "y": {"a": 3, "b": 4}})
 
 
+@pytest.fixture(autouse=True)
+def no_chunked_uploads(monkeypatch):
+    # moto doesn't decode the aws-chunked bodies newer botocores send with multipart uploads
+    monkeypatch.setenv("AWS_REQUEST_CHECKSUM_CALCULATION", "when_required")
+
+
 @pytest.fixture(scope="module")
 def repo_bucket():
     with moto.mock_aws():
@@ -39,6 +51,11 @@ def repo_bucket():
         yld.put_object(Key="repo/path/file3", Body=FILE3_CONTENT.encode("utf-8"))
         yld.put_object(Key="repo/path/other_file.json", Body=OTHER_FILE_CONTENT.encode("utf-8"))
         yld.put_object(Key="repo/path/_control_/test_step.complete", Body=b"")
+        yld.put_object(Key="repo/path/outdir", Body=b"archive")
+        yld.put_object(Key="repo/path/_archive_index_/outdir.json",
+                       Body=json.dumps({"format": "tar", "codec": None,
+                                        "members": [{"name": "a.json", "offset": 512, "size": 1},
+                                                    {"name": "b.txt", "offset": 1536, "size": 1}]}).encode("utf-8"))
         yield yld
 
 
@@ -54,6 +71,8 @@ def test_get_job_data(repo_bucket):
     ("file[12]", ["file1", "file2"]),
     ("*file*", ["file1", "file2", "file3", "other_file.json"]),
     ("nothing*", []),
+    ("*dir*", ["outdir"]),               # not its archive index
+    ("*.json", ["other_file.json"]),
 ])
 def test_expand_glob(repo_bucket, glob, expect):
     s3_glob = S3File(repo_bucket.name, f"repo/path/{glob}")
@@ -71,11 +90,13 @@ def test_expand_scatter_data(repo_bucket):
         "job_data_list": "${job.a_list}",
         "file_contents": "@other_file.json:$[*.b]",
         "file_glob": "file*",
+        "parallel_glob": "parallel:file*",
         "single_file": "single.txt",
         "file_ref": "${job.file_ref}",
         "contents_ref1": "${job.contents_ref1}",
         "contents_ref2": "@${job.contents_ref2}",
         "glob_ref": "${job.glob_ref}",
+        "archive_members": "outdir#*.json",
     }
 
     job_data = {
@@ -92,7 +113,7 @@ def test_expand_scatter_data(repo_bucket):
         "scatter": {},
     }
 
-    result = dict(expand_scatter_data(scatter_spec, repo, job_data))
+    result = {k: list(v) for k, v in expand_scatter_data(scatter_spec, repo, job_data)}
 
     expect = {
         "static_list": [1, 2, 3],
@@ -103,6 +124,11 @@ def test_expand_scatter_data(repo_bucket):
             f"s3://{repo_bucket.name}/repo/path/file2",
             f"s3://{repo_bucket.name}/repo/path/file3",
         ],
+        "parallel_glob": [
+            f"s3://{repo_bucket.name}/repo/path/file1",
+            f"s3://{repo_bucket.name}/repo/path/file2",
+            f"s3://{repo_bucket.name}/repo/path/file3",
+        ],
         "single_file": [S3File(repo_bucket.name, "repo/path/single.txt")],
         "file_ref": [S3File(repo_bucket.name, "repo/path/referenced_file.txt")],
         "contents_ref1": ["1", "3"],
@@ -110,7 +136,10 @@ def test_expand_scatter_data(repo_bucket):
         "glob_ref": [
             f"s3://{repo_bucket.name}/repo/path/file1",
             f"s3://{repo_bucket.name}/repo/path/file3",
-        ]
+        ],
+        "archive_members": [
+            f"s3://{repo_bucket.name}/repo/path/outdir#a.json",
+        ],
     }
 
     assert result == expect
@@ -153,6 +182,127 @@ def test_scatterator():
     assert result == expect
 
 
+def test_scatterator_iterators():
+    scatter_data = {
+        "one": iter(["a", "b"]),
+        "two": iter([1, 2]),
+        "three": (x for x in "xy"),
+    }
+    expect = [dict(zip(scatter_data.keys(), p)) for p in itertools.product("ab", [1, 2], "xy")]
+
+    result = list(scatterator(scatter_data))
+    assert result == expect
+
+
+@pytest.mark.parametrize("max_items, max_size, expect", [
+    (2, None, [["a", "b"], ["c", "d"], ["e"]]),
+    (None, 10, [["a", "b"], ["c"], ["d"], ["e"]]),
+    (None, 3, [["a"], ["b"], ["c"], ["d"], ["e"]]),
+    (2, 100, [["a", "b"], ["c", "d"], ["e"]]),
+    (100, 100, [["a", "b", "c", "d", "e"]]),
+])
+def test_batcherator(max_items, max_size, expect):
+    sizes = {"a": 4, "b": 5, "c": 8, "d": 20, "e": 1}
+    items = ({"file": S3File("bucket", k, sizes[k]), "other": k.upper()} for k in "abcde")
+
+    result = list(batcherator(items, max_items=max_items, max_size=max_size))
+    assert [[f.key for f in b["file"]] for b in result] == expect
+    assert [b["other"] for b in result] == [[k.upper() for k in e] for e in expect]
+
+
+def test_batcherator_unsized():
+    # values without a size count as zero bytes
+    items = ({"x": str(i)} for i in range(5))
+    result = list(batcherator(items, max_size=1))
+    assert result == [{"x": ["0", "1", "2", "3", "4"]}]
+
+
+def test_scatterator_zip():
+    scatter_data = {
+        "r1": iter(["a_R1", "b_R1", "c_R1"]),
+        "r2": iter(["a_R2", "b_R2", "c_R2"]),
+        "n": [1, 2, 3],
+    }
+    result = list(scatterator(scatter_data, "zip"))
+    assert result == [
+        {"r1": "a_R1", "r2": "a_R2", "n": 1},
+        {"r1": "b_R1", "r2": "b_R2", "n": 2},
+        {"r1": "c_R1", "r2": "c_R2", "n": 3},
+    ]
+
+
+def test_scatterator_zip_length_mismatch():
+    scatter_data = {
+        "r1": ["a_R1", "b_R1", "c_R1"],
+        "r2": ["a_R2", "b_R2"],
+    }
+    with pytest.raises(RuntimeError, match="r2 ran out of values after 2"):
+        list(scatterator(scatter_data, "zip"))
+
+
+@pytest.mark.parametrize("expression, expect", [
+    ("True", ["file1", "file2", "file3", "other_file.json"]),
+    ("f.size > 8", ["file3", "other_file.json"]),
+    ("f.name.endswith('.json') or n == 2", ["file2", "other_file.json"]),
+    ("f.tags.get('status') != 'done'", ["file1", "file3", "other_file.json"]),
+    ("f.metadata.get('flavor') == 'lime'", ["file3"]),
+    ("f.last_modified > now - timedelta(days=1)", ["file1", "file2", "file3", "other_file.json"]),
+    ("n in job.wanted", ["file1", "file3"]),
+])
+def test_filterator(repo_bucket, monkeypatch, expression, expect):
+    monkeypatch.setattr(f"{filterator.__module__}.MAX_PENDING_WRITES", 2)
+    s3 = boto3.client("s3")
+    s3.put_object_tagging(Bucket=repo_bucket.name, Key="repo/path/file2",
+                          Tagging={"TagSet": [{"Key": "status", "Value": "done"}]})
+    s3.copy_object(Bucket=repo_bucket.name, Key="repo/path/file3",
+                   CopySource={"Bucket": repo_bucket.name, "Key": "repo/path/file3"},
+                   Metadata={"flavor": "lime"}, MetadataDirective="REPLACE")
+
+    files = sorted(expand_glob(S3File(repo_bucket.name, "repo/path/*file*")))
+    items = ({"f": f, "n": n} for n, f in enumerate(files, start=1))
+    job_data = {"job": {"wanted": [1, 3]}, "parent": {}, "scatter": {}}
+
+    result = list(filterator(items, expression, job_data))
+    assert [r["f"].key.rsplit("/", 1)[-1] for r in result] == expect
+    assert all(isinstance(r["f"], S3File) for r in result)
+
+
+def test_filterator_metadata_lookup(repo_bucket):
+    # sizes of files that didn't come from a listing are looked up
+    items = [{"f": S3File(repo_bucket.name, "repo/path/file1")}, {"f": S3File(repo_bucket.name, "repo/path/file3")}]
+    result = list(filterator(iter(items), "f.size == 10", JOB_DATA))
+    assert result == [{"f": S3File(repo_bucket.name, "repo/path/file3")}]
+
+
+def test_multipart_writer(repo_bucket, monkeypatch):
+    monkeypatch.setattr(moto.s3.models, "S3_UPLOAD_PART_MIN_SIZE", 10)
+    s3_file = S3File(repo_bucket.name, "repo/path/multipart.txt")
+
+    with MultipartWriter(s3_file, part_size=10, Tagging="x=y") as fp:
+        for i in range(10):
+            fp.write(f"line {i}\n")
+        assert len(fp.parts) == 5
+
+    obj = boto3.resource("s3").Object(s3_file.bucket, s3_file.key)
+    assert obj.get()["Body"].read().decode("utf-8") == "".join(f"line {i}\n" for i in range(10))
+    tagging = boto3.client("s3").get_object_tagging(Bucket=s3_file.bucket, Key=s3_file.key)
+    assert tagging["TagSet"] == [{"Key": "x", "Value": "y"}]
+
+
+def test_multipart_writer_abort(repo_bucket):
+    s3_file = S3File(repo_bucket.name, "repo/path/aborted.txt")
+
+    with pytest.raises(RuntimeError):
+        with MultipartWriter(s3_file) as fp:
+            fp.write("stuff")
+            raise RuntimeError("boom")
+
+    uploads = boto3.client("s3").list_multipart_uploads(Bucket=repo_bucket.name, Prefix=s3_file.key)
+    assert "Uploads" not in uploads
+    with pytest.raises(Exception):
+        boto3.resource("s3").Object(s3_file.bucket, s3_file.key).load()
+
+
 def test_write_job_data_template(repo_bucket):
     scatter_repo = Repo(bucket=repo_bucket.name, prefix="repo/path/Scatter")
 
@@ -161,7 +311,7 @@ def test_write_job_data_template(repo_bucket):
             "job": "data"
         },
         "scatter": {
-            "should": "be overwritten"
+            "outer": "value"
         },
         "parent": {
             "original": f"s3://{repo_bucket.name}/repo/path/file1"
@@ -189,11 +339,14 @@ def test_write_job_data_template(repo_bucket):
     with closing(response["Body"]) as fp:
         template = json.load(fp)
 
+    # a nested scatter passes on the enclosing branch's scatter values
     expected_template = {
         "job": {
             "job": "data",
         },
-        "scatter": {},
+        "scatter": {
+            "outer": "value"
+        },
         "parent": {
             "original": f"s3://{repo_bucket.name}/repo/path/file1",
             "additional": f"s3://{repo_bucket.name}/repo/path/file2",
@@ -204,6 +357,238 @@ def test_write_job_data_template(repo_bucket):
     assert template == expected_template
 
 
+def test_write_items(repo_bucket):
+    scatter_repo = Repo(bucket=repo_bucket.name, prefix="repo/path/WriteItems")
+    template = {
+        "job": {"job": "data"},
+        "scatter": {},
+        "parent": {"input": "s3://bucket/input.txt"},
+    }
+    scatter_data = {
+        "letter": ["a", "b"],
+        "number": [1, 2, 3],
+    }
+
+    result = write_items(template, ["letter", "number"], scatterator(scatter_data), scatter_repo)
+    assert result == f"s3://{repo_bucket.name}/repo/path/WriteItems/items.csv"
+
+    response = boto3.resource("s3").Object(result.bucket, result.key).get()
+    items = list(csv.DictReader(response["Body"].read().decode("utf-8").splitlines(True)))
+    assert len(items) == 6
+
+    for i, (item, combo) in enumerate(zip(items, scatterator(scatter_data))):
+        assert item["_branch"] == f"{i:05}"
+        assert item["_index"] == str(i)
+        assert item["letter"] == combo["letter"]
+        assert item["number"] == str(combo["number"])
+
+        job_data_obj = boto3.resource("s3").Object(repo_bucket.name, f"repo/path/WriteItems/{i:05}/_JOB_DATA_")
+        response = job_data_obj.get()
+        with closing(response["Body"]) as fp:
+            job_data = json.load(fp)
+        assert job_data == {**template, "scatter": combo}
+
+        tagging = boto3.client("s3").get_object_tagging(Bucket=repo_bucket.name, Key=job_data_obj.key)
+        assert tagging["TagSet"] == [{"Key": "bclaw.system", "Value": "true"}]
+
+
+def test_write_items_batched(repo_bucket):
+    scatter_repo = Repo(bucket=repo_bucket.name, prefix="repo/path/WriteBatches")
+    template = {"job": {}, "scatter": {}, "parent": {}}
+    items = batcherator(scatterator({"number": iter(range(5))}), max_items=2)
+
+    result = write_items(template, ["number"], items, scatter_repo)
+
+    response = boto3.resource("s3").Object(result.bucket, result.key).get()
+    items = list(csv.DictReader(response["Body"].read().decode("utf-8").splitlines(True)))
+    assert items == [
+        {"number": "[0, 1]", "_branch": "00000", "_index": "0"},
+        {"number": "[2, 3]", "_branch": "00001", "_index": "1"},
+        {"number": "[4]", "_branch": "00002", "_index": "2"},
+    ]
+
+    job_data_obj = boto3.resource("s3").Object(repo_bucket.name, "repo/path/WriteBatches/00001/_JOB_DATA_")
+    job_data = json.loads(job_data_obj.get()["Body"].read())
+    assert job_data["scatter"] == {"number": [2, 3]}
+
+
+def test_write_items_sharded(repo_bucket):
+    scatter_repo = Repo(bucket=repo_bucket.name, prefix="repo/path/WriteShards")
+    template = {"job": {}, "scatter": {}, "parent": {}}
+
+    result = write_items(template, ["x"], scatterator({"x": iter("abcdefg")}), scatter_repo, shard_size=3)
+    assert result == f"s3://{repo_bucket.name}/repo/path/WriteShards/shards.csv"
+
+    def read_csv(key: str) -> list:
+        response = boto3.resource("s3").Object(repo_bucket.name, key).get()
+        return list(csv.DictReader(response["Body"].read().decode("utf-8").splitlines(True)))
+
+    shards = read_csv(result.key)
+    assert shards == [
+        {"items": "repo/path/WriteShards/items/00000.csv"},
+        {"items": "repo/path/WriteShards/items/00001.csv"},
+        {"items": "repo/path/WriteShards/items/00002.csv"},
+    ]
+
+    items = [read_csv(shard["items"]) for shard in shards]
+    assert items == [
+        [{"x": "a", "_branch": "00000", "_index": "0"},
+         {"x": "b", "_branch": "00001", "_index": "1"},
+         {"x": "c", "_branch": "00002", "_index": "2"}],
+        [{"x": "d", "_branch": "00003", "_index": "3"},
+         {"x": "e", "_branch": "00004", "_index": "4"},
+         {"x": "f", "_branch": "00005", "_index": "5"}],
+        [{"x": "g", "_branch": "00006", "_index": "6"}],
+    ]
+
+    job_data_obj = boto3.resource("s3").Object(repo_bucket.name, "repo/path/WriteShards/00006/_JOB_DATA_")
+    job_data = json.loads(job_data_obj.get()["Body"].read())
+    assert job_data["scatter"] == {"x": "g"}
+
+
+def test_write_items_nested(repo_bucket):
+    # in a nested scatter, the inner branches keep the outer branch's scatter values
+    scatter_repo = Repo(bucket=repo_bucket.name, prefix="repo/path/Outer/00003/Inner")
+    template = {"job": {}, "scatter": {"sample": "s3", "x": "outer"}, "parent": {}}
+
+    write_items(template, ["x"], scatterator({"x": ["a", "b"]}), scatter_repo)
+
+    job_data_obj = boto3.resource("s3").Object(repo_bucket.name, "repo/path/Outer/00003/Inner/00001/_JOB_DATA_")
+    job_data = json.loads(job_data_obj.get()["Body"].read())
+    assert job_data["scatter"] == {"sample": "s3", "x": "b"}
+
+
+def test_skip_completed_branches(repo_bucket):
+    scatter_repo = Repo(bucket=repo_bucket.name, prefix="repo/path/Rerun")
+    template = {"job": {}, "scatter": {}, "parent": {}}
+
+    write_items(template, ["x"], scatterator({"x": iter("abcde")}), scatter_repo)
+
+    # branches 1 and 3 finished both steps, branch 4 only finished one
+    for branch, step in [("00001", "One"), ("00001", "Two"), ("00003", "One"), ("00003", "Two"), ("00004", "One")]:
+        repo_bucket.put_object(Key=f"repo/path/Rerun/{branch}/_control_/{step}.complete", Body=b"")
+    repo_bucket.put_object(Key="repo/path/Rerun/00001/output.txt", Body=b"output")
+
+    completed = completed_branches(scatter_repo, ["One", "Two"])
+    assert set(completed) == {"00001", "00003"}
+
+    # branch 3 gets a different scatter value on the rerun, so it has to run again
+    result = write_items(template, ["x"], scatterator({"x": iter("abcXe")}), scatter_repo, completed=completed)
+
+    response = boto3.resource("s3").Object(result.bucket, result.key).get()
+    items = list(csv.DictReader(response["Body"].read().decode("utf-8").splitlines(True)))
+    assert items == [
+        {"x": "a", "_branch": "00000", "_index": "0"},
+        {"x": "c", "_branch": "00002", "_index": "2"},
+        {"x": "X", "_branch": "00003", "_index": "3"},
+        {"x": "e", "_branch": "00004", "_index": "4"},
+    ]
+
+
+def _signature(template: dict, event: dict, items: list) -> str:
+    hasher = scatter_hasher(template, event)
+    assert list(signed(iter(items), hasher)) == items
+    return hasher.hexdigest()
+
+
+def test_signed():
+    template = {"job": {"a": 1}, "scatter": {}, "parent": {}}
+    event = {"scatter": json.dumps({"x": "*.txt"}), "step_name": "ignored"}
+    items = [{"x": "s3://bucket/a.txt"}, {"x": "s3://bucket/b.txt"}]
+    result = _signature(template, event, items)
+    assert result == _signature(template, {**event, "step_name": "different", "shard_size": 10}, items)
+    assert result != _signature({**template, "job": {"a": 2}}, event, items)
+    assert result != _signature(template, {**event, "filter": "x.size > 0"}, items)
+    assert result != _signature(template, event, items + [{"x": "s3://bucket/c.txt"}])
+    assert result != _signature(template, event, items[:1])
+
+
+def _signed_items(items: list, hasher=None):
+    hasher = hasher or hashlib.md5()
+    return signed(iter(items), hasher), hasher
+
+
+@pytest.mark.parametrize("shard_size", [None, 1])
+def test_redrive_items(repo_bucket, shard_size):
+    scatter_repo = Repo(bucket=repo_bucket.name, prefix=f"repo/path/Redrive{shard_size}")
+    current = [{"x": "a"}, {"x": "b"}, {"x": "c"}, {"x": "d"}]
+    signature = _signature({}, {}, current)
+    repo_bucket.put_object(Key=f"{scatter_repo.prefix}/failed.csv",
+                           Body=b'"x","_branch","_index"\n"b","00001","1"\n"d","00003","3"\n',
+                           Metadata={"scatter-signature": signature})
+
+    items, hasher = _signed_items(current, scatter_hasher({}, {}))
+    result = redrive_items(scatter_repo, items, hasher, shard_size)
+    assert hasher.hexdigest() == signature
+
+    obj = boto3.resource("s3").Object(result.bucket, result.key).get()
+    if shard_size is None:
+        assert result.key == f"{scatter_repo.prefix}/items.csv"
+        assert obj["Body"].read().decode("utf-8") == '"x","_branch","_index"\n"b","00001","1"\n"d","00003","3"\n'
+    else:
+        assert result.key == f"{scatter_repo.prefix}/shards.csv"
+        shards = list(csv.DictReader(obj["Body"].read().decode("utf-8").splitlines(True)))
+        items = [boto3.resource("s3").Object(repo_bucket.name, s["items"]).get()["Body"].read().decode("utf-8")
+                 for s in shards]
+        assert items == ['"x","_branch","_index"\n"b","00001","1"\n', '"x","_branch","_index"\n"d","00003","3"\n']
+
+
+def test_redrive_items_no_redrive(repo_bucket):
+    scatter_repo = Repo(bucket=repo_bucket.name, prefix="repo/path/NoRedrive")
+    current = [{"x": "a"}, {"x": "b"}]
+
+    # nothing recorded
+    items, hasher = _signed_items(current)
+    assert redrive_items(scatter_repo, items, hasher) is None
+
+    # recorded for a different scatter, or before the scatter data changed
+    repo_bucket.put_object(Key=f"{scatter_repo.prefix}/failed.csv", Body=b'"x","_branch"\n"b","00001"\n',
+                           Metadata={"scatter-signature": _signature({}, {}, current[:1])})
+    items, hasher = _signed_items(current, scatter_hasher({}, {}))
+    assert redrive_items(scatter_repo, items, hasher) is None
+    with pytest.raises(Exception):
+        boto3.resource("s3").Object(repo_bucket.name, f"{scatter_repo.prefix}/items.csv").load()
+
+
+def test_lambda_handler_redrive(repo_bucket):
+    event = {
+        "repo": {
+            "bucket": repo_bucket.name,
+            "prefix": "repo/path",
+            "uri": "s3://this/is/not/used"
+        },
+        "scatter": json.dumps({"letter": ["a", "b", "c"]}),
+        "inputs": "{}",
+        "outputs": "{}",
+        "step_name": "redrive_step",
+        "redrive": True,
+        "logging": {
+            "step_name": "redrive_step",
+        },
+    }
+
+    def _items(result) -> str:
+        return boto3.resource("s3").Object(repo_bucket.name, result["items"]["key"]).get()["Body"].read().decode("utf-8")
+
+    # first run: nothing to redrive, so it scatters from scratch
+    result = lambda_handler(event.copy(), {})
+    signature = result["signature"]
+    assert len(_items(result).splitlines()) == 4
+
+    # branch 1 failed, recorded by an older version without the index column
+    repo_bucket.put_object(Key="repo/path/redrive_step/failed.csv", Body=b'"letter","_branch"\n"b","00001"\n',
+                           Metadata={"scatter-signature": signature})
+    result = lambda_handler(event.copy(), {})
+    assert _items(result) == '"letter","_branch","_index"\n"b","00001","1"\n'
+    assert result["signature"] == signature
+
+    # the scatter data changed: start over
+    changed = {**event, "scatter": json.dumps({"letter": ["a", "b", "c", "d"]})}
+    result = lambda_handler(changed, {})
+    assert len(_items(result).splitlines()) == 5
+    assert result["signature"] != signature
+
+
 def test_lambda_handler(repo_bucket):
     event = {
         "repo": {
@@ -232,6 +617,7 @@ def test_lambda_handler(repo_bucket):
             "uri": f"s3://{repo_bucket.name}/repo/path/test_step",
         },
     }
+    assert len(result.pop("signature")) == 32
     assert result == expect
 
     items_obj = boto3.resource("s3").Object(result["items"]["bucket"], result["items"]["key"])
@@ -240,16 +626,48 @@ def test_lambda_handler(repo_bucket):
     records = csv.reader(lines)
 
     header = next(records)
-    assert header == ["scatter_files", "list"]
+    assert header == ["scatter_files", "list", "_branch", "_index"]
 
-    for record in records:
+    for i, record in enumerate(records):
         assert re.match("^s3://test-bucket/repo/path/file[123]$", record[0])
         assert record[1] in {"1", "2"}
+        assert record[2] == f"{i:05}"
 
     template_obj = boto3.resource("s3").Object(result["repo"]["bucket"], f"{result['repo']['prefix']}/_JOB_DATA_")
     template_obj.load()
 
 
+def test_lambda_handler_sharded(repo_bucket):
+    event = {
+        "repo": {
+            "bucket": repo_bucket.name,
+            "prefix": "repo/path",
+            "uri": "s3://this/is/not/used"
+        },
+        "scatter": json.dumps({"number": [1, 2, 3]}),
+        "inputs": "{}",
+        "outputs": "{}",
+        "step_name": "sharded_step",
+        "shard_size": 2,
+        "logging": {
+            "step_name": "sharded_step",
+        },
+    }
+    result = lambda_handler(event, {})
+    assert len(result.pop("signature")) == 32
+    assert result == {
+        "shards": {
+            "bucket": repo_bucket.name,
+            "key": "repo/path/sharded_step/shards.csv",
+        },
+        "repo": {
+            "bucket": repo_bucket.name,
+            "prefix": "repo/path/sharded_step",
+            "uri": f"s3://{repo_bucket.name}/repo/path/sharded_step",
+        },
+    }
+
+
 def test_lambda_handler_scatter_sub(repo_bucket):
     event = {
         "repo": {
@@ -273,7 +691,7 @@ def test_lambda_handler_scatter_sub(repo_bucket):
     records = csv.reader(lines)
 
     header = next(records)
-    assert header == ["scatter_glob"]
+    assert header == ["scatter_glob", "_branch", "_index"]
 
     for record in records:
         assert re.match("^s3://test-bucket/repo/path/file[123]$", record[0])